@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Measure the memory used per node by a MemoryFS tree.
+
+Usage:
+    python benchmarks/memoryfs_nodes.py --files 100000 --per-dir 100
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from fslib import helpers
+from fslib import stacking
+
+
+def build_tree(fs, files, per_dir, content):
+    """Create files spread over directories of per_dir entries; returns the number of nodes."""
+    nodes = 1
+    directory = None
+    for i in range(files):
+        if i % per_dir == 0:
+            directory = helpers.normpath('/dir-%d' % (i // per_dir))
+            fs.mkdir(directory)
+            nodes += 1
+        # Names repeat across directories, as in real trees
+        with fs.open_binary(directory.child('file-%d.txt' % (i % per_dir)), 'wb') as f:
+            if content:
+                f.write(content)
+        nodes += 1
+    return nodes
+
+
+def measure(files, per_dir, content, full_path_index):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    fs = stacking.MemoryFS(full_path_index=full_path_index)
+    nodes = build_tree(fs, files, per_dir, content)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return nodes, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--per-dir', type=int, default=100)
+    parser.add_argument('--content-size', type=int, default=0, help="Bytes written to each file")
+    args = parser.parse_args()
+
+    content = b'x' * args.content_size
+    for full_path_index in (True, False):
+        nodes, size, elapsed = measure(args.files, args.per_dir, content, full_path_index)
+        print("full_path_index=%-5s nodes=%d bytes/node=%.0f build=%.2fs" % (
+            full_path_index, nodes, size / nodes, elapsed,
+        ))
+
+
+if __name__ == '__main__':
+    main()
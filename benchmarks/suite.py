@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Benchmark fslib stacks, against raw os calls.
+
+Usage:
+    python benchmarks/suite.py [--quick] [--only union,mount] [--json results.json]
+    python benchmarks/suite.py --compare before.json after.json [--threshold 10]
+
+Each result is the best time of one operation, in nanoseconds. Operations
+with an os equivalent (stat, open, listdir, copy) also report their
+overhead: their time divided by the os call's time.
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import posixpath
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+import fslib
+from fslib import base
+from fslib import stacking
+
+
+ENTRIES = 100
+
+
+def best_ns(func, repeat=3):
+    """The best time of one call of func, in nanoseconds."""
+    timer = timeit.Timer(func)
+    loops, _elapsed = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=loops)) / loops * 1e9
+
+
+def best_once_ns(setup, func, repeat=3):
+    """The best time of func(setup()), for operations that can't be repeated on the same state."""
+    times = []
+    for _i in range(repeat):
+        state = setup()
+        times.append(timeit.timeit(lambda: func(state), number=1) * 1e9)
+    return min(times)
+
+
+def make_dir(root, name, entries=ENTRIES):
+    """A directory holding ``entries`` small files."""
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    for i in range(entries):
+        with open(os.path.join(path, 'file-%d' % i), 'wb') as f:
+            f.write(b'x' * 100)
+    return path
+
+
+def read_file(fs, path):
+    with fs.open(path, 'rb') as f:
+        f.read()
+
+
+class Suite:
+    def __init__(self, workdir, quick=False, full=False):
+        self.workdir = workdir
+        self.quick = quick
+        self.full = full
+        self.results = []
+        # operation => ns, for raw os calls
+        self.baselines = {}
+
+    def add(self, name, params, ns, baseline=None):
+        result = {'name': name, 'params': params, 'ns': ns}
+        if baseline is not None:
+            result['baseline'] = baseline
+            result['overhead'] = ns / self.baselines[baseline]
+        self.results.append(result)
+        print(format_result(result), flush=True)
+
+    def measure_fs(self, name, params, fs, directory, filename='file-0'):
+        """stat/open/listdir through a FileSystem, with paths relative to its root."""
+        path = posixpath.join(directory, filename)
+        self.add(name + '.stat', params, best_ns(lambda: fs.stat(path)), baseline='stat')
+        self.add(name + '.open', params, best_ns(lambda: read_file(fs, path)), baseline='open')
+        self.add(name + '.listdir', params, best_ns(lambda: fs.listdir(directory)), baseline='listdir')
+
+    # Benchmarks
+    # ----------
+
+    def bench_os(self):
+        directory = make_dir(self.workdir, 'os')
+        path = os.path.join(directory, 'file-0')
+
+        def read_os():
+            with open(path, 'rb') as f:
+                f.read()
+
+        for operation, func in [
+            ('stat', lambda: os.stat(path)),
+            ('open', read_os),
+            ('listdir', lambda: os.listdir(directory)),
+        ]:
+            self.baselines[operation] = best_ns(func)
+            self.add('os.' + operation, {}, self.baselines[operation])
+        self.measure_fs('osfs', {}, fslib.FileSystem(base.OSFS(directory)), '/')
+
+    def bench_wrapping(self):
+        directory = make_dir(self.workdir, 'wrapping')
+        for depth in (1, 2, 4, 8, 16):
+            backend = base.OSFS(directory)
+            for _i in range(depth):
+                backend = base.WrappingFS(wrapped=backend)
+            self.measure_fs('wrapping', {'depth': depth}, fslib.FileSystem(backend), '/')
+
+    def bench_union(self):
+        counts = (1, 2, 4, 8) if self.quick else (1, 2, 4, 8, 16)
+        for cache_size in (None, 1024):
+            for branches in counts:
+                union = stacking.UnionFS(cache_size=cache_size)
+                for rank in range(branches):
+                    directory = make_dir(self.workdir, 'union-%s-%d-%d' % (cache_size, branches, rank))
+                    union.add_branch(base.OSFS(directory), ref=rank, rank=rank)
+                # Files are found in the topmost branch, but listings merge all branches.
+                self.measure_fs('union', {'branches': branches, 'cache_size': cache_size},
+                                fslib.FileSystem(union), '/')
+                # A file only found in the bottom branch
+                bottom = self.workdir + '/union-%s-%d-%d/only-bottom' % (cache_size, branches, branches - 1)
+                with open(bottom, 'wb'):
+                    pass
+                fs = fslib.FileSystem(union)
+                self.add('union.stat_bottom', {'branches': branches, 'cache_size': cache_size},
+                         best_ns(lambda: fs.stat('/only-bottom')), baseline='stat')
+
+    def bench_mount(self):
+        counts = (1, 10, 100) if self.quick else (1, 10, 100, 1000)
+        for mounts in counts:
+            root = os.path.join(self.workdir, 'mount-%d' % mounts)
+            os.makedirs(root)
+            mount_fs = stacking.MountFS()
+            mount_fs.mount_fs(base.OSFS(root), '/')
+            for i in range(mounts):
+                os.makedirs(os.path.join(root, 'mnt-%d' % i))
+                directory = make_dir(root, 'data-%d' % i, entries=ENTRIES if i == mounts - 1 else 1)
+                mount_fs.mount_fs(base.OSFS(directory), '/mnt-%d' % i)
+            self.measure_fs('mount', {'mounts': mounts}, fslib.FileSystem(mount_fs), '/mnt-%d' % (mounts - 1))
+
+    def bench_memoryfs(self):
+        sizes = [10 ** 3, 10 ** 4] if self.quick else [10 ** 3, 10 ** 4, 10 ** 5]
+        if self.full:
+            sizes.append(10 ** 6)
+        for full_path_index in (True, False):
+            for nodes in sizes:
+                params = {'nodes': nodes, 'full_path_index': full_path_index}
+                memory_fs = stacking.MemoryFS(full_path_index=full_path_index)
+                fs = fslib.FileSystem(memory_fs)
+                paths = []
+                start = timeit.default_timer()
+                for i in range(nodes):
+                    if i % ENTRIES == 0:
+                        directory = '/dir-%d' % (i // ENTRIES)
+                        fs.mkdir(directory)
+                    path = '%s/file-%d' % (directory, i % ENTRIES)
+                    with fs.open(path, 'wb') as f:
+                        f.write(b'x' * 100)
+                    paths.append(path)
+                self.add('memoryfs.build', params, (timeit.default_timer() - start) / nodes * 1e9)
+
+                sample = random.Random(nodes).sample(paths, 1000)
+                self.add('memoryfs.stat', params, best_ns(lambda: [fs.stat(path) for path in sample]) / 1000,
+                         baseline='stat')
+                self.add('memoryfs.open', params, best_ns(lambda: read_file(fs, sample[0])), baseline='open')
+                self.add('memoryfs.listdir', params, best_ns(lambda: fs.listdir('/dir-0')), baseline='listdir')
+
+    def bench_copy_up(self):
+        size = (4 if self.quick else 32) * 1024 * 1024
+        lower = os.path.join(self.workdir, 'copy-up')
+        os.makedirs(lower)
+        source = os.path.join(lower, 'big')
+        with open(source, 'wb') as f:
+            f.write(os.urandom(size))
+
+        copy = os.path.join(self.workdir, 'copy-up-copy')
+        self.baselines['copy'] = best_ns(lambda: shutil.copyfile(source, copy), repeat=3)
+        self.add('os.copy', {'size': size}, self.baselines['copy'])
+
+        def make_union(copy_up):
+            union = stacking.UnionFS(copy_up=copy_up)
+            union.add_branch(base.OSFS(lower), ref='lower', rank=1)
+            upper = stacking.WhiteoutFS(stacking.MemoryWhiteoutCache(), wrapped=stacking.MemoryFS())
+            union.add_branch(upper, ref='upper', rank=0, writable=True)
+            return fslib.FileSystem(union)
+
+        def update(fs):
+            with fs.open('/big', 'r+b') as f:
+                f.write(b'changed')
+
+        for copy_up in (stacking.UnionFS.COPY_UP_FULL, stacking.UnionFS.COPY_UP_ON_CLOSE,
+                        stacking.UnionFS.COPY_UP_LAZY):
+            self.add('copy_up.update', {'size': size, 'mode': copy_up},
+                     best_once_ns(lambda: make_union(copy_up), update), baseline='copy')
+
+    def bench_whiteouts(self):
+        entries = 500 if self.quick else 5000
+
+        counter = itertools.count()
+
+        def new_path(suffix):
+            return os.path.join(self.workdir, 'whiteouts-%d%s' % (next(counter), suffix))
+
+        caches = {
+            'memory': stacking.MemoryWhiteoutCache,
+            'dbm': lambda: stacking.DBMWhiteoutCache(new_path('.dbm')),
+            'dbm-buffered': lambda: stacking.DBMWhiteoutCache(new_path('.dbm'), max_pending=1024),
+            'bloom': lambda: stacking.BloomWhiteoutCache(stacking.MemoryWhiteoutCache()),
+            'sqlite': lambda: stacking.SQLiteWhiteoutCache(new_path('.sqlite')),
+        }
+
+        # Over an OSFS, so that lookups can be compared to os calls
+        lower = make_dir(self.workdir, 'whiteouts', entries=entries)
+        listdir_baseline = 'listdir-%d' % entries
+        self.baselines[listdir_baseline] = best_ns(lambda: os.listdir(lower))
+        self.add('os.listdir', {'entries': entries}, self.baselines[listdir_baseline])
+
+        def make_union(make_cache):
+            union = stacking.UnionFS()
+            union.add_branch(base.OSFS(self.workdir), ref='lower', rank=1)
+            upper = stacking.WhiteoutFS(make_cache(), wrapped=stacking.MemoryFS())
+            union.add_branch(upper, ref='upper', rank=0, writable=True)
+            return fslib.FileSystem(union)
+
+        for name, make_cache in caches.items():
+            params = {'cache': name, 'entries': entries}
+            whiteout_fs = stacking.WhiteoutFS(make_cache(), wrapped=base.OSFS(lower))
+            fs = fslib.FileSystem(whiteout_fs)
+
+            start = timeit.default_timer()
+            for i in range(0, entries, 2):
+                fs.remove('/file-%d' % i)
+            whiteout_fs.whiteout_cache.flush()
+            self.add('whiteouts.unlink', params, (timeit.default_timer() - start) / (entries // 2) * 1e9)
+
+            self.add('whiteouts.stat_live', params, best_ns(lambda: fs.stat('/file-1')), baseline='stat')
+            self.add('whiteouts.stat_deleted', params, best_ns(lambda: fs.file_exists('/file-0')))
+            self.add('whiteouts.listdir', params, best_ns(lambda: fs.listdir('/')), baseline=listdir_baseline)
+            whiteout_fs.close()
+
+            # Whole trees, from a deeper branch: one subtree whiteout, or one per entry
+            self.add('whiteouts.union_rmtree', params, best_once_ns(
+                lambda: make_union(make_cache),
+                lambda union: union.rmtree('/whiteouts'),
+            ))
+
+    GROUPS = ('os', 'wrapping', 'union', 'mount', 'memoryfs', 'copy_up', 'whiteouts')
+
+    def run(self, groups):
+        # Baselines are needed by all others
+        self.bench_os()
+        for group in groups:
+            if group != 'os':
+                getattr(self, 'bench_' + group)()
+
+
+# Output
+# ------
+
+
+def result_key(result):
+    return (result['name'], json.dumps(result['params'], sort_keys=True))
+
+
+def format_params(params):
+    return ' '.join('%s=%s' % item for item in sorted(params.items()))
+
+
+def format_result(result):
+    overhead = ' %7.2fx os' % result['overhead'] if 'overhead' in result else ''
+    return '%-26s %-40s %14.0f ns%s' % (result['name'], format_params(result['params']), result['ns'], overhead)
+
+
+def compare(before_path, after_path, threshold):
+    """Print the changes between two runs.
+
+    Returns:
+        int, the number of results slower by more than ``threshold`` percent.
+    """
+    with open(before_path) as f:
+        before = {result_key(result): result for result in json.load(f)['results']}
+    with open(after_path) as f:
+        after = json.load(f)['results']
+
+    regressions = 0
+    for result in after:
+        previous = before.get(result_key(result))
+        if previous is None:
+            print('%-26s %-40s %14s -> %10.0f ns' % (
+                result['name'], format_params(result['params']), 'new', result['ns'],
+            ))
+            continue
+        change = (result['ns'] / previous['ns'] - 1) * 100
+        flag = ''
+        if change > threshold:
+            flag = '  SLOWER'
+            regressions += 1
+        elif change < -threshold:
+            flag = '  faster'
+        print('%-26s %-40s %11.0f ns -> %10.0f ns %+7.1f%%%s' % (
+            result['name'], format_params(result['params']), previous['ns'], result['ns'], change, flag,
+        ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help="Smaller sizes, for a quick check")
+    parser.add_argument('--full', action='store_true', help="Include MemoryFS with 10^6 nodes")
+    parser.add_argument('--only', help="Comma-separated groups, among: %s" % ', '.join(Suite.GROUPS))
+    parser.add_argument('--json', help="Write the results to this file")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="Compare two JSON results")
+    parser.add_argument('--threshold', type=float, default=10, help="Percentage of slowdown reported by --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(args.compare[0], args.compare[1], args.threshold)
+        print("%d results slower by more than %g%%" % (regressions, args.threshold))
+        sys.exit(1 if regressions else 0)
+
+    groups = Suite.GROUPS if not args.only else args.only.split(',')
+    unknown = set(groups) - set(Suite.GROUPS)
+    if unknown:
+        parser.error("Unknown groups: %s" % ', '.join(sorted(unknown)))
+
+    with tempfile.TemporaryDirectory(prefix='fslib-bench-') as workdir:
+        suite = Suite(workdir, quick=args.quick, full=args.full)
+        suite.run(groups)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'meta': {
+                    'fslib': fslib.__version__,
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'quick': args.quick,
+                },
+                'results': suite.results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
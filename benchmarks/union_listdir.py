@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Count stat() calls and time spent listing a directory through UnionFS.
+
+Usage:
+    python benchmarks/union_listdir.py --entries 50000 --branches 3
+"""
+
+import argparse
+import time
+
+from fslib import base
+from fslib import builders
+from fslib import stacking
+
+
+class StatCountingFS(base.WrappingFS):
+    """Count the stat() calls reaching a branch."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = 0
+
+    def _stat(self, path):
+        self.stats += 1
+        return self.wrapped.stat(path)
+
+
+def make_union(entries, branches):
+    union = stacking.UnionFS()
+    counters = []
+    for rank in range(branches):
+        branch = builders.make_memory_fake()
+        branch.mkdir('/data')
+        # Spread entries over branches
+        for i in range(rank, entries, branches):
+            branch.open_binary('/data/entry-%d' % i, 'wb').close()
+        # Hide 10% of the entries of the next branch
+        for i in range(rank + 1, entries, 10 * branches):
+            branch.unlink('/data/entry-%d' % i)
+        counter = StatCountingFS(wrapped=branch)
+        counters.append(counter)
+        union.add_branch(counter, ref=rank, rank=rank, writable=(rank == 0))
+    return union, counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--branches', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    union, counters = make_union(args.entries, args.branches)
+    best = None
+    for _i in range(args.repeat):
+        for counter in counters:
+            counter.stats = 0
+        start = time.perf_counter()
+        names = union.listdir('/data')
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print("entries=%d branches=%d listed=%d" % (args.entries, args.branches, len(names)))
+    print("stat() calls per listing: %d" % sum(counter.stats for counter in counters))
+    print("best time: %.3f ms" % (best * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""asyncio facade for fslib."""
+
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import threading
+import weakref
+
+from . import base
+
+
+# backend => {loop: asyncio.Semaphore}, shared by all facades of a backend
+_semaphores = weakref.WeakKeyDictionary()
+_semaphores_lock = threading.Lock()
+
+
+class AsyncFile:
+    """An open file, whose methods are coroutines.
+
+    Iterating over it (``async for line in f``) yields its lines.
+    """
+
+    def __init__(self, afs, f):
+        self._afs = afs
+        self._file = f
+
+    def __repr__(self):
+        return '<AsyncFile: %r>' % self._file
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    async def read(self, size=-1):
+        return await self._afs._run(self._file.read, size)
+
+    async def readline(self, size=-1):
+        return await self._afs._run(self._file.readline, size)
+
+    async def write(self, data):
+        return await self._afs._run(self._file.write, data)
+
+    async def writelines(self, lines):
+        return await self._afs._run(self._file.writelines, lines)
+
+    async def seek(self, offset, whence=0):
+        return await self._afs._run(self._file.seek, offset, whence)
+
+    async def tell(self):
+        return await self._afs._run(self._file.tell)
+
+    async def truncate(self, size=None):
+        return await self._afs._run(self._file.truncate, size)
+
+    async def flush(self):
+        return await self._afs._run(self._file.flush)
+
+    async def close(self):
+        return await self._afs._run(self._file.close)
+
+    def __aiter__(self):
+        # A generator of our own: closing it must leave the file open.
+        return self._afs._aiterate(lambda: (line for line in self._file))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        await self.close()
+
+
+class _AsyncOpen:
+    """A file being opened: await it, or use it as an async context manager."""
+
+    def __init__(self, afs, path, mode, encoding):
+        self._afs = afs
+        self._args = (path, mode, encoding)
+        self._file = None
+
+    async def _open(self):
+        f = await self._afs._run(self._afs.sync.open, *self._args)
+        return AsyncFile(self._afs, f)
+
+    def __await__(self):
+        return self._open().__await__()
+
+    async def __aenter__(self):
+        self._file = await self._open()
+        return self._file
+
+    async def __aexit__(self, *args, **kwargs):
+        await self._file.close()
+
+
+class AsyncWatch:
+    """A subscription to the changes of a path, as returned by AsyncFileSystem.watch().
+
+    Iterating over it (``async for event in watch``) yields events.Event
+    objects until it is closed.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self.watch = None
+
+    def __repr__(self):
+        return '<AsyncWatch: %r>' % self.watch
+
+    @property
+    def closed(self):
+        return self.watch.closed
+
+    def _emit(self, event):
+        # Called from the thread that noticed the change
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    async def get(self):
+        """Wait for the next event.
+
+        Returns:
+            Event, or None once the watch is closed.
+        """
+        event = await self._queue.get()
+        if event is None:
+            # Let other readers know
+            self._queue.put_nowait(None)
+        return event
+
+    def close(self):
+        if self.watch.closed:
+            return
+        self.watch.close()
+        # After the events already queued
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+    async def __aiter__(self):
+        while True:
+            event = await self.get()
+            if event is None:
+                return
+            yield event
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        self.close()
+
+
+class AsyncFileSystem:
+    """Abstraction layer around ``import os``, for asyncio.
+
+    Mirrors the FileSystem API with coroutines. Calls to backends with
+    blocking I/O (see BaseFS.FEATURE_BLOCKING_IO) run in a thread pool;
+    others, e.g a MemoryFS, run inline, in the event loop.
+
+    Args:
+        backend: BaseFS, the filesystem to use
+        digest_cache: hashing.BaseDigestCache or None, as for FileSystem
+        executor: concurrent.futures.Executor or None, where blocking calls
+            run; by default, a dedicated thread pool of max_workers threads.
+        concurrency: int or None, the maximum number of calls to the
+            backend running at once, across all facades of that backend
+            within an event loop; the first facade to run a call sets it.
+        inline: bool or None, whether to run calls in the event loop;
+            guessed from the backend features if None.
+        batch_size: int, the number of items (lines, entries, ...) fetched
+            at once by async iterators.
+    """
+
+    def __init__(self, backend, files_encoding='utf-8', digest_cache=None, executor=None, max_workers=None,
+                 concurrency=None, inline=None, batch_size=256):
+        self.sync = base.FileSystem(backend, files_encoding=files_encoding, digest_cache=digest_cache)
+        self.backend = backend
+        if inline is None:
+            inline = not backend.has_feature(base.BaseFS.FEATURE_BLOCKING_IO)
+        self.inline = inline
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._executor = executor
+        self._own_executor = executor is None
+        self._max_workers = max_workers
+
+    def __repr__(self):
+        return '<AsyncFileSystem: %r>' % self.backend
+
+    # Execution
+    # ---------
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._max_workers,
+                thread_name_prefix='fslib',
+            )
+        return self._executor
+
+    def _get_semaphore(self, loop):
+        """The semaphore bounding calls to the backend from a loop."""
+        with _semaphores_lock:
+            by_loop = _semaphores.get(self.backend)
+            if by_loop is None:
+                by_loop = _semaphores[self.backend] = weakref.WeakKeyDictionary()
+            semaphore = by_loop.get(loop)
+            if semaphore is None:
+                semaphore = by_loop[loop] = asyncio.Semaphore(self.concurrency)
+            return semaphore
+
+    async def _run(self, fn, *args, **kwargs):
+        if self.inline:
+            return fn(*args, **kwargs)
+
+        call = functools.partial(fn, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+        if self.concurrency is None:
+            return await loop.run_in_executor(self._get_executor(), call)
+
+        async with self._get_semaphore(loop):
+            return await loop.run_in_executor(self._get_executor(), call)
+
+    async def _aiterate(self, make_iterable, batch_size=None):
+        """Iterate asynchronously, fetching items by batches.
+
+        Args:
+            make_iterable: callable, returning the iterable; its iterator is
+                closed once done, so it should not be shared.
+            batch_size: int or None, overriding self.batch_size.
+        """
+        batch_size = batch_size or self.batch_size
+        iterator = await self._run(lambda: iter(make_iterable()))
+        try:
+            while True:
+                batch = await self._run(list, itertools.islice(iterator, batch_size))
+                if not batch:
+                    return
+                for item in batch:
+                    yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                await self._run(iterator.close)
+
+    def close(self):
+        """Shut down the dedicated thread pool, if any."""
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    # Read
+    # ----
+
+    async def access(self, path, read=True, write=False, follow=True):
+        return await self._run(self.sync.access, path, read=read, write=write, follow=follow)
+
+    async def stat(self, path):
+        return await self._run(self.sync.stat, path)
+
+    async def lstat(self, path):
+        return await self._run(self.sync.lstat, path)
+
+    async def stat_many(self, paths, follow=True):
+        return await self._run(self.sync.stat_many, paths, follow=follow)
+
+    async def exists_many(self, paths):
+        return await self._run(self.sync.exists_many, paths)
+
+    async def file_exists(self, path):
+        return await self._run(self.sync.file_exists, path)
+
+    async def dir_exists(self, path):
+        return await self._run(self.sync.dir_exists, path)
+
+    async def symlink_exists(self, path):
+        return await self._run(self.sync.symlink_exists, path)
+
+    async def read_one_line(self, path, encoding=None):
+        return await self._run(self.sync.read_one_line, path, encoding=encoding)
+
+    async def readlines(self, path, encoding=None):
+        """Read all lines from a file.
+
+        Yields lines of the file, stripping the terminating \\n.
+        """
+        async for line in self._aiterate(functools.partial(self.sync.readlines, path, encoding=encoding)):
+            yield line
+
+    async def listdir(self, path):
+        """Yield the names of the entries in a directory."""
+        for name in await self._run(self.sync.listdir, path):
+            yield name
+
+    async def scandir(self, path):
+        """Yield the entries of a directory, as DirEntry objects.
+
+        Their types come with the listing, but their stat() is a blocking
+        call: await stat() or stat_many() on their paths instead.
+        """
+        for entry in await self._run(self.sync.scandir, path):
+            yield entry
+
+    async def watch(self, path, recursive=False):
+        """Watch a path for changes; see FileSystem.watch().
+
+        Returns:
+            AsyncWatch, to close once done.
+        """
+        awatch = AsyncWatch(asyncio.get_running_loop())
+        awatch.watch = await self._run(self.sync.watch, path, recursive=recursive, callback=awatch._emit)
+        return awatch
+
+    async def walk(self, top, topdown=True, onerror=None, followlinks=False, workers=None, ordered=True):
+        """Walk a directory tree, as FileSystem.walk().
+
+        With topdown=True, directories are fetched one at a time, so that
+        dirnames may still be altered in place to prune the walk.
+        """
+        walk = functools.partial(
+            self.sync.walk, top,
+            topdown=topdown, onerror=onerror, followlinks=followlinks, workers=workers, ordered=ordered,
+        )
+        async for item in self._aiterate(walk, batch_size=1 if topdown else None):
+            yield item
+
+    async def get_hash(self, filename, **kwargs):
+        return await self._run(self.sync.get_hash, filename, **kwargs)
+
+    async def hash_tree(self, top, **kwargs):
+        return await self._run(self.sync.hash_tree, top, **kwargs)
+
+    # Read/write
+    # ----------
+
+    def open(self, path, mode, encoding=None):
+        """Open a file, as an AsyncFile.
+
+        Usage:
+            f = await afs.open(path, 'rb')
+            async with afs.open(path, 'rb') as f: ...
+        """
+        return _AsyncOpen(self, path, mode, encoding)
+
+    async def readlink(self, path):
+        return await self._run(self.sync.readlink, path)
+
+    # Write
+    # -----
+
+    async def mkdir(self, path):
+        return await self._run(self.sync.mkdir, path)
+
+    async def makedirs(self, path):
+        return await self._run(self.sync.makedirs, path)
+
+    async def chmod(self, path, mode):
+        return await self._run(self.sync.chmod, path, mode)
+
+    async def chown(self, path, uid, gid):
+        return await self._run(self.sync.chown, path, uid, gid)
+
+    async def symlink(self, link_name, target):
+        return await self._run(self.sync.symlink, link_name, target)
+
+    async def create_symlink(self, link_name, target, relative=False, force=False):
+        return await self._run(self.sync.create_symlink, link_name, target, relative=relative, force=force)
+
+    async def copy(self, source, destination, **kwargs):
+        return await self._run(self.sync.copy, source, destination, **kwargs)
+
+    async def copytree(self, source, destination, **kwargs):
+        return await self._run(self.sync.copytree, source, destination, **kwargs)
+
+    async def writelines(self, path, lines, encoding=None):
+        return await self._run(self.sync.writelines, path, lines, encoding=encoding)
+
+    # Delete
+    # ------
+
+    async def remove(self, path):
+        return await self._run(self.sync.remove, path)
+
+    async def rmtree(self, path):
+        return await self._run(self.sync.rmtree, path)
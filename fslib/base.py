@@ -2,24 +2,101 @@
 # Copyright (c) 2010-2020 Raphaël Barrois
 # This software is distributed under the two-clause BSD license.
 
+import collections
+import concurrent.futures
+import errno
 import hashlib
 import io
+import itertools
+import mmap
 import os
+import shutil
 import stat
 
+from . import events
 from . import exceptions
+from . import hashing
 from . import helpers
 
 ROOT = '/'
 
+# Default size of the chunks read by FileSystem.get_hash() / copy()
+HASH_CHUNK_SIZE = 32 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _iter_chunks(f, chunk_size):
+    """Read a binary file object by chunks of at most chunk_size bytes."""
+    data = f.read(chunk_size)
+    while data:
+        yield data
+        data = f.read(chunk_size)
+
+
+def _hash_mapped(f, method):
+    """Hash an OS-level binary file through mmap, without copying its content."""
+    file_hash = method()
+    if os.fstat(f.fileno()).st_size:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            file_hash.update(mapped)
+    return file_hash
+
+
+def _hash_tree_file(fs, path, method, chunk_size):
+    """Hash a file for FileSystem.hash_tree().
+
+    Returns:
+        str, the hex digest of the file; None if it isn't a regular file
+        (or is a broken symlink).
+    """
+    try:
+        file_stat = fs.stat(path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    if not stat.S_ISREG(file_stat.st_mode):
+        return None
+    return fs.get_hash(path, method=method, chunk_size=chunk_size).hexdigest()
+
+
+class _LazyCall:
+    """A Future-like call, only run when its result is requested."""
+
+    def __init__(self, fn, *args):
+        self._fn = fn
+        self._args = args
+
+    def result(self):
+        return self._fn(*self._args)
+
+
+class _WalkedDir:
+    """A directory listed by an unordered bottom-up walk, whose subdirectories remain to be yielded."""
+
+    def __init__(self, path, parent, dirs, nondirs, remaining):
+        self.path = path
+        self.parent = parent
+        self.dirs = dirs
+        self.nondirs = nondirs
+        self.remaining = remaining
+
 
 class FileSystem:
     """Abstraction layer around ``import os``.
+
+    Args:
+        backend: BaseFS, the filesystem to use
+        digest_cache: hashing.BaseDigestCache or None, where get_hash()
+            remembers the digests of files. Writes through this
+            FileSystem invalidate it; files altered otherwise are
+            detected through their size and modification time.
     """
-    def __init__(self, backend, files_encoding='utf-8', **kwargs):
+    def __init__(self, backend, files_encoding='utf-8', digest_cache=None, **kwargs):
         super().__init__(**kwargs)
         self.files_encoding = files_encoding
         self.backend = backend
+        self.digest_cache = digest_cache
 
     # Read
     # ----
@@ -38,6 +115,24 @@ class FileSystem:
     def lstat(self, path):
         return self.backend.lstat(path)
 
+    def stat_many(self, paths, follow=True):
+        """Retrieve the stats of several paths at once.
+
+        Args:
+            paths: iterable of paths
+            follow: bool, whether to follow symlinks (as stat() does),
+                or not (as lstat()).
+
+        Returns:
+            list, holding for each path either its stats or the OSError
+            raised while fetching them.
+        """
+        return self.backend.stat_many(paths, follow=follow)
+
+    def exists_many(self, paths):
+        """Whether each of the paths exists, as a list of bools."""
+        return [not isinstance(result, OSError) for result in self.backend.stat_many(paths)]
+
     def file_exists(self, path):
         """Whether the path exists, and is a file."""
         if not self.backend.access(path, os.F_OK):
@@ -75,24 +170,244 @@ class FileSystem:
                 # Strip final \n
                 yield line[:-1]
 
-    def get_hash(self, filename, method=hashlib.md5):
-        file_hash = method()
-        read_size = 32768
-        with self.backend.open_binary(filename, 'rb') as f:
-            data = f.read(read_size)
-            while data:
-                file_hash.update(data)
-                data = f.read(read_size)
+    def listdir(self, path):
+        """List the names of the entries in a directory."""
+        return list(self.backend.listdir(path))
+
+    def scandir(self, path):
+        """List the entries of a directory, as DirEntry objects."""
+        return self.backend.scandir(path)
+
+    def watch(self, path, recursive=False, callback=None):
+        """Watch a path for changes; see BaseFS.watch().
+
+        Returns:
+            events.Watch, to close once done.
+        """
+        return self.backend.watch(path, recursive=recursive, callback=callback)
+
+    def walk(self, top, topdown=True, onerror=None, followlinks=False, workers=None, ordered=True):
+        """Walk a directory tree, as os.walk().
+
+        Yields (dirpath, dirnames, filenames) tuples; with topdown=True,
+        dirnames may be altered in place to prune the walk.
+
+        Args:
+            workers: int or None, the number of threads listing directories
+                concurrently. Only used for backends with blocking I/O
+                (FEATURE_BLOCKING_IO); other backends are walked serially.
+            ordered: bool, whether a concurrent walk yields directories in
+                the same order as a serial one. If False, directories are
+                yielded as soon as they have been listed (still before their
+                subdirectories if topdown, after them otherwise).
+        """
+        if not workers or workers < 2 or not self.backend.has_feature(BaseFS.FEATURE_BLOCKING_IO):
+            listing = _LazyCall(self._walk_scan, top, followlinks)
+            yield from self._walk_ordered(top, listing, _LazyCall, 1, topdown, onerror, followlinks)
+            return
+
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        try:
+            if ordered:
+                listing = pool.submit(self._walk_scan, top, followlinks)
+                yield from self._walk_ordered(top, listing, pool.submit, workers, topdown, onerror, followlinks)
+            else:
+                yield from self._walk_unordered(top, pool, topdown, onerror, followlinks)
+        finally:
+            # Don't list directories ahead of a walk stopped early
+            pool.shutdown(cancel_futures=True)
+
+    def _walk_scan(self, path, followlinks):
+        """List a directory for walk().
+
+        Returns:
+            (dirs, nondirs, subdirs): names of directories and others, and
+                paths of the subdirectories to walk into.
+        """
+        dirs = []
+        nondirs = []
+        subdirs = []
+        for entry in self.scandir(path):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                dirs.append(entry.name)
+                if followlinks or not entry.is_symlink():
+                    subdirs.append(entry.name)
+            else:
+                nondirs.append(entry.name)
+        return dirs, nondirs, subdirs
+
+    def _walk_ordered(self, path, listing, submit, prefetch, topdown, onerror, followlinks):
+        """Walk a directory, whose listing has been submitted.
+
+        Args:
+            listing: a Future-like object, returned by submit()
+            prefetch: int, the number of subdirectories to list ahead
+        """
+        try:
+            dirs, nondirs, subdirs = listing.result()
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            return
+
+        if topdown:
+            yield path, dirs, nondirs
+            # Follow pruning by the caller
+            kept = set(dirs)
+            subdirs = [name for name in subdirs if name in kept]
+
+        # List the next few subdirectories ahead
+        names = iter(subdirs)
+        children = collections.deque()
+        while True:
+            for name in itertools.islice(names, prefetch - len(children)):
+                child = os.path.join(path, name)
+                children.append((child, submit(self._walk_scan, child, followlinks)))
+            if not children:
+                break
+            child, child_listing = children.popleft()
+            yield from self._walk_ordered(child, child_listing, submit, prefetch, topdown, onerror, followlinks)
+
+        if not topdown:
+            yield path, dirs, nondirs
+
+    def _walk_unordered(self, top, pool, topdown, onerror, followlinks):
+        pending = {pool.submit(self._walk_scan, top, followlinks): (top, None)}
+        # For bottom-up walks, directories waiting for their subdirectories.
+        waiting = {}
+        while pending:
+            done, _not_done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path, parent = pending.pop(future)
+                try:
+                    dirs, nondirs, subdirs = future.result()
+                except OSError as e:
+                    if onerror is not None:
+                        onerror(e)
+                    if not topdown:
+                        yield from self._walk_release(parent, waiting)
+                    continue
+
+                if topdown:
+                    yield path, dirs, nondirs
+                    kept = set(dirs)
+                    subdirs = [name for name in subdirs if name in kept]
+
+                for name in subdirs:
+                    child = os.path.join(path, name)
+                    pending[pool.submit(self._walk_scan, child, followlinks)] = (child, path)
+
+                if not topdown:
+                    waiting[path] = _WalkedDir(path, parent, dirs, nondirs, remaining=len(subdirs) + 1)
+                    yield from self._walk_release(path, waiting)
+
+    @staticmethod
+    def _walk_release(path, waiting):
+        """Yield directories of a bottom-up walk, once all their subdirectories have been."""
+        while path is not None:
+            walked = waiting[path]
+            walked.remaining -= 1
+            if walked.remaining:
+                return
+            del waiting[path]
+            yield walked.path, walked.dirs, walked.nondirs
+            path = walked.parent
+
+    def get_hash(self, filename, method=hashlib.md5, chunk_size=HASH_CHUNK_SIZE):
+        """Hash the content of a file.
+
+        Returns:
+            A hashlib-like object; only its digest() and hexdigest() methods
+            are available if it comes from the digest cache.
+        """
+        if self.digest_cache is None:
+            return self.backend.get_hash(filename, method=method, chunk_size=chunk_size)
+
+        before = self.backend.stat(filename)
+        method_name = method().name
+        digest = self.digest_cache.get(before, method_name)
+        if digest is not None:
+            return hashing.CachedHash(method_name, digest)
+
+        file_hash = self.backend.get_hash(filename, method=method, chunk_size=chunk_size)
+        after = self.backend.stat(filename)
+        if (before.st_ino, before.st_size, before.st_mtime_ns) == (after.st_ino, after.st_size, after.st_mtime_ns):
+            # Not modified while being hashed
+            self.digest_cache.set(after, method_name, file_hash.digest())
         return file_hash
 
+    def hash_tree(self, top, method=hashlib.md5, workers=None, executor=None, chunk_size=HASH_CHUNK_SIZE,
+                  onerror=None, followlinks=False):
+        """Hash all files below a directory.
+
+        Only regular files (or symlinks to them) are hashed.
+
+        Args:
+            top: str, the directory to walk
+            method: callable, building a hashlib-like object
+            workers: int or None, the number of threads hashing files (and
+                listing directories, see walk()) concurrently.
+            executor: concurrent.futures.Executor or None, an executor to
+                hash files with instead of a thread pool, e.g a
+                ProcessPoolExecutor; the FileSystem and method must then
+                be picklable.
+            onerror: callable or None, called with the OSError raised while
+                listing a directory, as for walk(). Errors raised while
+                hashing files are propagated.
+
+        Returns:
+            dict, mapping the path of each file to its hex digest.
+        """
+        pool = executor
+        if pool is None and workers and workers >= 2:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+        hashes = {}
+        try:
+            for dirpath, _dirnames, filenames in self.walk(top, onerror=onerror, followlinks=followlinks,
+                                                           workers=workers):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    if pool is None:
+                        hashes[path] = _hash_tree_file(self, path, method, chunk_size)
+                    else:
+                        hashes[path] = pool.submit(_hash_tree_file, self, path, method, chunk_size)
+
+            if pool is not None:
+                hashes = {path: future.result() for path, future in hashes.items()}
+        finally:
+            if pool is not executor:
+                pool.shutdown()
+
+        return {path: digest for path, digest in hashes.items() if digest is not None}
+
     # Read/write
     # ----------
 
     def open(self, path, mode, encoding=None):
         if 'b' in mode:
-            return self.backend.open_binary(path, mode)
+            f = self.backend.open_binary(path, mode)
         else:
-            return self.backend.open_text(path, mode, encoding=encoding or self.files_encoding)
+            f = self.backend.open_text(path, mode, encoding=encoding or self.files_encoding)
+
+        if self.digest_cache is not None and not helpers.is_readonly_open_mode(mode):
+            self._forget_digest(path)
+            return helpers.CloseHookFile(f, on_close=lambda: self._forget_digest(path))
+        return f
+
+    def _forget_digest(self, path):
+        """Drop the cached digests of a file about to be, or just, modified."""
+        if self.digest_cache is None:
+            return
+        try:
+            file_stat = self.backend.stat(path)
+        except OSError:
+            return
+        self.digest_cache.invalidate(file_stat)
 
     def readlink(self, path):
         return self.backend.readlink(path)
@@ -135,17 +450,74 @@ class FileSystem:
 
         self.symlink(link_name, target)
 
-    def copy(self, source, destination, copy_mode=True, copy_user=False):
+    def copy(self, source, destination, copy_mode=True, copy_user=False,
+             chunk_size=COPY_CHUNK_SIZE, hash_method=None, destination_fs=None):
+        """Copy a file, streaming its content by chunks of chunk_size bytes.
+
+        Args:
+            hash_method: callable, if provided (e.g ``hashlib.sha256``),
+                the copied data is hashed in the same pass.
+            destination_fs: FileSystem, where to copy the file (default: self)
+
+        Returns:
+            The hash object of the copied data, if hash_method was provided.
+        """
+        destination_fs = destination_fs or self
+        file_hash = hash_method() if hash_method else None
         with self.backend.open_binary(source, 'rb') as src:
-            with self.backend.open_binary(destination, 'wb') as dst:
-                dst.write(src.read())
+            with destination_fs.open(destination, 'wb') as dst:
+                for data in _iter_chunks(src, chunk_size):
+                    dst.write(data)
+                    if file_hash is not None:
+                        file_hash.update(data)
+
+        self._copy_metadata(source, destination, destination_fs, copy_mode=copy_mode, copy_user=copy_user)
+        return file_hash
+
+    def copytree(self, source, destination, copy_mode=True, copy_user=False,
+                 chunk_size=COPY_CHUNK_SIZE, destination_fs=None):
+        """Recursively copy a directory.
+
+        The destination must not exist yet; file contents are streamed as
+        in copy(), and symlinks are copied as symlinks.
 
+        Args:
+            destination_fs: FileSystem, where to copy the tree (default: self)
+        """
+        destination_fs = destination_fs or self
+        destination_fs.mkdir(destination)
+        for entry in self.scandir(source):
+            source_path = os.path.join(source, entry.name)
+            destination_path = os.path.join(destination, entry.name)
+            if entry.is_symlink():
+                destination_fs.symlink(destination_path, self.readlink(source_path))
+            elif entry.is_dir(follow_symlinks=False):
+                self.copytree(
+                    source_path, destination_path,
+                    copy_mode=copy_mode,
+                    copy_user=copy_user,
+                    chunk_size=chunk_size,
+                    destination_fs=destination_fs,
+                )
+            else:
+                self.copy(
+                    source_path, destination_path,
+                    copy_mode=copy_mode,
+                    copy_user=copy_user,
+                    chunk_size=chunk_size,
+                    destination_fs=destination_fs,
+                )
+
+        # Last, in case the mode forbids writing within the directory
+        self._copy_metadata(source, destination, destination_fs, copy_mode=copy_mode, copy_user=copy_user)
+
+    def _copy_metadata(self, source, destination, destination_fs, copy_mode, copy_user):
         if copy_mode or copy_user:
             stats = self.backend.stat(source)
             if copy_mode:
-                self.chmod(destination, stats.st_mode)
+                destination_fs.chmod(destination, stats.st_mode)
             if copy_user:
-                self.chown(destination, stats.st_uid, stats.st_gid)
+                destination_fs.chown(destination, stats.st_uid, stats.st_gid)
 
     def writelines(self, path, lines, encoding=None):
         """Write a set of lines to a file.
@@ -163,8 +535,138 @@ class FileSystem:
         if self.dir_exists(path):
             return self.backend.rmdir(path)
         else:
+            # The inode may be reused
+            self._forget_digest(path)
             return self.backend.unlink(path)
 
+    def rmtree(self, path):
+        """Remove a directory and all its contents.
+
+        See ``rm -r`` in bash.
+        """
+        return self.backend.rmtree(path)
+
+
+class DirEntry:
+    """An entry of a directory, as returned by BaseFS.scandir().
+
+    Similar to os.DirEntry: the entry type and stats are fetched lazily,
+    then cached.
+
+    Attributes:
+        name (str): the name of the entry
+        path (NormPath): its path, within the filesystem that listed it
+    """
+    def __init__(self, fs, path, name=None, file_type=None):
+        self._fs = fs
+        self._path = path
+        self.name = path.name if name is None else name
+        self._file_type = file_type
+        self._stat = None
+        self._lstat = None
+
+    def __repr__(self):
+        return '<%s: %r>' % (self.__class__.__name__, self.name)
+
+    @property
+    def path(self):
+        return self._path
+
+    def with_path(self, path):
+        """The same entry, seen at another path (e.g through a ChrootFS)."""
+        return _DirEntryAlias(self, path)
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks:
+            if self._stat is None:
+                self._stat = self._fetch_stat()
+            return self._stat
+        if self._lstat is None:
+            self._lstat = self._fetch_lstat()
+        return self._lstat
+
+    def file_type(self):
+        """The type of the entry, as a stat.S_IF* constant.
+
+        Symlinks are not followed.
+        """
+        if self._file_type is None:
+            self._file_type = self._fetch_file_type()
+        return self._file_type
+
+    def is_symlink(self):
+        return self.file_type() == stat.S_IFLNK
+
+    def is_dir(self, follow_symlinks=True):
+        return self._is_type(stat.S_IFDIR, follow_symlinks)
+
+    def is_file(self, follow_symlinks=True):
+        return self._is_type(stat.S_IFREG, follow_symlinks)
+
+    def _is_type(self, file_type, follow_symlinks):
+        if follow_symlinks and self.is_symlink():
+            try:
+                return stat.S_IFMT(self.stat().st_mode) == file_type
+            except OSError:
+                # Dangling symlink
+                return False
+        return self.file_type() == file_type
+
+    def _fetch_file_type(self):
+        return stat.S_IFMT(self.stat(follow_symlinks=False).st_mode)
+
+    def _fetch_stat(self):
+        return self._fs.stat(self._path)
+
+    def _fetch_lstat(self):
+        return self._fs.lstat(self._path)
+
+
+class _DirEntryAlias(DirEntry):
+    """A DirEntry at another path, sharing the original entry's data."""
+
+    def __init__(self, entry, path):
+        super().__init__(fs=None, path=path)
+        self._entry = entry
+
+    def _fetch_file_type(self):
+        return self._entry.file_type()
+
+    def _fetch_stat(self):
+        return self._entry.stat()
+
+    def _fetch_lstat(self):
+        return self._entry.stat(follow_symlinks=False)
+
+
+class _OSDirEntry(DirEntry):
+    """A DirEntry wrapping an os.DirEntry, reusing its type and stats."""
+
+    def __init__(self, fs, entry):
+        super().__init__(fs, path=None, name=entry.name.decode(fs.path_encoding))
+        self._entry = entry
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = self._fs.convert_path_out(self._entry.path.decode(self._fs.path_encoding))
+        return self._path
+
+    def _fetch_file_type(self):
+        if self._entry.is_symlink():
+            return stat.S_IFLNK
+        elif self._entry.is_dir(follow_symlinks=False):
+            return stat.S_IFDIR
+        elif self._entry.is_file(follow_symlinks=False):
+            return stat.S_IFREG
+        return super()._fetch_file_type()
+
+    def _fetch_stat(self):
+        return self._entry.stat()
+
+    def _fetch_lstat(self):
+        return self._entry.stat(follow_symlinks=False)
+
 
 class BaseFS:
     """A filesystem backend.
@@ -211,7 +713,10 @@ class BaseFS:
     # --------------
 
     def convert_path_in(self, path):
-        """Normalize a path (unless it is already an absolute path)."""
+        """Normalize a path, as a helpers.NormPath.
+
+        This is a no-op if the path was already normalized by another layer.
+        """
         return helpers.normpath(path)
 
     def convert_path_out(self, path):
@@ -225,28 +730,15 @@ class BaseFS:
             >>> fs.explode_path('/tmp/x/y')
             ['tmp', 'x', 'y']
         """
-        parts = []
-        head = path
-        while head:
-            # /foo/bar/baz => head=/foo/bar, tail=baz
-            head, tail = os.path.split(head)
-            parts.append(tail)
-        return reversed(parts)
+        return iter(helpers.normpath(path).parts)
 
     def iter_path(self, path):
         """Convert a (normalized) path to a list of its parents.
 
-        >>> BaseFS(root='/foo/bar').iter_path('/foo/bar/baz/blah')
-        ['/foo/bar', '/foo/bar/baz', '/foo/bar/baz/blah']
+        >>> fs.iter_path('/foo/bar/baz')
+        ['/', '/foo', '/foo/bar', '/foo/bar/baz']
         """
-        parts = []
-
-        head = tail = path
-        while tail:
-            parts.append(head)
-            head, tail = os.path.split(path)
-            path = head
-        return reversed(parts)
+        return iter(helpers.normpath(path).lineage)
 
     # Features
     # --------
@@ -255,10 +747,17 @@ class BaseFS:
 
     FEATURE_READONLY = 'readonly'
     FEATURE_WHITEOUT = 'whiteout'
+    # Operations may block on I/O, releasing the GIL meanwhile.
+    FEATURE_BLOCKING_IO = 'blocking_io'
+    # rmtree() hides a whole subtree at once, even from deeper UnionFS
+    # branches; it stays hidden if its root is created again.
+    FEATURE_SUBTREE_WHITEOUT = 'subtree_whiteout'
 
     ALL_FEATURES = (
         FEATURE_READONLY,
         FEATURE_WHITEOUT,
+        FEATURE_BLOCKING_IO,
+        FEATURE_SUBTREE_WHITEOUT,
     )
 
     def has_feature(self, feature):
@@ -283,14 +782,74 @@ class BaseFS:
         raise NotImplementedError()
 
     def listdir(self, path):
-        return [
-            self.convert_path_out(rpath)
-            for rpath in self._listdir(self.convert_path_in(path))
-        ]
+        # Entries are names, not paths: no conversion needed.
+        return list(self._listdir(self.convert_path_in(path)))
 
     def _listdir(self, path):
         raise NotImplementedError()
 
+    def scandir(self, path):
+        return list(self._scandir(self.convert_path_in(path)))
+
+    def _scandir(self, path):
+        """List the entries of a directory, as DirEntry objects.
+
+        By default, builds entries from ``_listdir()``, whose stats will
+        be fetched through this filesystem.
+        """
+        return [DirEntry(self, path.child(name)) for name in self._listdir(path)]
+
+    def list_whiteouts(self, path):
+        return self._list_whiteouts(self.convert_path_in(path))
+
+    def _list_whiteouts(self, path):
+        """List the names of deleted entries within a directory.
+
+        Those entries may still exist in a filesystem stacked below, and
+        should be hidden.
+
+        Raises:
+            NotImplementedError if the filesystem supports whiteouts but
+            can't list them.
+        """
+        if self.has_feature(self.FEATURE_WHITEOUT):
+            raise NotImplementedError()
+        return ()
+
+    def watch(self, path, recursive=False, callback=None):
+        """Watch a path for changes.
+
+        Events are reported for the path itself and, for a directory, for
+        the entries directly within it, or all paths below it if recursive.
+
+        Args:
+            path: str
+            recursive: bool
+            callback: callable or None, called with each events.Event;
+                events are queued in the watch otherwise.
+
+        Returns:
+            events.Watch, to close once done.
+
+        Raises:
+            NotImplementedError if the filesystem can't report changes.
+        """
+        watch = events.Watch(callback)
+
+        def emit(event):
+            watch.emit(event._replace(path=self.convert_path_out(event.path)))
+
+        watch.add_source(self._watch(self.convert_path_in(path), recursive, emit))
+        return watch
+
+    def _watch(self, path, recursive, emit):
+        """Send the events on a path to ``emit``, as events.Event.
+
+        Returns:
+            callable, stopping the watch.
+        """
+        raise NotImplementedError()
+
     def lstat(self, path):
         return self._lstat(self.convert_path_in(path))
 
@@ -310,6 +869,61 @@ class BaseFS:
         """Retrieve the stats for a given path, as a os.stats object."""
         raise NotImplementedError()
 
+    def get_hash(self, path, method, chunk_size=HASH_CHUNK_SIZE):
+        return self._get_hash(self.convert_path_in(path), method, chunk_size)
+
+    def _get_hash(self, path, method, chunk_size):
+        """Hash the content of a file.
+
+        By default, reads it by chunks of chunk_size bytes; backends may
+        provide faster, zero-copy, implementations.
+
+        Args:
+            method: callable, building a hashlib-like object
+
+        Returns:
+            The hashlib-like object, fed with the file content.
+        """
+        file_hash = method()
+        with self._open_binary(path, 'rb') as f:
+            for data in _iter_chunks(f, chunk_size):
+                file_hash.update(data)
+        return file_hash
+
+    def stat_many(self, paths, follow=True):
+        results = []
+        converted = []
+        for path in paths:
+            try:
+                converted.append(self.convert_path_in(path))
+            except OSError as e:
+                results.append(e)
+            else:
+                results.append(None)
+        if not converted:
+            return results
+
+        stats = iter(self._stat_many(converted, follow=follow))
+        return [next(stats) if result is None else result for result in results]
+
+    def _stat_many(self, paths, follow=True):
+        """Retrieve the stats of several paths at once.
+
+        By default, calls ``_stat()`` (or ``_lstat()``) for each path.
+
+        Returns:
+            list, holding for each path either its stats or the OSError
+            raised while fetching them.
+        """
+        fetch = self._stat if follow else self._lstat
+        results = []
+        for path in paths:
+            try:
+                results.append(fetch(path))
+            except OSError as e:
+                results.append(e)
+        return results
+
     # Read/write
     # ----------
 
@@ -382,6 +996,23 @@ class BaseFS:
         """Remove a file or symlink."""
         raise NotImplementedError()
 
+    def rmtree(self, path):
+        return self._rmtree(self.convert_path_in(path))
+
+    def _rmtree(self, path):
+        """Remove a directory and all its contents.
+
+        Entries are removed one at a time, bottom-up, unless the filesystem
+        has a faster way.
+        """
+        for name in self._listdir(path):
+            child = path.child(name)
+            if stat.S_ISDIR(self._lstat(child).st_mode):
+                self._rmtree(child)
+            else:
+                self._unlink(child)
+        self._rmdir(path)
+
     # Helpers
     # -------
 
@@ -402,6 +1033,10 @@ class BaseFS:
 class OSFS(BaseFS):
     """Actual filesystem backend."""
 
+    _FEATURES = (
+        BaseFS.FEATURE_BLOCKING_IO,
+    )
+
     def __init__(self, mapped_root=ROOT, path_encoding='utf-8', **kwargs):
         super().__init__(**kwargs)
         self.mapped_root = mapped_root
@@ -411,10 +1046,10 @@ class OSFS(BaseFS):
         return '<OSFS: %r (%s)>' % (self.mapped_root, self.path_encoding)
 
     def convert_path_in(self, path):
-        path = super().convert_path_in(path[len(ROOT):])
-        assert helpers.is_parent(ROOT, path)
+        path = super().convert_path_in(path)
+        assert path.parts[:1] != (os.pardir,)
 
-        return os.path.join(self.mapped_root, path)
+        return os.path.join(self.mapped_root, *path.parts)
 
     def convert_path_out(self, path):
         assert helpers.is_parent(self.mapped_root, path)
@@ -437,12 +1072,29 @@ class OSFS(BaseFS):
     def _lstat(self, path):
         return os.lstat(path.encode(self.path_encoding))
 
+    def _scandir(self, path):
+        with os.scandir(path.encode(self.path_encoding)) as entries:
+            return [_OSDirEntry(self, entry) for entry in entries]
+
     def _readlink(self, path):
         return os.readlink(path.encode(self.path_encoding)).decode(self.path_encoding)
 
+    def _watch(self, path, recursive, emit):
+        def emit_os_event(kind, os_path):
+            emit(events.Event(kind, os_path.decode(self.path_encoding)))
+
+        watcher = events.InotifyWatcher(path.encode(self.path_encoding), recursive, emit_os_event)
+        return watcher.close
+
     def _stat(self, path):
         return os.stat(path.encode(self.path_encoding))
 
+    def _get_hash(self, path, method, chunk_size):
+        with open(path.encode(self.path_encoding), 'rb') as f:
+            if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+                return hashlib.file_digest(f, method)
+            return _hash_mapped(f, method)
+
     # Read/write
     # ----------
 
@@ -481,6 +1133,9 @@ class OSFS(BaseFS):
     def _unlink(self, path):
         return os.unlink(path.encode(self.path_encoding))
 
+    def _rmtree(self, path):
+        return shutil.rmtree(path.encode(self.path_encoding))
+
 
 class WrappingFS(BaseFS):
 
@@ -503,6 +1158,15 @@ class WrappingFS(BaseFS):
     def _listdir(self, path):
         return self.wrapped.listdir(path)
 
+    def _scandir(self, path):
+        return self.wrapped.scandir(path)
+
+    def _list_whiteouts(self, path):
+        return self.wrapped.list_whiteouts(path)
+
+    def _watch(self, path, recursive, emit):
+        return self.wrapped.watch(path, recursive=recursive, callback=emit).close
+
     def _lstat(self, path):
         return self.wrapped.lstat(path)
 
@@ -512,6 +1176,12 @@ class WrappingFS(BaseFS):
     def _stat(self, path):
         return self.wrapped.stat(path)
 
+    def _get_hash(self, path, method, chunk_size):
+        return self.wrapped.get_hash(path, method, chunk_size)
+
+    def _stat_many(self, paths, follow=True):
+        return self.wrapped.stat_many(paths, follow=follow)
+
     # Mixed
     # -----
 
@@ -2,6 +2,13 @@
 # Copyright (c) 2010-2020 Raphaël Barrois
 # This software is distributed under the two-clause BSD license.
 
+import errno
+import os
+import stat
+import tarfile
+
+from . import exceptions
+from . import helpers
 from . import stacking
 
 
@@ -13,3 +20,148 @@ def make_memory_fake(**common_flags):
         wrapped=memory_fs,
     )
     return whiteout_fs
+
+
+def _target_dir(memory_fs, target):
+    """Create the directory receiving a bulk import, if needed."""
+    target = helpers.normpath(target)
+    if target != stacking.ROOT:
+        memory_fs.makedirs(target)
+    return target
+
+
+def import_directory(memory_fs, osfs, path=stacking.ROOT, target=stacking.ROOT):
+    """Import a directory of an OSFS into a MemoryFS, in one pass.
+
+    Nodes are created directly, bypassing permission checks, with the
+    modes, owners and modification times of the imported files. Symlinks
+    are imported as such; other special files are skipped.
+
+    Args:
+        memory_fs: MemoryFS, e.g the ``wrapped`` filesystem of
+            make_memory_fake()
+        osfs: OSFS, the filesystem to read from
+        path: str, the directory to import, within osfs
+        target: str, where to import it, within memory_fs
+
+    Returns:
+        memory_fs
+    """
+    target = _target_dir(memory_fs, target)
+    # The target directory node is looked up by import_node()
+    pending = [(osfs.convert_path_in(path), target, None)]
+    while pending:
+        os_dir, dir_path, dir_node = pending.pop()
+        with os.scandir(os_dir) as entries:
+            for entry in entries:
+                file_stat = entry.stat(follow_symlinks=False)
+                node_path = dir_path.child(entry.name)
+                attrs = dict(
+                    mode=file_stat.st_mode, uid=file_stat.st_uid, gid=file_stat.st_gid, mtime=file_stat.st_mtime,
+                    parent=dir_node,
+                )
+                if entry.is_dir(follow_symlinks=False):
+                    node = memory_fs.import_node(node_path, **attrs)
+                    pending.append((entry.path, node_path, node))
+                elif entry.is_symlink():
+                    memory_fs.import_node(node_path, target=os.readlink(entry.path), **attrs)
+                elif stat.S_ISREG(file_stat.st_mode):
+                    with open(entry.path, 'rb') as f:
+                        memory_fs.import_node(node_path, content=f.read(), **attrs)
+    return memory_fs
+
+
+def import_tarfile(memory_fs, source, target=stacking.ROOT):
+    """Import the contents of a tar archive into a MemoryFS, in one pass.
+
+    The archive is read as a stream. Nodes are created directly, bypassing
+    permission checks, with the modes, owners and modification times of
+    the archive members; missing parent directories are created with
+    default attributes. Hard links share the content of their target until
+    written to, or copy the target of a symlink; devices and FIFOs are
+    skipped. A member found several times replaces the earlier one, as
+    when extracting the archive.
+
+    Args:
+        memory_fs: MemoryFS, e.g the ``wrapped`` filesystem of
+            make_memory_fake()
+        source: str (a path), binary file object or tarfile.TarFile
+        target: str, where to import it, within memory_fs
+
+    Returns:
+        memory_fs
+
+    Raises:
+        FSError: a hard link to a missing member or a directory, a member
+            below a file, or replacing a non-empty directory.
+    """
+    if isinstance(source, tarfile.TarFile):
+        return _import_tar_members(memory_fs, source, target)
+    elif isinstance(source, str):
+        with tarfile.open(source, mode='r|*') as tar:
+            return _import_tar_members(memory_fs, tar, target)
+    else:
+        with tarfile.open(fileobj=source, mode='r|*') as tar:
+            return _import_tar_members(memory_fs, tar, target)
+
+
+def _import_tar_members(memory_fs, tar, target):
+    target = _target_dir(memory_fs, target)
+    # Nodes created so far, by path; the target directory node is looked
+    # up by import_node().
+    nodes = {target: None}
+
+    def member_path(name):
+        # Member names are relative, maybe with a leading './'
+        return target.descendant(helpers.normpath(stacking.ROOT + name).parts)
+
+    def get_dir(dir_path):
+        if dir_path not in nodes:
+            nodes[dir_path] = memory_fs.import_node(
+                dir_path,
+                mode=stat.S_IFDIR | memory_fs.default_dir_mode,
+                uid=memory_fs.default_uid,
+                gid=memory_fs.default_gid,
+                parent=get_dir(dir_path.parent),
+            )
+        node = nodes[dir_path]
+        if node is not None and not node.is_dir:
+            raise exceptions.FSError("Can't import below %r, not a directory" % dir_path)
+        return node
+
+    for member in tar:
+        node_path = member_path(member.name)
+        if node_path == target:
+            continue
+        attrs = dict(uid=member.uid, gid=member.gid, mtime=member.mtime, parent=get_dir(node_path.parent))
+        mode = stat.S_IMODE(member.mode)
+        if member.islnk():
+            linked_path = member_path(member.linkname)
+            linked = nodes.get(linked_path)
+            if linked is None:
+                raise exceptions.FSError("Hard link %r to %r: no such member before it" % (node_path, linked_path))
+            elif isinstance(linked, stacking.FakeSymlink):
+                # A link to the symlink itself
+                attrs.update(mode=linked.mode, target=linked.target)
+            elif isinstance(linked, stacking.FakeFile):
+                attrs.update(mode=stat.S_IFREG | mode, content=linked)
+            else:
+                raise exceptions.FSError("Hard link %r to %r: not a file" % (node_path, linked_path))
+        elif member.isdir():
+            attrs.update(mode=stat.S_IFDIR | mode)
+        elif member.issym():
+            attrs.update(mode=stat.S_IFLNK | mode, target=member.linkname)
+        elif member.isreg():
+            attrs.update(mode=stat.S_IFREG | mode, content=tar.extractfile(member).read())
+        else:
+            continue
+
+        # Members found again replace the earlier ones, as when extracting
+        # the archive; directories are updated in place.
+        try:
+            nodes[node_path] = memory_fs.import_node(node_path, **attrs)
+        except OSError as e:
+            if e.errno != errno.ENOTEMPTY:
+                raise
+            raise exceptions.FSError("Member %r would replace a non-empty directory" % node_path) from e
+    return memory_fs
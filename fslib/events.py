@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Change notifications, for BaseFS.watch()."""
+
+import collections
+import ctypes
+import errno
+import logging
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Event kinds
+CREATE = 'create'
+MODIFY = 'modify'
+DELETE = 'delete'
+ATTRIB = 'attrib'
+# Some events were lost: anything below the path may have changed.
+OVERFLOW = 'overflow'
+
+
+Event = collections.namedtuple('Event', ['kind', 'path'])
+
+
+class Watch:
+    """A subscription to the changes of a path, as returned by BaseFS.watch().
+
+    Without a callback, events are queued; read them by iterating over the
+    watch, which blocks until it is closed, or through get().
+
+    Args:
+        callback: callable or None, called with each Event instead of
+            queueing it, from the thread that noticed the change.
+    """
+
+    def __init__(self, callback=None):
+        self._callback = callback
+        self._queue = None if callback is not None else queue.SimpleQueue()
+        self._sources = []
+        self.closed = False
+
+    def __repr__(self):
+        return '<Watch: %d sources%s>' % (len(self._sources), ', closed' if self.closed else '')
+
+    def add_source(self, stop):
+        """Register a source of events, ``stop`` being called on close()."""
+        self._sources.append(stop)
+
+    def emit(self, event):
+        if self.closed:
+            return
+        if self._callback is not None:
+            self._callback(event)
+        else:
+            self._queue.put(event)
+
+    def get(self, timeout=None):
+        """Wait for the next event.
+
+        Returns:
+            Event, or None on timeout or once the watch is closed.
+        """
+        try:
+            event = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if event is None:
+            # Let other readers know
+            self._queue.put(None)
+        return event
+
+    def __iter__(self):
+        while True:
+            event = self.get()
+            if event is None:
+                return
+            yield event
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for stop in self._sources:
+            stop()
+        if self._queue is not None:
+            self._queue.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+
+class Hub:
+    """Dispatch the events of a filesystem to its watchers.
+
+    A watcher gets the events on its path and, for a directory, on the
+    entries directly within it; or on all paths below it if recursive.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        # Watchers follow the original filesystem, not its copies.
+        return (Hub, ())
+
+    def __bool__(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, path, recursive, emit):
+        """Send the events on a path to ``emit``.
+
+        Returns:
+            callable, ending the subscription.
+        """
+        subscriber = (path, recursive, emit)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscriber]
+
+        def unsubscribe():
+            with self._lock:
+                self._subscribers = [s for s in self._subscribers if s is not subscriber]
+        return unsubscribe
+
+    def emit(self, kind, path):
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        event = Event(kind, path)
+        for watched, recursive, emit in subscribers:
+            if path == watched or (watched.is_parent_of(path) if recursive else path.parent == watched):
+                emit(event)
+
+
+# {{{ inotify
+# ===========
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_INOTIFY_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+# Events on the entries of a watched directory; writes, and the events of
+# the watched directories themselves, are handled separately.
+_INOTIFY_KINDS = (
+    (IN_CREATE | IN_MOVED_TO, CREATE),
+    (IN_ATTRIB, ATTRIB),
+    (IN_DELETE | IN_MOVED_FROM, DELETE),
+)
+
+# struct inotify_event, followed by a NUL-padded name
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+_libc = None
+
+
+def _get_libc():
+    global _libc  # pylint: disable=global-statement
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            raise NotImplementedError("inotify is only available on Linux.")
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise NotImplementedError("This libc doesn't provide inotify.")
+        libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        _libc = libc
+    return _libc
+
+
+class InotifyWatcher:
+    """Watch an OS-level path with inotify, from a thread.
+
+    When recursive, directories created below the path are watched as
+    they appear, and the entries they already hold are reported as
+    created; directories moved away are no longer watched.
+
+    A write is reported once, even if the file is closed afterwards.
+    Exceptions raised by ``emit`` are logged, and don't stop the watcher.
+
+    Args:
+        path: bytes, the OS-level path
+        recursive: bool
+        emit: callable, called with (kind, path) for each event, path
+            being an OS-level bytes path.
+    """
+
+    def __init__(self, path, recursive, emit):
+        self._libc = _get_libc()
+        self.path = path
+        self.recursive = recursive
+        self._emit = emit
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise self._error(path)
+        # watch descriptor => watched path
+        self._watched = {}
+        # Paths written to since they were last closed
+        self._written = set()
+        try:
+            self._add(path, must_exist=True)
+            if recursive and os.path.isdir(path):
+                for dirpath, dirnames, _filenames in os.walk(path):
+                    for name in dirnames:
+                        self._add(os.path.join(dirpath, name))
+        except OSError:
+            os.close(self._fd)
+            raise
+        self._stop_read, self._stop_write = os.pipe()
+        self._thread = threading.Thread(target=self._run, name='fslib-inotify', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _error(path):
+        code = ctypes.get_errno()
+        return OSError(code, os.strerror(code), path)
+
+    def _add(self, path, must_exist=False):
+        wd = self._libc.inotify_add_watch(self._fd, path, _INOTIFY_MASK)
+        if wd < 0:
+            error = self._error(path)
+            if must_exist or error.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise error
+            # Already gone
+            return
+        self._watched[wd] = path
+
+    def _run(self):
+        try:
+            while True:
+                ready, _, _ = select.select([self._fd, self._stop_read], [], [])
+                if self._stop_read in ready:
+                    return
+                try:
+                    data = os.read(self._fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                try:
+                    self._dispatch(data)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Error while dispatching the changes of %r", self.path)
+        finally:
+            os.close(self._fd)
+            os.close(self._stop_read)
+
+    def _dispatch(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self._emit(OVERFLOW, self.path)
+                continue
+            directory = self._watched.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watched[wd]
+                continue
+            if not name:
+                # The watched directory itself: below the top, changes
+                # are reported through its parent.
+                if directory == self.path:
+                    self._dispatch_self(mask)
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & (IN_MODIFY | IN_CLOSE_WRITE):
+                if self._is_new_write(path, mask):
+                    self._emit(MODIFY, path)
+            for flags, kind in _INOTIFY_KINDS:
+                if mask & flags:
+                    self._emit(kind, path)
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self._written.discard(path)
+            if self.recursive and mask & IN_ISDIR:
+                if mask & IN_MOVED_FROM:
+                    self._unwatch_below(path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_new_dir(path)
+
+    def _dispatch_self(self, mask):
+        """Handle the events of the top watched path."""
+        if mask & (IN_MODIFY | IN_CLOSE_WRITE):
+            if self._is_new_write(self.path, mask):
+                self._emit(MODIFY, self.path)
+        if mask & IN_ATTRIB:
+            self._emit(ATTRIB, self.path)
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            self._emit(DELETE, self.path)
+
+    def _is_new_write(self, path, mask):
+        """Whether an IN_MODIFY or IN_CLOSE_WRITE event should be reported.
+
+        Closing a file after writing to it doesn't change it further.
+        """
+        if mask & IN_MODIFY:
+            self._written.add(path)
+            return True
+        if path in self._written:
+            self._written.discard(path)
+            return False
+        # e.g written through a memory mapping
+        return True
+
+    def _watch_new_dir(self, path):
+        # Entries may have been created before the watch was in place
+        self._add(path)
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in dirnames:
+                self._add(os.path.join(dirpath, name))
+            for name in dirnames + filenames:
+                self._emit(CREATE, os.path.join(dirpath, name))
+
+    def _unwatch_below(self, path):
+        """Stop watching a directory moved away, and the directories below it."""
+        prefix = path + os.sep.encode()
+        for wd, watched in list(self._watched.items()):
+            if watched == path or watched.startswith(prefix):
+                del self._watched[wd]
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def close(self):
+        os.write(self._stop_write, b'\0')
+        # May be called from a callback, within the thread
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        os.close(self._stop_write)
+
+
+# }}} /inotify
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Caches of file digests, for FileSystem.get_hash()."""
+
+import sqlite3
+import threading
+
+from . import helpers
+
+
+def file_identity(file_stat):
+    """The (st_dev, st_ino) identity of a file.
+
+    Returns:
+        tuple, or None if the stats can't identify the file (e.g from a
+        MemoryFS, without inode numbers or nanosecond timestamps).
+    """
+    if not file_stat.st_ino or getattr(file_stat, 'st_mtime_ns', None) is None:
+        return None
+    return (file_stat.st_dev, file_stat.st_ino)
+
+
+class CachedHash:
+    """A digest read from a cache, with the read-only part of the hashlib API."""
+
+    def __init__(self, name, digest):
+        self.name = name
+        self._digest = digest
+
+    def __repr__(self):
+        return '<CachedHash %s: %s>' % (self.name, self.hexdigest())
+
+    @property
+    def digest_size(self):
+        return len(self._digest)
+
+    def digest(self):
+        return self._digest
+
+    def hexdigest(self):
+        return self._digest.hex()
+
+
+class BaseDigestCache:
+    """Storage for file digests.
+
+    Digests are stored by file identity (st_dev, st_ino) and hash method
+    name; they are only valid while the file keeps the same st_size and
+    st_mtime_ns.
+    """
+
+    def get(self, file_stat, method_name):
+        """Fetch the digest of a file, as bytes, or None."""
+        raise NotImplementedError()
+
+    def set(self, file_stat, method_name, digest):
+        raise NotImplementedError()
+
+    def invalidate(self, file_stat):
+        """Forget all digests of a file."""
+        raise NotImplementedError()
+
+    def info(self):
+        """Statistics on the cache, as a helpers.CacheInfo."""
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class MemoryDigestCache(BaseDigestCache):
+    def __init__(self, maxsize=1024):
+        # (dev, ino) => (size, mtime_ns, {method_name: digest})
+        self.storage = helpers.LRUCache(maxsize)
+
+    def get(self, file_stat, method_name):
+        identity = file_identity(file_stat)
+        if identity is None:
+            return None
+        record = self.storage.get(identity)
+        if record is None or record[:2] != (file_stat.st_size, file_stat.st_mtime_ns):
+            return None
+        return record[2].get(method_name)
+
+    def set(self, file_stat, method_name, digest):
+        identity = file_identity(file_stat)
+        if identity is None:
+            return
+        version = (file_stat.st_size, file_stat.st_mtime_ns)
+        record = self.storage.get(identity)
+        if record is None or record[:2] != version:
+            record = version + ({},)
+        record[2][method_name] = digest
+        self.storage[identity] = record
+
+    def invalidate(self, file_stat):
+        identity = file_identity(file_stat)
+        if identity is not None:
+            self.storage.pop(identity)
+
+    def info(self):
+        return self.storage.info()
+
+
+# The usage clock: one past the latest use, read through the digests_used index
+_NEXT_USE = 'SELECT COALESCE(MAX(used), 0) + 1 FROM digests'
+
+
+class SQLiteDigestCache(BaseDigestCache):
+    """A digest cache persisted in a SQLite database.
+
+    Several processes may share the database: the usage clock and the
+    number of digests are kept in the database itself.
+
+    Args:
+        path: str, the database file
+        maxsize: int, the number of digests to keep; the least recently
+            used ones are evicted first.
+    """
+
+    def __init__(self, path, maxsize=100000):
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.storage = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # A cache: losing the last writes on power loss is fine.
+        self.storage.execute('PRAGMA journal_mode=WAL')
+        self.storage.execute('PRAGMA synchronous=NORMAL')
+        with self.storage:
+            self.storage.execute('BEGIN IMMEDIATE')
+            self.storage.execute(
+                'CREATE TABLE IF NOT EXISTS digests ('
+                ' dev INTEGER, ino INTEGER, method TEXT, size INTEGER, mtime_ns INTEGER,'
+                ' digest BLOB, used INTEGER,'
+                ' PRIMARY KEY (dev, ino, method))'
+            )
+            self.storage.execute('CREATE INDEX IF NOT EXISTS digests_used ON digests (used)')
+            # COUNT(*) scans the table: maintain the count instead.
+            self.storage.execute(
+                'CREATE TABLE IF NOT EXISTS digests_count (id INTEGER PRIMARY KEY CHECK (id = 0), count INTEGER)')
+            self.storage.execute('INSERT OR IGNORE INTO digests_count SELECT 0, COUNT(*) FROM digests')
+            self.storage.execute(
+                'CREATE TRIGGER IF NOT EXISTS digests_added AFTER INSERT ON digests'
+                ' BEGIN UPDATE digests_count SET count = count + 1; END')
+            self.storage.execute(
+                'CREATE TRIGGER IF NOT EXISTS digests_removed AFTER DELETE ON digests'
+                ' BEGIN UPDATE digests_count SET count = count - 1; END')
+
+    def __getstate__(self):
+        # Reopen the database when unpickled, e.g in another process.
+        return {'path': self.path, 'maxsize': self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _currsize(self):
+        return self.storage.execute('SELECT count FROM digests_count').fetchone()[0]
+
+    def get(self, file_stat, method_name):
+        identity = file_identity(file_stat)
+        if identity is None:
+            return None
+        with self._lock:
+            row = self.storage.execute(
+                'SELECT digest FROM digests WHERE dev = ? AND ino = ? AND method = ? AND size = ? AND mtime_ns = ?',
+                identity + (method_name, file_stat.st_size, file_stat.st_mtime_ns),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.storage.execute(
+                'UPDATE digests SET used = (%s) WHERE dev = ? AND ino = ? AND method = ?' % _NEXT_USE,
+                identity + (method_name,),
+            )
+            return row[0]
+
+    def set(self, file_stat, method_name, digest):
+        identity = file_identity(file_stat)
+        if identity is None:
+            return
+        with self._lock, self.storage:
+            self.storage.execute('BEGIN')
+            # Drop the previous digest, and those of former versions of the file
+            self.storage.execute(
+                'DELETE FROM digests WHERE dev = ? AND ino = ? AND (method = ? OR size != ? OR mtime_ns != ?)',
+                identity + (method_name, file_stat.st_size, file_stat.st_mtime_ns),
+            )
+            self.storage.execute(
+                'INSERT INTO digests (dev, ino, method, size, mtime_ns, digest, used)'
+                ' VALUES (?, ?, ?, ?, ?, ?, (%s))' % _NEXT_USE,
+                identity + (method_name, file_stat.st_size, file_stat.st_mtime_ns, digest),
+            )
+            currsize = self._currsize()
+            if currsize > self.maxsize:
+                self.storage.execute(
+                    'DELETE FROM digests WHERE rowid IN (SELECT rowid FROM digests ORDER BY used LIMIT ?)',
+                    (currsize - self.maxsize,),
+                )
+
+    def invalidate(self, file_stat):
+        identity = file_identity(file_stat)
+        if identity is None:
+            return
+        with self._lock:
+            self.storage.execute('DELETE FROM digests WHERE dev = ? AND ino = ?', identity)
+
+    def info(self):
+        with self._lock:
+            currsize = self._currsize()
+        return helpers.CacheInfo(
+            hits=self.hits,
+            misses=self.misses,
+            maxsize=self.maxsize,
+            currsize=currsize,
+        )
+
+    def close(self):
+        self.storage.close()
@@ -2,7 +2,13 @@
 # Copyright (c) 2010-2020 Raphaël Barrois
 # This software is distributed under the two-clause BSD license.
 
+import collections
+import hashlib
+import math
 import os
+import threading
+import time
+import weakref
 
 
 def get_active_umask():
@@ -17,13 +23,367 @@ def is_readonly_open_mode(mode):
     return set(mode) < set('rbt')
 
 
+def is_overwriting_open_mode(mode):
+    """Whether a 'open()' mode string ignores any previous content."""
+    return 'w' in mode or 'x' in mode
+
+
 def is_parent(dir1, dir2):
-    relpath = os.path.relpath(dir2, start=dir1)
-    # If dir2 == os.path.join(dir1, x), os.path.relpath(dir2, start=dir1) == x
-    return relpath == '' or relpath[:2] != '..'
+    """Whether dir2 is dir1, or lies within dir1."""
+    return normpath(dir1).is_parent_of(normpath(dir2))
+
+
+class NormPath(str):
+    """A normalized path.
+
+    Instances are immutable, and shared: ``normpath()`` returns the same
+    object for a given path as long as it is in use. Each instance carries
+    its components, parents, etc., so that the layers of a stack don't
+    have to re-normalize it or split it again.
+
+    Attributes:
+        parts (tuple of str): the path components, e.g ('tmp', 'x')
+        is_absolute (bool): whether the path starts at the root
+    """
+
+    def __new__(cls, value, parts, is_absolute):
+        path = super().__new__(cls, value)
+        path.parts = parts
+        path.is_absolute = is_absolute
+        path._parent = None
+        path._lineage = None
+        return path
+
+    def __reduce__(self):
+        # Copies and unpickled paths are interned as well.
+        return (normpath, (str(self),))
+
+    @classmethod
+    def from_parts(cls, parts, is_absolute=True):
+        """Build a path from already normalized components."""
+        parts = tuple(parts)
+        if is_absolute:
+            value = os.sep + os.sep.join(parts)
+        else:
+            value = os.sep.join(parts) or os.curdir
+        try:
+            return _interned_paths[value]
+        except KeyError:
+            pass
+        path = cls(value, parts, is_absolute)
+        _interned_paths[value] = path
+        return path
+
+    @property
+    def name(self):
+        """The last component of the path, or '' for the root."""
+        return self.parts[-1] if self.parts else ''
+
+    @property
+    def parent(self):
+        """The parent directory; the root is its own parent."""
+        if self._parent is None:
+            if self.parts:
+                self._parent = self.from_parts(self.parts[:-1], self.is_absolute)
+            else:
+                self._parent = self
+        return self._parent
+
+    @property
+    def lineage(self):
+        """All parents of the path, from the outermost one, and the path itself.
+
+        Example:
+
+            >>> normpath('/tmp/x').lineage
+            ('/', '/tmp', '/tmp/x')
+        """
+        if self._lineage is None:
+            if self.parts:
+                self._lineage = self.parent.lineage + (self,)
+            else:
+                self._lineage = (self,)
+        return self._lineage
+
+    def child(self, name):
+        """The path of a member of this directory."""
+        if os.sep in name or name in ('', os.curdir, os.pardir):
+            return normpath(os.path.join(self, name))
+        return self.from_parts(self.parts + (name,), self.is_absolute)
+
+    def descendant(self, parts):
+        """The path reached by following components from this one."""
+        return self.from_parts(self.parts + tuple(parts), self.is_absolute)
+
+    def is_parent_of(self, other):
+        """Whether ``other`` (a NormPath) is this path or lies within it."""
+        return (
+            self.is_absolute == other.is_absolute
+            and other.parts[:len(self.parts)] == self.parts
+        )
+
+
+_interned_paths = weakref.WeakValueDictionary()
 
 
 def normpath(path):
-    if not os.path.isabs(path):
-        path = os.path.normpath(path)
-    return path
+    """Normalize a path, as a NormPath.
+
+    ``..`` components are collapsed lexically, without resolving symlinks;
+    they are only kept when leading a relative path.
+    This is a no-op for already normalized paths.
+    """
+    if isinstance(path, NormPath):
+        return path
+    try:
+        return _interned_paths[path]
+    except KeyError:
+        pass
+
+    is_absolute = path.startswith(os.sep)
+    parts = tuple(
+        part
+        for part in os.path.normpath(path).split(os.sep)
+        if part and part != os.curdir
+    )
+    normalized = NormPath.from_parts(parts, is_absolute)
+    # Remember this spelling too
+    _interned_paths[path] = normalized
+    return normalized
+
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ['hits', 'misses', 'maxsize', 'currsize', 'evictions'], defaults=(0,),
+)
+
+
+class LRUCache:
+    """A bounded mapping, discarding the least recently used entries.
+
+    Lookups through ``get()`` are counted as hits or misses, and entries
+    discarded to make room as evictions.
+    The cache may be shared between threads.
+
+    Args:
+        maxsize: int, the number of entries to keep
+        ttl: float or None, the default lifetime of entries, in seconds;
+            expired entries are dropped when next looked up.
+    """
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = collections.OrderedDict()
+        # key => expiry time, for entries with a lifetime
+        self._expiry = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if self._expiry and self._expiry.get(key, math.inf) <= time.monotonic():
+                del self._data[key]
+                del self._expiry[key]
+                self._removed(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        """Store an entry, expiring after ``ttl`` seconds (defaults to the cache's ttl)."""
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            if key not in self._data:
+                self._added(key)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if ttl is None:
+                self._expiry.pop(key, None)
+            else:
+                self._expiry[key] = time.monotonic() + ttl
+            if len(self._data) > self.maxsize:
+                evicted, _value = self._data.popitem(last=False)
+                self._expiry.pop(evicted, None)
+                self._removed(evicted)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self._expiry.pop(key, None)
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            self._removed(key)
+            return value
+
+    def keys(self):
+        """A snapshot of the keys, from least to most recently used."""
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+
+    def info(self):
+        return CacheInfo(
+            hits=self.hits,
+            misses=self.misses,
+            maxsize=self.maxsize,
+            currsize=len(self._data),
+            evictions=self.evictions,
+        )
+
+    # Hooks for subclasses, called with the lock held
+    def _added(self, key):
+        pass
+
+    def _removed(self, key):
+        pass
+
+
+class PathLRUCache(LRUCache):
+    """A LRUCache keyed by NormPath, able to drop all entries below a path.
+
+    Cached paths are indexed by parent, so that pop_tree() only visits the
+    entries it removes, and the directories leading to them.
+    """
+    def __init__(self, maxsize, ttl=None):
+        super().__init__(maxsize, ttl=ttl)
+        # path => paths of its children that are cached or have cached descendants
+        self._children = {}
+
+    def _added(self, key):
+        path = key
+        while path.parts:
+            siblings = self._children.setdefault(path.parent, set())
+            if path in siblings:
+                break
+            siblings.add(path)
+            path = path.parent
+
+    def _removed(self, key):
+        path = key
+        # Keep the path in the index while it leads to cached entries
+        while path.parts and path not in self._children and path not in self._data:
+            siblings = self._children[path.parent]
+            siblings.discard(path)
+            if siblings:
+                break
+            del self._children[path.parent]
+            path = path.parent
+
+    def pop_tree(self, path):
+        """Drop the entry for a path, and those of all paths below it."""
+        with self._lock:
+            pending = [path]
+            while pending:
+                current = pending.pop()
+                self._data.pop(current, None)
+                self._expiry.pop(current, None)
+                pending.extend(self._children.pop(current, ()))
+            if path.parts and path in self._children.get(path.parent, ()):
+                self._removed(path)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+            self._children.clear()
+
+
+class BloomFilter:
+    """A compact set of strings, whose membership tests answer "maybe" or "definitely not".
+
+    Items can't be removed.
+
+    Args:
+        capacity: int, the expected number of items
+        error_rate: float, the rate of false positives at capacity
+        max_bytes: int or None, a bound on the size of the filter; the
+            rate of false positives is higher if it is reached.
+    """
+    def __init__(self, capacity, error_rate=0.01, max_bytes=None):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        num_bits = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        if max_bytes is not None:
+            num_bits = min(num_bits, max_bytes * 8)
+        self.num_bits = max(num_bits, 8)
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    @property
+    def nbytes(self):
+        return len(self._bits)
+
+    def _positions(self, item):
+        # Double hashing: k positions from two 64-bit hashes
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class CloseHookFile:
+    """Proxy to a file object, calling ``on_close`` once it has been closed."""
+
+    def __init__(self, wrapped, on_close):
+        self._wrapped = wrapped
+        self._on_close = on_close
+
+    def close(self):
+        try:
+            self._wrapped.close()
+        finally:
+            self._on_close()
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __iter__(self):
+        return iter(self._wrapped)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Call counts, errors and latencies of filesystem operations, per layer.
+
+Operations are recorded either by stacking.InstrumentedFS wrappers, or
+for every BaseFS layer once enable() has been called.
+
+Each call is timed twice: its total time, and its own time, excluding
+the nested calls recorded in the same thread; the own time shows which
+layer of a stack is slow.
+
+Only the calls themselves are timed: for open_binary() and open_text(),
+opening the file, not reading or writing it; for scandir(), listing the
+directory, not the stats fetched lazily by the entries.
+"""
+
+import collections
+import errno
+import functools
+import threading
+import time
+
+from . import base
+
+# Public BaseFS methods instrumented by enable()
+OPERATIONS = (
+    'access', 'listdir', 'scandir', 'list_whiteouts', 'watch',
+    'lstat', 'readlink', 'stat', 'get_hash', 'stat_many',
+    'open_binary', 'open_text',
+    'chmod', 'chown', 'mkdir', 'symlink',
+    'rmdir', 'unlink', 'rmtree',
+)
+
+# Latency buckets: [0, 1µs), then powers of two up to ~1s, then the rest.
+MIN_BUCKET_BITS = 10
+NUM_BUCKETS = 22
+
+
+def bucket_bounds():
+    """The upper bound of each latency bucket, in nanoseconds; the last one is None."""
+    return tuple(1 << (MIN_BUCKET_BITS + i) for i in range(NUM_BUCKETS - 1)) + (None,)
+
+
+OperationStats = collections.namedtuple(
+    'OperationStats', ['calls', 'errors', 'total_ns', 'own_ns', 'max_ns', 'buckets'],
+)
+
+
+def percentile(stats, fraction):
+    """An upper bound of the given percentile of latencies, from the histogram.
+
+    Args:
+        stats: OperationStats
+        fraction: float, e.g 0.99
+
+    Returns:
+        int (nanoseconds), or None if no call was recorded.
+    """
+    if not stats.calls:
+        return None
+    threshold = fraction * stats.calls
+    seen = 0
+    for count, bound in zip(stats.buckets, bucket_bounds()):
+        seen += count
+        if seen >= threshold:
+            return stats.max_ns if bound is None else min(bound, stats.max_ns)
+    return stats.max_ns
+
+
+class _Operation:
+    """Mutable statistics of an operation on a layer."""
+
+    __slots__ = ('calls', 'errors', 'total_ns', 'own_ns', 'max_ns', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = collections.Counter()
+        self.total_ns = 0
+        self.own_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * NUM_BUCKETS
+
+    def freeze(self):
+        return OperationStats(
+            calls=self.calls,
+            errors=dict(self.errors),
+            total_ns=self.total_ns,
+            own_ns=self.own_ns,
+            max_ns=self.max_ns,
+            buckets=tuple(self.buckets),
+        )
+
+
+class Recorder:
+    """Collects operation statistics, by (layer, operation)."""
+
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+        # Time spent in nested calls, per thread
+        self._local = threading.local()
+
+    def call(self, layer, operation, func, *args, **kwargs):
+        """Call func(*args, **kwargs), recording it."""
+        nested = getattr(self._local, 'nested', None)
+        if nested is None:
+            nested = self._local.nested = []
+        nested.append(0)
+        error = None
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        except OSError as e:
+            error = errno.errorcode.get(e.errno, str(e.errno))
+            raise
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            nested_ns = nested.pop()
+            if nested:
+                nested[-1] += elapsed
+            self.record(layer, operation, elapsed, elapsed - nested_ns, error)
+
+    def record(self, layer, operation, elapsed_ns, own_ns, error=None):
+        key = (layer, operation)
+        bucket = min(max(elapsed_ns.bit_length() - MIN_BUCKET_BITS, 0), NUM_BUCKETS - 1)
+        with self._lock:
+            stats = self._operations.get(key)
+            if stats is None:
+                stats = self._operations[key] = _Operation()
+            stats.calls += 1
+            stats.total_ns += elapsed_ns
+            stats.own_ns += own_ns
+            stats.max_ns = max(stats.max_ns, elapsed_ns)
+            stats.buckets[bucket] += 1
+            if error is not None:
+                stats.errors[error] += 1
+
+    def snapshot(self):
+        """The statistics so far.
+
+        Returns:
+            dict((layer, operation) => OperationStats)
+        """
+        with self._lock:
+            return {key: stats.freeze() for key, stats in self._operations.items()}
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+    def report(self):
+        """A text table of the statistics so far, slowest layers first."""
+        rows = sorted(self.snapshot().items(), key=lambda item: -item[1].own_ns)
+        lines = ['%-24s %-14s %9s %7s %11s %11s %9s %9s' % (
+            'layer', 'operation', 'calls', 'errors', 'total ms', 'own ms', 'p50 µs', 'p99 µs',
+        )]
+        for (layer, operation), stats in rows:
+            lines.append('%-24s %-14s %9d %7d %11.3f %11.3f %9.1f %9.1f' % (
+                layer, operation, stats.calls, sum(stats.errors.values()),
+                stats.total_ns / 1e6, stats.own_ns / 1e6,
+                percentile(stats, 0.5) / 1e3, percentile(stats, 0.99) / 1e3,
+            ))
+        return '\n'.join(lines)
+
+
+# The recorder used by default
+default_recorder = Recorder()
+
+
+def layer_name(fs):
+    """The name of a filesystem in the statistics."""
+    return type(fs).__name__
+
+
+# {{{ Global switch
+# =================
+
+
+_originals = {}
+
+
+def _instrumented(operation, method, recorder):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return recorder.call(layer_name(self), operation, method, self, *args, **kwargs)
+    return wrapper
+
+
+def enable(recorder=None):
+    """Record the operations of all BaseFS layers.
+
+    The public methods of BaseFS are replaced until disable() is called:
+    there is no overhead at all while disabled.
+    """
+    recorder = recorder or default_recorder
+    disable()
+    for operation in OPERATIONS:
+        method = getattr(base.BaseFS, operation)
+        _originals[operation] = method
+        setattr(base.BaseFS, operation, _instrumented(operation, method, recorder))
+
+
+def disable():
+    for operation, method in _originals.items():
+        setattr(base.BaseFS, operation, method)
+    _originals.clear()
+
+
+def is_enabled():
+    return bool(_originals)
+
+
+# }}} /Global switch
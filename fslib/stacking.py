@@ -7,16 +7,30 @@
 
 import collections
 import contextlib
+import copy
 import dbm
 import errno
+import functools
 import io
+import itertools
+import mmap
+import operator
 import os
+import shutil
+import sqlite3
 import stat
+import struct
+import sys
+import tempfile
+import threading
 import time
+import weakref
 
 from . import base
+from . import events
 from . import exceptions
 from . import helpers
+from . import instrumentation
 
 
 ROOT = base.ROOT
@@ -33,18 +47,27 @@ class ChrootFS(base.WrappingFS):
     """
     def __init__(self, external_root=ROOT, internal_root=ROOT, **kwargs):
         super().__init__(**kwargs)
-        self.external_root = external_root
-        self.internal_root = internal_root
+        self.external_root = helpers.normpath(external_root)
+        self.internal_root = helpers.normpath(internal_root)
 
-    def convert_path_in(self, path):
-        if not helpers.is_parent(self.external_root, path):
+    @classmethod
+    def _swap_root(cls, path, old_root, new_root):
+        path = helpers.normpath(path)
+        if not old_root.is_parent_of(path):
             raise exceptions.EACCES(path)
-        return os.path.join(self.internal_root, path[len(self.external_root):])
+        return new_root.descendant(path.parts[len(old_root.parts):])
+
+    def convert_path_in(self, path):
+        return self._swap_root(path, self.external_root, self.internal_root)
 
     def convert_path_out(self, path):
-        if not helpers.is_parent(self.internal_root, path):
-            raise exceptions.EACCES(path)
-        return os.path.join(self.external_root, path[len(self.internal_root):])
+        return self._swap_root(path, self.internal_root, self.external_root)
+
+    def _scandir(self, path):
+        return [
+            entry.with_path(self.convert_path_out(entry.path))
+            for entry in self.wrapped.scandir(path)
+        ]
 
 
 # }}} /ChrootFS
@@ -113,11 +136,287 @@ class ReadOnlyFS(base.WrappingFS):
 # }}} /ReadOnlyFS
 
 
+# {{{ CachingFS
+# =============
+
+
+class CachingFS(base.WrappingFS):
+    """Cache the metadata lookups of a slow filesystem.
+
+    The results of stat(), lstat(), access(), readlink() and listdir(),
+    including errors such as ENOENT, are kept in a LRU cache of paths, for
+    at most ``ttl`` seconds.
+
+    Changes made through this filesystem update the cache. Other changes,
+    made below it or by other processes, are only seen once entries expire
+    or have been invalidated (see invalidate()); this includes changes to
+    the target of a symlink through another path. With follow_changes,
+    the changes reported by the wrapped filesystem (see BaseFS.watch())
+    invalidate entries as they happen.
+
+    Args:
+        cache_size: int, the number of paths to remember
+        ttl: float or None, the lifetime of cached results, in seconds
+        follow_changes: bool, whether to watch the wrapped filesystem
+    """
+
+    # Errors describing the filesystem, rather than a failure to reach it
+    CACHED_ERRNOS = frozenset([errno.ENOENT, errno.ENOTDIR, errno.EACCES, errno.EINVAL, errno.ELOOP])
+
+    def __init__(self, cache_size=10000, ttl=1.0, follow_changes=False, **kwargs):
+        super().__init__(**kwargs)
+        # path => {lookup: result or OSError}
+        self._cache = helpers.PathLRUCache(cache_size, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self._changes = None
+        if follow_changes:
+            self._changes = self.wrapped.watch(ROOT, recursive=True, callback=self._on_change)
+
+    def close(self):
+        """Stop following changes."""
+        if self._changes is not None:
+            self._changes.close()
+
+    def cache_info(self):
+        """Statistics on cached lookups, as a CacheInfo; currsize counts paths."""
+        info = self._cache.info()
+        return info._replace(hits=self.hits, misses=self.misses)
+
+    def invalidate(self, path, recursive=False):
+        """Forget the cached metadata of a path, and optionally of all paths below it."""
+        self._invalidate(self.convert_path_in(path), recursive=recursive)
+
+    def _invalidate(self, path, recursive=False):
+        if recursive:
+            self._cache.pop_tree(path)
+        else:
+            self._cache.pop(path)
+
+    def _changed(self, path, recursive=False):
+        """Invalidate a path changed through this filesystem, and its parent."""
+        self._invalidate(path, recursive=recursive)
+        # The parent's listing and mtime
+        self._cache.pop(path.parent)
+
+    def _on_change(self, event):
+        # Deletions and permission changes affect the paths below, and so
+        # do creations: the new path may be a symlink, or a moved directory.
+        recursive = event.kind in (events.CREATE, events.DELETE, events.ATTRIB, events.OVERFLOW)
+        self._changed(helpers.normpath(event.path), recursive=recursive)
+
+    @contextlib.contextmanager
+    def _changing(self, path, recursive=False):
+        """Invalidate a path once changed, even if the change failed halfway."""
+        try:
+            yield
+        finally:
+            self._changed(path, recursive=recursive)
+
+    def _entry(self, path):
+        entry = self._cache.get(path)
+        if entry is None:
+            entry = {}
+            self._cache[path] = entry
+        return entry
+
+    def _store(self, entry, lookup, result):
+        if not isinstance(result, OSError) or result.errno in self.CACHED_ERRNOS:
+            entry[lookup] = result
+
+    def _cached(self, path, lookup, fetch, *args, **kwargs):
+        entry = self._entry(path)
+        try:
+            result = entry[lookup]
+        except KeyError:
+            self.misses += 1
+            try:
+                result = fetch(path, *args, **kwargs)
+            except OSError as e:
+                self._store(entry, lookup, e)
+                raise
+            self._store(entry, lookup, result)
+            return result
+
+        self.hits += 1
+        if isinstance(result, OSError):
+            raise result.with_traceback(None)
+        return result
+
+    # Read
+    # ----
+
+    def _access(self, path, mode, follow=True):
+        return self._cached(path, ('access', mode, follow), self.wrapped.access, mode, follow=follow)
+
+    def _listdir(self, path):
+        return list(self._cached(path, 'listdir', self.wrapped.listdir))
+
+    def _lstat(self, path):
+        return self._cached(path, 'lstat', self.wrapped.lstat)
+
+    def _readlink(self, path):
+        return self._cached(path, 'readlink', self.wrapped.readlink)
+
+    def _stat(self, path):
+        return self._cached(path, 'stat', self.wrapped.stat)
+
+    def _stat_many(self, paths, follow=True):
+        lookup = 'stat' if follow else 'lstat'
+        results = [None] * len(paths)
+        missing = []
+        for index, path in enumerate(paths):
+            result = self._entry(path).get(lookup)
+            if result is None:
+                missing.append(index)
+            else:
+                results[index] = result
+        self.hits += len(paths) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            fetched = self.wrapped.stat_many([paths[index] for index in missing], follow=follow)
+            for index, result in zip(missing, fetched):
+                self._store(self._entry(paths[index]), lookup, result)
+                results[index] = result
+        return results
+
+    # Read/write
+    # ----------
+
+    def _open_binary(self, path, mode):
+        if helpers.is_readonly_open_mode(mode):
+            return self.wrapped.open_binary(path, mode)
+        with self._changing(path):
+            f = self.wrapped.open_binary(path, mode)
+        return helpers.CloseHookFile(f, on_close=lambda: self._invalidate(path))
+
+    def _open_text(self, path, mode, encoding):
+        if helpers.is_readonly_open_mode(mode):
+            return self.wrapped.open_text(path, mode, encoding)
+        with self._changing(path):
+            f = self.wrapped.open_text(path, mode, encoding)
+        return helpers.CloseHookFile(f, on_close=lambda: self._invalidate(path))
+
+    # Write
+    # -----
+
+    def _chmod(self, path, mode):
+        # Access to paths below a directory may change
+        with self._changing(path, recursive=True):
+            return self.wrapped.chmod(path, mode)
+
+    def _chown(self, path, uid, gid):
+        with self._changing(path, recursive=True):
+            return self.wrapped.chown(path, uid, gid)
+
+    def _mkdir(self, path):
+        with self._changing(path):
+            return self.wrapped.mkdir(path)
+
+    def _symlink(self, link_name, target):
+        # Lookups through the link, e.g of /link/file, now reach the target
+        with self._changing(link_name, recursive=True):
+            return self.wrapped.symlink(link_name, target)
+
+    # Delete
+    # ------
+
+    def _rmdir(self, path):
+        with self._changing(path, recursive=True):
+            return self.wrapped.rmdir(path)
+
+    def _rmtree(self, path):
+        with self._changing(path, recursive=True):
+            return self.wrapped.rmtree(path)
+
+    def _unlink(self, path):
+        # The path may be a symlink to a directory
+        with self._changing(path, recursive=True):
+            return self.wrapped.unlink(path)
+
+
+# }}} /CachingFS
+
+
+# {{{ InstrumentedFS
+# ==================
+
+
+def _recorded(operation):
+    """A WrappingFS method, recorded as ``operation``."""
+    forward = getattr(base.WrappingFS, '_' + operation)
+
+    def method(self, *args, **kwargs):
+        return self.recorder.call(self.label, operation, forward, self, *args, **kwargs)
+    method.__name__ = forward.__name__
+    return method
+
+
+class InstrumentedFS(base.WrappingFS):
+    """Record call counts, errors and latencies of the wrapped filesystem.
+
+    Slot it between layers of a stack to see where time goes; see
+    fslib.instrumentation.
+
+    Args:
+        recorder: instrumentation.Recorder or None, defaults to
+            instrumentation.default_recorder
+        label: str or None, the name of the wrapped layer in the
+            statistics; defaults to its class name, within
+            ``InstrumentedFS(...)``: calls to that layer are also recorded
+            under its class name once instrumentation.enable() is called.
+    """
+
+    def __init__(self, recorder=None, label=None, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder or instrumentation.default_recorder
+        self.label = label or 'InstrumentedFS(%s)' % instrumentation.layer_name(self.wrapped)
+
+    def __repr__(self):
+        return '<InstrumentedFS %s: %r>' % (self.label, self.wrapped)
+
+    # Read
+    _access = _recorded('access')
+    _listdir = _recorded('listdir')
+    _scandir = _recorded('scandir')
+    _list_whiteouts = _recorded('list_whiteouts')
+    _watch = _recorded('watch')
+    _lstat = _recorded('lstat')
+    _readlink = _recorded('readlink')
+    _stat = _recorded('stat')
+    _get_hash = _recorded('get_hash')
+    _stat_many = _recorded('stat_many')
+
+    # Read/write
+    _open_binary = _recorded('open_binary')
+    _open_text = _recorded('open_text')
+
+    # Write
+    _chmod = _recorded('chmod')
+    _chown = _recorded('chown')
+    _mkdir = _recorded('mkdir')
+    _symlink = _recorded('symlink')
+
+    # Delete
+    _rmdir = _recorded('rmdir')
+    _unlink = _recorded('unlink')
+    _rmtree = _recorded('rmtree')
+
+
+# }}} /InstrumentedFS
+
+
 # {{{ Whiteout
 # ============
 
 
 class BaseWhiteoutCache:
+    # Whether lookups may block on I/O
+    blocking_io = False
+    # Whether whole subtrees can be deleted at once, see add_subtree()
+    subtrees = False
+
     def __contains__(self, key):
         raise NotImplementedError()
 
@@ -127,65 +426,524 @@ class BaseWhiteoutCache:
     def add(self, key):
         raise NotImplementedError()
 
+    def add_subtree(self, key):
+        """Delete a path and all paths below it."""
+        raise NotImplementedError()
+
+    def children(self, path):
+        """List the names of deleted entries directly within a directory."""
+        raise NotImplementedError()
+
+    def hidden_children(self, path, names):
+        """Select the deleted names among the contents of a directory."""
+        try:
+            deleted = self.children(path)
+        except NotImplementedError:
+            return {name for name in names if path.child(name) in self}
+        return deleted.intersection(names)
+
+    def keys(self):
+        """Iterate over all deleted paths."""
+        raise NotImplementedError()
+
+    def flush(self):
+        """Write buffered changes, if any, to storage."""
+
     def close(self):
         pass
 
 
+class _ChildrenIndex:
+    """Deleted names, grouped by parent directory."""
+
+    def __init__(self, keys=()):
+        self._names = collections.defaultdict(set)
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        key = helpers.normpath(key)
+        self._names[key.parent].add(key.name)
+
+    def discard(self, key):
+        key = helpers.normpath(key)
+        names = self._names.get(key.parent)
+        if names is not None:
+            names.discard(key.name)
+            if not names:
+                del self._names[key.parent]
+
+    def children(self, path):
+        return set(self._names.get(path, ()))
+
+
 class MemoryWhiteoutCache(BaseWhiteoutCache):
     def __init__(self):
         self.storage = set()
+        self._index = _ChildrenIndex()
 
     def __contains__(self, key):
         return key in self.storage
 
     def __delitem__(self, key):
         self.storage.discard(key)
+        self._index.discard(key)
 
     def add(self, key):
         self.storage.add(key)
+        self._index.add(key)
+
+    def children(self, path):
+        return self._index.children(path)
+
+    def keys(self):
+        return iter(list(self.storage))
 
 
 class DBMWhiteoutCache(BaseWhiteoutCache):
-    def __init__(self, path):
+    """A whiteout cache persisted in a dbm file, with optional write-back buffering.
+
+    All keys are loaded in memory when opening the cache, and lookups are
+    served from there. By default, each change is written through to the
+    dbm file. With max_pending, changes are buffered instead, and written
+    as one batch by flush(): when more than max_pending changes are
+    buffered, when the oldest one is more than flush_interval seconds old
+    (checked on the next change), or when closing the cache.
+
+    Buffered changes are only durable once flushed: they are lost if the
+    process dies before, and an idle cache doesn't flush by itself. Call
+    flush() or close() at points where deletions must survive a crash.
+
+    A batch is first written to a journal file next to the dbm file, then
+    applied; a journal left over by a crash is replayed when opening the
+    cache again, so that either all or none of a batch's changes are
+    visible.
+
+    Args:
+        path: str, the dbm file
+        max_pending: int, the number of changes to buffer; 0 writes each
+            change through.
+        flush_interval: float or None, the maximum age of buffered
+            changes, in seconds.
+    """
+    blocking_io = True
+
+    # Journal records: '+' (added) or '-' (removed), the key, a NUL byte
+    ADDED = b'+'
+    REMOVED = b'-'
+
+    def __init__(self, path, max_pending=0, flush_interval=1.0):
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
         self.storage = dbm.open(path, 'c')
+        self.journal_path = path + '.journal'
+        self._lock = threading.RLock()
+        # key => True (added) or False (removed), not yet written
+        self._pending = {}
+        self._pending_since = None
+        if os.path.exists(self.journal_path):
+            self._replay_journal()
+        self._keys = set(key.decode('utf-8') for key in self.storage.keys())
+        # Built on the first call to children()
+        self._index = None
 
     @classmethod
     def _norm_key(cls, key):
         return key.encode('utf-8')
 
     def __contains__(self, key):
-        return self._norm_key(key) in self.storage
+        return key in self._keys
 
     def __delitem__(self, key):
-        try:
-            del self.storage[self._norm_key(key)]
-        except KeyError:
-            pass
+        with self._lock:
+            if key not in self._keys:
+                # WhiteoutFS removes the whiteout of each path it creates
+                return
+            self._keys.discard(key)
+            if self._index is not None:
+                self._index.discard(key)
+            self._buffer(key, False)
+
+    def add(self, key):
+        with self._lock:
+            self._keys.add(key)
+            if self._index is not None:
+                self._index.add(key)
+            self._buffer(key, True)
+
+    def children(self, path):
+        with self._lock:
+            if self._index is None:
+                self._index = _ChildrenIndex(self._keys)
+            return self._index.children(path)
+
+    def keys(self):
+        with self._lock:
+            return iter(list(self._keys))
+
+    def _buffer(self, key, added):
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending[key] = added
+        if len(self._pending) > self.max_pending or (
+                self.flush_interval is not None
+                and time.monotonic() - self._pending_since >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write buffered changes to the dbm file."""
+        with self._lock:
+            if not self._pending:
+                return
+            changes = [(self._norm_key(key), added) for key, added in self._pending.items()]
+            if len(changes) == 1:
+                # A single dbm write needs no journal
+                self._apply(changes)
+            else:
+                self._write_journal(changes)
+                self._apply(changes)
+                os.unlink(self.journal_path)
+            self._pending.clear()
+
+    def _write_journal(self, changes):
+        # Written aside then renamed: a journal file is always complete.
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(
+                (self.ADDED if added else self.REMOVED) + key + b'\0'
+                for key, added in changes
+            ))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def _replay_journal(self):
+        with open(self.journal_path, 'rb') as f:
+            records = f.read().split(b'\0')[:-1]
+        self._apply([(record[1:], record[:1] == self.ADDED) for record in records])
+        os.unlink(self.journal_path)
+
+    def _apply(self, changes):
+        for key, added in changes:
+            if added:
+                self.storage[key] = 'DELETED'
+            else:
+                try:
+                    del self.storage[key]
+                except KeyError:
+                    pass
+        # Not all dbm modules can sync; others write through on each change
+        if hasattr(self.storage, 'sync'):
+            self.storage.sync()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.storage.close()
+
+
+class SQLiteWhiteoutCache(BaseWhiteoutCache):
+    """A whiteout cache persisted in a SQLite database, with subtree whiteouts.
+
+    Each row hides either a path, a path and all paths below it (see
+    add_subtree()), or only the paths below it: a deleted subtree whose
+    root has been created again. Whether a path is hidden is decided by
+    the row of its closest ancestor; looking it up, or filtering a
+    directory listing, takes one indexed query.
+
+    Args:
+        path: str, the database file
+    """
+    blocking_io = True
+    subtrees = True
+
+    # Row kinds
+    DELETED = 1
+    SUBTREE = 2
+    OPAQUE = 3  # Hides descendants only
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.storage = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.storage.execute('PRAGMA journal_mode=WAL')
+        self.storage.execute(
+            'CREATE TABLE IF NOT EXISTS whiteouts ('
+            ' path TEXT PRIMARY KEY, parent TEXT, kind INTEGER)'
+        )
+        self.storage.execute('CREATE INDEX IF NOT EXISTS whiteouts_parent ON whiteouts (parent)')
+
+    def __getstate__(self):
+        # Reopen the database when unpickled, e.g in another process.
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _closest(self, lineage):
+        """The (path, kind) row of the closest path of a lineage, or None."""
+        return self.storage.execute(
+            'SELECT path, kind FROM whiteouts WHERE path IN (%s) ORDER BY length(path) DESC LIMIT 1'
+            % ', '.join('?' * len(lineage)),
+            lineage,
+        ).fetchone()
+
+    def _hides(self, key, row):
+        """Whether the closest row on the lineage of a key hides it."""
+        if row is None:
+            return False
+        path, kind = row
+        return kind != self.OPAQUE or path != key
+
+    def _set(self, key, kind):
+        key = helpers.normpath(key)
+        self.storage.execute(
+            'INSERT OR REPLACE INTO whiteouts (path, parent, kind) VALUES (?, ?, ?)',
+            (str(key), str(key.parent), kind),
+        )
+
+    def __contains__(self, key):
+        key = helpers.normpath(key)
+        with self._lock:
+            return self._hides(key, self._closest(key.lineage))
+
+    def __delitem__(self, key):
+        key = helpers.normpath(key)
+        with self._lock, self.storage:
+            self.storage.execute('BEGIN')
+            row = self._closest(key.lineage)
+            if row is None:
+                return
+            path, kind = row
+            if path == key and kind == self.DELETED:
+                self.storage.execute('DELETE FROM whiteouts WHERE path = ?', (key,))
+            elif kind != self.DELETED:
+                # The key is visible again, but not what was below it
+                self._set(key, self.OPAQUE)
 
     def add(self, key):
-        self.storage[self._norm_key(key)] = 'DELETED'
+        key = helpers.normpath(key)
+        with self._lock, self.storage:
+            self.storage.execute('BEGIN')
+            row = self.storage.execute('SELECT kind FROM whiteouts WHERE path = ?', (key,)).fetchone()
+            # Keep hiding what was below an opaque path
+            self._set(key, self.SUBTREE if row is not None and row[0] == self.OPAQUE else self.DELETED)
+
+    def add_subtree(self, key):
+        key = helpers.normpath(key)
+        prefix = key if key == ROOT else key + '/'
+        with self._lock, self.storage:
+            self.storage.execute('BEGIN')
+            # '0' follows '/': all paths below the key sort within [prefix, prefix[:-1] + '0')
+            self.storage.execute(
+                'DELETE FROM whiteouts WHERE path >= ? AND path < ? AND path != ?',
+                (prefix, prefix[:-1] + '0', key),
+            )
+            self._set(key, self.SUBTREE)
+
+    def children(self, path):
+        path = helpers.normpath(path)
+        with self._lock:
+            if self._closest(path.lineage) is not None:
+                # All names are hidden, except some: they can't be listed.
+                raise NotImplementedError()
+            rows = self.storage.execute(
+                'SELECT path FROM whiteouts WHERE parent = ? AND kind != ?', (path, self.OPAQUE),
+            ).fetchall()
+        return {helpers.normpath(row[0]).name for row in rows}
+
+    def hidden_children(self, path, names):
+        path = helpers.normpath(path)
+        lineage = path.lineage
+        with self._lock:
+            rows = self.storage.execute(
+                'SELECT path, kind, parent = ? FROM whiteouts WHERE path IN (%s) OR parent = ?'
+                % ', '.join('?' * len(lineage)),
+                (path,) + lineage + (path,),
+            ).fetchall()
+        closest = max((row[:2] for row in rows if not row[2]), key=lambda row: len(row[0]), default=None)
+        hidden_by_default = closest is not None
+        kinds = {helpers.normpath(child).name: kind for child, kind, is_child in rows if is_child}
+        return {
+            name for name in names
+            if (kinds[name] != self.OPAQUE if name in kinds else hidden_by_default)
+        }
+
+    def keys(self):
+        with self._lock:
+            rows = self.storage.execute(
+                'SELECT path FROM whiteouts WHERE kind != ?', (self.OPAQUE,),
+            ).fetchall()
+        return iter([row[0] for row in rows])
 
     def close(self):
         self.storage.close()
 
 
+BloomInfo = collections.namedtuple(
+    'BloomInfo', ['hits', 'misses', 'false_positives', 'capacity', 'error_rate', 'nbytes'],
+)
+
+
+class BloomWhiteoutCache(BaseWhiteoutCache):
+    """A Bloom filter in front of another whiteout cache.
+
+    Most lookups are for paths that were never deleted: the filter answers
+    them without querying the wrapped cache. The filter is built from the
+    wrapped cache's keys when created, and updated on add(); it is rebuilt,
+    twice as large, once it holds more than its capacity, and after many
+    removals (removed keys stay in the filter until then).
+
+    Args:
+        cache: BaseWhiteoutCache, the wrapped cache
+        capacity: int or None, the initial number of keys to size the
+            filter for; defaults to twice the current number of keys.
+        error_rate: float, the rate of false positives at capacity
+        max_bytes: int or None, a bound on the size of the filter
+    """
+
+    MIN_CAPACITY = 1024
+
+    def __init__(self, cache, capacity=None, error_rate=0.01, max_bytes=None):
+        if cache.subtrees:
+            # Paths below a deleted subtree aren't keys of the cache
+            raise ValueError("Can't filter lookups of %r, which has subtree whiteouts." % cache)
+        self.cache = cache
+        self.error_rate = error_rate
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.false_positives = 0
+        self._lock = threading.Lock()
+        self._removed = 0
+        self._filter = None
+        self.rebuild(capacity)
+
+    @property
+    def blocking_io(self):
+        return self.cache.blocking_io
+
+    def rebuild(self, capacity=None):
+        """Rebuild the filter from the wrapped cache's keys."""
+        with self._lock:
+            keys = list(self.cache.keys())
+            if capacity is None:
+                capacity = max(self.MIN_CAPACITY, 2 * len(keys))
+            bloom = helpers.BloomFilter(capacity, error_rate=self.error_rate, max_bytes=self.max_bytes)
+            for key in keys:
+                bloom.add(key)
+            self._filter = bloom
+            self._removed = 0
+
+    def __contains__(self, key):
+        if key not in self._filter:
+            self.misses += 1
+            return False
+        if key in self.cache:
+            self.hits += 1
+            return True
+        self.false_positives += 1
+        return False
+
+    def __delitem__(self, key):
+        # WhiteoutFS removes the whiteout of each path it creates: only
+        # count actual removals towards a rebuild.
+        if key not in self._filter or key not in self.cache:
+            return
+        del self.cache[key]
+        self._removed += 1
+        if self._removed > self._filter.capacity // 2:
+            self.rebuild(self._filter.capacity)
+
+    def add(self, key):
+        self.cache.add(key)
+        with self._lock:
+            self._filter.add(key)
+            full = self._filter.count > self._filter.capacity
+        if full:
+            self.rebuild(2 * self._filter.capacity)
+
+    def children(self, path):
+        return self.cache.children(path)
+
+    def keys(self):
+        return self.cache.keys()
+
+    def info(self):
+        """Statistics on the filter, as a BloomInfo."""
+        return BloomInfo(
+            hits=self.hits,
+            misses=self.misses,
+            false_positives=self.false_positives,
+            capacity=self._filter.capacity,
+            error_rate=self.error_rate,
+            nbytes=self._filter.nbytes,
+        )
+
+    def flush(self):
+        self.cache.flush()
+
+    def close(self):
+        self.cache.close()
+
+
 class WhiteoutFS(base.WrappingFS):
     """A filesystem backend that holds a "whiteout cache".
 
     All creations/updates/etc. will be forwarded to the wrapped FS,
     but deletions are handled at this level.
+
+    Args:
+        whiteout_cache: BaseWhiteoutCache, storage for deleted paths;
+            owned by the WhiteoutFS, which closes it (see close()).
+        live_dirs_cache_size: int or None, the number of directories
+            already checked as existing (and not deleted) to remember.
+            The cache is invalidated by deletions and creations going
+            through this WhiteoutFS only; they forget the directories
+            at or below the changed path, which may be a symlink.
     """
 
     _FEATURES = (
         base.BaseFS.FEATURE_WHITEOUT,
     )
 
-    def __init__(self, whiteout_cache, **kwargs):
+    def __init__(self, whiteout_cache, live_dirs_cache_size=1024, **kwargs):
         super().__init__(**kwargs)
         self.whiteout_cache = whiteout_cache
+        self._closed = False
+        self._events = events.Hub()
+        self._live_dirs = None
+        if live_dirs_cache_size:
+            self._live_dirs = helpers.PathLRUCache(live_dirs_cache_size)
 
     def __del__(self):
-        self.whiteout_cache.close()
+        # __init__ may have failed before the cache was set
+        if not getattr(self, '_closed', True):
+            self.close()
+
+    def close(self):
+        """Close the whiteout cache, once."""
+        if not self._closed:
+            self._closed = True
+            self.whiteout_cache.close()
+
+    def has_feature(self, feature):
+        if feature == self.FEATURE_BLOCKING_IO and self.whiteout_cache.blocking_io:
+            return True
+        if feature == self.FEATURE_SUBTREE_WHITEOUT:
+            return self.whiteout_cache.subtrees
+        return super().has_feature(feature)
+
+    def cache_info(self):
+        """Statistics on the live directories cache, as a CacheInfo or None."""
+        if self._live_dirs is None:
+            return None
+        return self._live_dirs.info()
+
+    def _forget_dirs(self, path):
+        """Forget the live directories at or below a path."""
+        if self._live_dirs is not None:
+            self._live_dirs.pop_tree(path)
 
     def _check_component(self, path, ensure_dir=True):
         """Check whether a given path may be accessed.
@@ -198,19 +956,53 @@ class WhiteoutFS(base.WrappingFS):
         if path in self.whiteout_cache:
             raise exceptions.DeletedObjectError(path)
 
-        if ensure_dir and not self.wrapped.isdir(path) and path != ROOT:
-            raise exceptions.ENOTDIR(path)
+        if ensure_dir:
+            if not self.wrapped.isdir(path) and path != ROOT:
+                raise exceptions.ENOTDIR(path)
+            if self._live_dirs is not None:
+                self._live_dirs[path] = True
 
     def _check_path(self, path):
         """Check whether a path, and all its parents, exists."""
-        for part in self.iter_path(path):
-            self._check_component(part, ensure_dir=(path != part))
+        lineage = helpers.normpath(path).lineage
+        start = 0
+        if self._live_dirs is not None:
+            # Resume from the innermost directory already known to be live
+            for depth in range(len(lineage) - 1, -1, -1):
+                if self._live_dirs.get(lineage[depth]):
+                    start = depth + 1
+                    break
+
+        for part in lineage[start:]:
+            self._check_component(part, ensure_dir=(part is not lineage[-1]))
+
+    def _check_parents(self, path, checked):
+        """Check the parents of a path, sharing results across a batch.
+
+        Args:
+            checked: dict, mapping already checked directories to None
+                or the error raised for them; updated in place.
+
+        Returns:
+            None, or the OSError raised for the first invalid parent.
+        """
+        for part in path.lineage[:-1]:
+            if part not in checked:
+                checked[part] = None
+                if self._live_dirs is None or not self._live_dirs.get(part):
+                    try:
+                        self._check_component(part)
+                    except OSError as e:
+                        checked[part] = e
+            if checked[part] is not None:
+                return checked[part]
+        return None
 
     @contextlib.contextmanager
     def _manage_whiteout(self, path, for_creation):
         """Handle pre-open checks."""
         if for_creation:
-            self._check_path(os.path.dirname(path))  # Ensure the parent exists
+            self._check_path(path.parent)  # Ensure the parent exists
         else:
             self._check_path(path)  # Ensure the file exists
         yield
@@ -231,11 +1023,25 @@ class WhiteoutFS(base.WrappingFS):
 
         return self.wrapped.access(path, mode, follow=follow)
 
+    def _visible(self, path, items, name=lambda item: item):
+        """Filter out the deleted items among the contents of a directory."""
+        items = list(items)
+        hidden = self.whiteout_cache.hidden_children(path, [name(item) for item in items])
+        return [item for item in items if name(item) not in hidden]
+
     def _listdir(self, path):
         with self._manage_whiteout(path, for_creation=False):
-            for item in self.wrapped.listdir(path):
-                if item not in self.whiteout_cache:
-                    yield item
+            return self._visible(path, self.wrapped.listdir(path))
+
+    def _scandir(self, path):
+        with self._manage_whiteout(path, for_creation=False):
+            return self._visible(path, self.wrapped.scandir(path), name=operator.attrgetter('name'))
+
+    def _list_whiteouts(self, path):
+        with self._manage_whiteout(path, for_creation=False):
+            names = set(self.whiteout_cache.children(path))
+        names.update(self.wrapped.list_whiteouts(path))
+        return names
 
     def _lstat(self, path):
         with self._manage_whiteout(path, for_creation=False):
@@ -249,6 +1055,29 @@ class WhiteoutFS(base.WrappingFS):
         with self._manage_whiteout(path, for_creation=False):
             return self.wrapped.stat(path)
 
+    def _get_hash(self, path, method, chunk_size):
+        with self._manage_whiteout(path, for_creation=False):
+            return self.wrapped.get_hash(path, method, chunk_size)
+
+    def _stat_many(self, paths, follow=True):
+        results = [None] * len(paths)
+        checked = {}
+        visible = []
+        for index, path in enumerate(paths):
+            error = self._check_parents(path, checked)
+            if error is None and path in self.whiteout_cache:
+                error = exceptions.DeletedObjectError(path)
+            if error is None:
+                visible.append(index)
+            else:
+                results[index] = error
+
+        if visible:
+            stats = self.wrapped.stat_many([paths[index] for index in visible], follow=follow)
+            for index, result in zip(visible, stats):
+                results[index] = result
+        return results
+
     # Read/write
     # ----------
 
@@ -280,10 +1109,12 @@ class WhiteoutFS(base.WrappingFS):
             return self.wrapped.chown(path, uid, gid)
 
     def _mkdir(self, path):
+        self._forget_dirs(path)
         with self._manage_whiteout(path, for_creation=True):
             return self.wrapped.mkdir(path)
 
     def _symlink(self, link_name, target):
+        self._forget_dirs(link_name)
         with self._manage_whiteout(link_name, for_creation=True):
             return self.wrapped.symlink(link_name, target)
 
@@ -292,13 +1123,42 @@ class WhiteoutFS(base.WrappingFS):
 
     def _unlink(self, path):
         self._check_path(path)
+        # The path may be a symlink to a directory
+        self._forget_dirs(path)
         self.whiteout_cache.add(path)
+        self._events.emit(events.DELETE, path)
 
     def _rmdir(self, path):
         contents = any(self.listdir(path))
         if contents:
             raise exceptions.ENOTEMPTY(path)
+        self._forget_dirs(path)
         self.whiteout_cache.add(path)
+        self._events.emit(events.DELETE, path)
+
+    def _rmtree(self, path):
+        if not self.whiteout_cache.subtrees:
+            return super()._rmtree(path)
+        self._check_path(path)
+        if not self.wrapped.isdir(path):
+            raise exceptions.ENOTDIR(path)
+        self._forget_dirs(path)
+        self.whiteout_cache.add_subtree(path)
+        # Entries below aren't reported one by one
+        self._events.emit(events.DELETE, path)
+
+    # Changes
+    # -------
+
+    def _watch(self, path, recursive, emit):
+        # Deletions happen at this level, other changes below
+        wrapped_watch = self.wrapped.watch(path, recursive=recursive, callback=emit)
+        unsubscribe = self._events.subscribe(path, recursive, emit)
+
+        def stop():
+            unsubscribe()
+            wrapped_watch.close()
+        return stop
 
 
 # }}} /Whiteout
@@ -319,19 +1179,244 @@ _STATUS_EXISTS = 'exists'
 
 _PStat = collections.namedtuple('_PStat', ['stats', 'status'])
 
+# A cached outcome of UnionFS._get_read_branch(); branch is None for ENOENT.
+_Resolution = collections.namedtuple('_Resolution', ['branch', 'pstat'])
+
+
+def _with_size(stats, size):
+    """Copy an os.stat_result, with another st_size."""
+    values = list(stats[:10])
+    values[stat.ST_SIZE] = size
+    extra = {
+        name: getattr(stats, name)
+        for name in ('st_atime', 'st_mtime', 'st_ctime', 'st_atime_ns', 'st_mtime_ns', 'st_ctime_ns')
+        if hasattr(stats, name)
+    }
+    return os.stat_result(values, extra)
+
+
+class _RangeCopy:
+    """A file being copied up from a lower branch, block by block.
+
+    A block is copied ("materialized") to a local staging file only when
+    partially overwritten, and blocks not yet materialized are read from
+    the lower file. The writable branch is left alone until finish() writes
+    the whole file there: meanwhile, the lower file stays visible in the
+    other branches, and an unfinished copy loses its writes, never the
+    lower file's content.
+
+    Attributes:
+        lower_size (int): the leading bytes that may still be read from
+            the lower file.
+        upper_size (int): the bytes written so far to the staging file.
+        materialized (set of int): the blocks present in the staging file.
+        open_handles (int): the number of open _RangeCopyFile.
+    """
+
+    def __init__(self, path, lower_branch, lower_size, block_size):
+        self.path = path
+        self.lower_branch = lower_branch
+        self.block_size = block_size
+        self.lower_size = lower_size
+        self.upper_size = 0
+        self.materialized = set()
+        self.open_handles = 0
+        self.staging = tempfile.TemporaryFile()
+
+    @property
+    def size(self):
+        return max(self.lower_size, self.upper_size)
+
+    def is_lower(self, block):
+        """Whether a block should be read from the lower file."""
+        return block not in self.materialized and block * self.block_size < self.lower_size
+
+    def materialize(self, block, lower):
+        start = block * self.block_size
+        end = min(start + self.block_size, self.lower_size)
+        lower.seek(start)
+        self.staging.seek(start)
+        self.staging.write(lower.read(end - start))
+        self.upper_size = max(self.upper_size, end)
+        self.materialized.add(block)
+
+    def readinto(self, pos, view, lower):
+        """Read the content found at ``pos`` into a memoryview.
+
+        Returns:
+            int, the number of bytes read; 0 at the end of the file.
+        """
+        size = min(len(view), max(0, self.size - pos))
+        done = 0
+        while done < size:
+            offset = pos + done
+            block, block_offset = divmod(offset, self.block_size)
+            length = min(self.block_size - block_offset, size - done)
+            source = self.staging
+            if self.is_lower(block) and offset < self.lower_size:
+                source = lower
+                length = min(length, self.lower_size - offset)
+            source.seek(offset)
+            read = source.readinto(view[done:done + length])
+            if not read:
+                # A hole in the staging file
+                view[done:done + length] = bytes(length)
+                read = length
+            done += read
+        return done
+
+    def finish(self, upper):
+        """Write the whole file to ``upper``, a file open for writing."""
+        buffer = memoryview(bytearray(self.block_size))
+        with self.lower_branch.fs.open_binary(self.path, 'rb') as lower:
+            pos = 0
+            while pos < self.size:
+                read = self.readinto(pos, buffer, lower)
+                upper.write(buffer[:read])
+                pos += read
+        self.close()
+
+    def close(self):
+        """Drop the staging file."""
+        self.staging.close()
+
+
+class _RangeCopyFile(io.RawIOBase):
+    """An open file under a _RangeCopy, reading from the lower file and the staging file."""
+
+    def __init__(self, range_copy, mode, on_close):
+        super().__init__()
+        self._copy = range_copy
+        self._readable = 'r' in mode or '+' in mode
+        self._writable = not helpers.is_readonly_open_mode(mode)
+        self._append = 'a' in mode
+        self._on_close = on_close
+        self._pos = 0
+        self._lower = range_copy.lower_branch.fs.open_binary(range_copy.path, 'rb')
+        range_copy.open_handles += 1
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._lower.close()
+            super().close()
+        finally:
+            self._copy.open_handles -= 1
+            self._on_close(self._copy)
+
+    def readable(self):
+        return self._readable
+
+    def writable(self):
+        return self._writable
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._readable:
+            raise io.UnsupportedOperation("File not open for reading")
+        read = self._copy.readinto(self._pos, memoryview(b).cast('B'), self._lower)
+        self._pos += read
+        return read
+
+    def write(self, b):
+        if not self._writable:
+            raise io.UnsupportedOperation("File not open for writing")
+        data = memoryview(b).cast('B')
+        if not data:
+            return 0
+        if self._append:
+            self._pos = self._copy.size
+        start, end = self._pos, self._pos + len(data)
+        block_size = self._copy.block_size
+        for block in range(start // block_size, (end - 1) // block_size + 1):
+            if self._copy.is_lower(block):
+                block_start = block * block_size
+                block_end = min(block_start + block_size, self._copy.lower_size)
+                if start <= block_start and block_end <= end:
+                    # Fully overwritten, no need to copy it.
+                    self._copy.materialized.add(block)
+                else:
+                    self._copy.materialize(block, self._lower)
+        self._copy.staging.seek(start)
+        self._copy.staging.write(data)
+        self._copy.upper_size = max(self._copy.upper_size, end)
+        self._pos = end
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._copy.size
+        if offset < 0:
+            raise exceptions.EINVAL(self._copy.path)
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def truncate(self, size=None):
+        if not self._writable:
+            raise io.UnsupportedOperation("File not open for writing")
+        if size is None:
+            size = self._pos
+        self._copy.staging.truncate(size)
+        self._copy.lower_size = min(self._copy.lower_size, size)
+        self._copy.upper_size = size
+        return size
+
 
 class UnionFS(base.BaseFS):
+    """Merge several branches into a single view.
+
+    Args:
+        strict: bool, whether failures to copy attributes on copy-up
+            should be raised.
+        cache_size: int or None, the number of path resolutions (which
+            branch holds a path, and its stats) to keep in a LRU cache.
+            The cache is only invalidated by writes going through this
+            UnionFS; branches MUST NOT be altered behind its back.
+        copy_up: str, how files from a lower branch are copied up when
+            opened for update ('r+', 'a'):
+            - COPY_UP_FULL: the whole file is copied before opening it;
+            - COPY_UP_ON_CLOSE: only the blocks being partially written
+              are copied, until the last handle is closed;
+            - COPY_UP_LAZY: as COPY_UP_ON_CLOSE, but the copy is only
+              completed by finish_copy_ups(), or when removing a branch.
+            Partial copies are staged in a local temporary file, and only
+            written to the writable branch once completed: until then,
+            changes are only seen through this UnionFS, and are lost if
+            it goes away first.
+        copy_up_block_size: int, the block size for partial copy-ups.
+    """
     _FEATURES = (
         base.BaseFS.FEATURE_WHITEOUT,
     )
 
-    def __init__(self, strict=False, **kwargs):
+    COPY_UP_FULL = 'full'
+    COPY_UP_ON_CLOSE = 'close'
+    COPY_UP_LAZY = 'lazy'
+
+    def __init__(self, strict=False, cache_size=None, copy_up=COPY_UP_FULL, copy_up_block_size=64 * 1024,
+                 **kwargs):
         super().__init__(**kwargs)
         self.strict = strict
+        self.copy_up = copy_up
+        self.copy_up_block_size = copy_up_block_size
+        # Files partially copied up, by path
+        self._range_copies = {}
         self._branches = {}
         self._sorted_branches = []
         self._write_branches = []
         self._next_branch_ref = 0
+        self._resolution_cache = None
+        if cache_size:
+            self._resolution_cache = helpers.PathLRUCache(cache_size)
+        self._events = events.Hub()
 
     def __repr__(self):
         return '<UnionFS: %r>' % ([b.fs for b in self._sorted_branches],)
@@ -339,6 +1424,8 @@ class UnionFS(base.BaseFS):
     def has_feature(self, feature):
         if feature == self.FEATURE_READONLY:
             return not self._write_branches
+        elif feature == self.FEATURE_BLOCKING_IO:
+            return any(branch.fs.has_feature(feature) for branch in self._sorted_branches)
         return super().has_feature(feature)
 
     # Branches management
@@ -352,6 +1439,8 @@ class UnionFS(base.BaseFS):
             for branch in self._sorted_branches
             if branch.writable
         ]
+        if self._resolution_cache is not None:
+            self._resolution_cache.clear()
 
     def add_branch(self, fs, ref, rank=None, writable=False):
         """Add a branch to the UnionFS.
@@ -392,9 +1481,32 @@ class UnionFS(base.BaseFS):
         self._update_branches_cache()
 
     def remove_branch(self, ref):
+        self.finish_copy_ups()
         del self._branches[ref]
         self._update_branches_cache()
 
+    # Resolution cache
+    # ----------------
+
+    def cache_info(self):
+        """Statistics on the path resolution cache, as a CacheInfo or None."""
+        if self._resolution_cache is None:
+            return None
+        return self._resolution_cache.info()
+
+    def _invalidate_path(self, path):
+        """Forget cached resolutions for a path and all its parents."""
+        if self._resolution_cache is None:
+            return
+        for part in self.iter_path(path):
+            self._resolution_cache.pop(part)
+
+    def _invalidate_tree(self, path):
+        """Forget cached resolutions for a path, its parents and all paths below it."""
+        self._invalidate_path(path)
+        if self._resolution_cache is not None:
+            self._resolution_cache.pop_tree(path)
+
     # Path management
     # ---------------
 
@@ -432,6 +1544,133 @@ class UnionFS(base.BaseFS):
         raise exceptions.ENOENT(path)
 
     def _get_read_branch(self, path):
+        if self._resolution_cache is None:
+            return self._resolve_read_branch(path)
+
+        resolution = self._resolution_cache.get(path)
+        if resolution is None:
+            try:
+                outcome = self._resolve_read_branch(path)
+            except OSError as e:
+                resolution = self._make_resolution(e)
+                if resolution is None or not self._is_cacheable(path, e):
+                    raise
+            else:
+                if not self._is_cacheable(path, outcome):
+                    return outcome
+                resolution = self._make_resolution(outcome)
+            self._resolution_cache[path] = resolution
+
+        outcome = self._resolution_outcome(path, resolution)
+        if isinstance(outcome, OSError):
+            raise outcome
+        return outcome
+
+    @staticmethod
+    def _make_resolution(outcome):
+        """Convert the outcome of a lookup to a _Resolution.
+
+        Args:
+            outcome: a (branch, stats) tuple, or the OSError raised
+
+        Returns:
+            _Resolution, or None if the outcome shouldn't be cached.
+        """
+        if isinstance(outcome, exceptions.DeletedObjectError):
+            return _Resolution(branch=None, pstat=_PStat(stats=None, status=_STATUS_DELETED))
+        elif isinstance(outcome, OSError):
+            if outcome.errno != errno.ENOENT:
+                return None
+            return _Resolution(branch=None, pstat=_PStat(stats=None, status=_STATUS_UNKNOWN))
+        branch, stats = outcome
+        return _Resolution(branch=branch, pstat=_PStat(stats=stats, status=_STATUS_EXISTS))
+
+    def _is_cacheable(self, path, outcome):
+        """Whether the outcome of a lookup may be cached.
+
+        The stats of a symlink, or the ENOENT of a dangling one, are those
+        of its target: they change with paths other than the link's.
+
+        Args:
+            outcome: a (branch, stats) tuple, or the OSError raised
+        """
+        if isinstance(outcome, exceptions.DeletedObjectError):
+            return True
+        elif isinstance(outcome, OSError):
+            # Maybe a dangling symlink, in any branch
+            branches = self._sorted_branches
+        else:
+            branches = [outcome[0]]
+
+        for branch in branches:
+            try:
+                lstats = branch.fs.lstat(path)
+            except exceptions.DeletedObjectError:
+                return True
+            except OSError:
+                continue
+            return not stat.S_ISLNK(lstats.st_mode)
+        return True
+
+    @staticmethod
+    def _resolution_outcome(path, resolution):
+        """Convert a _Resolution back to a (branch, stats) tuple or an OSError."""
+        if resolution.pstat.status == _STATUS_DELETED:
+            return exceptions.DeletedObjectError(path)
+        elif resolution.pstat.status == _STATUS_UNKNOWN:
+            return exceptions.ENOENT(path)
+        return resolution.branch, resolution.pstat.stats
+
+    def _get_read_branches(self, paths):
+        """Find the read branches of several paths.
+
+        Each branch is probed once for all paths not yet found in the
+        branches above it.
+
+        Returns:
+            list, holding for each path a (branch, stats) tuple or an OSError.
+        """
+        results = [None] * len(paths)
+        pending = []
+        for index, path in enumerate(paths):
+            resolution = None
+            if self._resolution_cache is not None:
+                resolution = self._resolution_cache.get(path)
+            if resolution is None:
+                pending.append(index)
+            else:
+                results[index] = self._resolution_outcome(path, resolution)
+        lookups = pending
+
+        for branch in self._sorted_branches:
+            if not pending:
+                break
+            stats = branch.fs.stat_many([paths[index] for index in pending])
+            missing = []
+            for index, result in zip(pending, stats):
+                if isinstance(result, exceptions.DeletedObjectError):
+                    # Propagate for proper FEATURE_WHITEOUT behavior
+                    results[index] = result
+                elif isinstance(result, OSError) and result.errno == errno.ENOENT:
+                    # The file or one of its parent doesn't exist in this branch
+                    missing.append(index)
+                elif isinstance(result, OSError):
+                    results[index] = result
+                else:
+                    results[index] = (branch, result)
+            pending = missing
+
+        for index in pending:
+            results[index] = exceptions.ENOENT(paths[index])
+
+        if self._resolution_cache is not None:
+            for index in lookups:
+                resolution = self._make_resolution(results[index])
+                if resolution is not None and self._is_cacheable(paths[index], results[index]):
+                    self._resolution_cache[paths[index]] = resolution
+        return results
+
+    def _resolve_read_branch(self, path):
         for branch in self._sorted_branches:
             try:
                 stats = branch.fs.stat(path)
@@ -493,7 +1732,7 @@ class UnionFS(base.BaseFS):
             else:
                 with old_branch.fs.open_binary(path, 'rb') as src:
                     with target_branch.fs.open_binary(path, 'wb') as dst:
-                        dst.write(src.read())
+                        shutil.copyfileobj(src, dst, base.COPY_CHUNK_SIZE)
 
         else:
             raise exceptions.FSError("Can't copy inode at %r" % path)
@@ -506,7 +1745,7 @@ class UnionFS(base.BaseFS):
 
     def _copy_on_write(self, target_path, branch, expected=_EXIST_ANY, for_overwrite=False):
         # 1. Ensure the parent dir is valid somewhere
-        parent = os.path.dirname(target_path)
+        parent = target_path.parent
         if not self.isdir(parent):
             raise exceptions.ENOTDIR(parent)
 
@@ -526,12 +1765,13 @@ class UnionFS(base.BaseFS):
             if e.errno != errno.ENOENT:
                 raise
         else:
-            self._copy_object(
-                path=target_path,
-                target_branch=branch,
-                old_branch=old_branch,
-                for_overwrite=for_overwrite,
-            )
+            if old_branch is not branch:
+                self._copy_object(
+                    path=target_path,
+                    target_branch=branch,
+                    old_branch=old_branch,
+                    for_overwrite=for_overwrite,
+                )
 
     def _get_write_branch(self, path, **kwargs):
         # XXX: Could handle multiple writable branches.
@@ -539,6 +1779,8 @@ class UnionFS(base.BaseFS):
             raise exceptions.EACCES(path)
         branch = self._write_branches[0]
         self._copy_on_write(path, branch, **kwargs)
+        # The path, and maybe its parents, now live in the write branch
+        self._invalidate_path(path)
         return branch
 
     # Read
@@ -552,6 +1794,9 @@ class UnionFS(base.BaseFS):
                 return False
             # Worse!
             raise
+        if mode == os.F_OK:
+            # Already known to exist in that branch
+            return True
         return branch.fs.access(path, mode, follow=follow)
 
     def _get_dir_branches(self, path):
@@ -576,39 +1821,71 @@ class UnionFS(base.BaseFS):
                     # Not readable there, shadows deeper branches.
                     break
 
-    def _listdir(self, path):
+    def _merge_listings(self, path, list_branch):
+        """Merge the listings of a directory from all branches.
+
+        Names listed by a branch are hidden, in deeper branches, by those
+        whited out in that branch. For whiteout-capable branches unable to
+        list their whiteouts, each candidate name is stat()ed instead.
+
+        Args:
+            list_branch: callable(branch) => dict(name => item), listing
+                the directory within a branch
+
+        Returns:
+            (members, hidden): the visible items, as a dict(name => item),
+                and the set of whited out names
+        """
         branches = list(self._get_dir_branches(path))
         if not branches:
             raise exceptions.ENOENT(path)
 
-        seen = set()
-        members = set()
-        for rank, branch in enumerate(branches):
-            for member in branch.fs.listdir(path):
-                if member in seen:
-                    continue
-                seen.add(member)
-
-                valid = True
-                member_path = os.path.join(path, member)
-                for higher_branch in branches[:rank]:
-                    status = self._get_branch_pstat(higher_branch, member_path)
-                    if status == _STATUS_DELETED:
-                        valid = False
-                        break
-                    # Can't be _STATUS_EXISTS (would already appear in 'seen'),
+        members = {}
+        hidden = set()
+        opaque_branches = []
+        for branch in branches:
+            listing = list_branch(branch)
+            candidates = listing.keys() - members.keys() - hidden
+            for higher_branch in opaque_branches:
+                for name in list(candidates):
+                    pstat = self._get_branch_pstat(higher_branch, path.child(name))
+                    # Can't be _STATUS_EXISTS (would already be in 'members'),
                     # Can't be _STATUS_NOPERM (stat() always possible if R_OK & X_OK),
                     # Can't be _STATUS_INVALID (stat() always possible if isdir())
-                    assert status == _STATUS_UNKNOWN
+                    if pstat.status == _STATUS_DELETED:
+                        candidates.discard(name)
+                        hidden.add(name)
+            members.update((name, listing[name]) for name in candidates)
+
+            try:
+                hidden |= set(branch.fs.list_whiteouts(path)) - members.keys()
+            except NotImplementedError:
+                opaque_branches.append(branch)
 
-                if valid:
-                    members.add(member)
+        return members, hidden
 
+    def _listdir(self, path):
+        members, _hidden = self._merge_listings(
+            path, lambda branch: dict.fromkeys(branch.fs.listdir(path)))
         return list(members)
 
+    def _scandir(self, path):
+        members, _hidden = self._merge_listings(
+            path, lambda branch: {entry.name: entry for entry in branch.fs.scandir(path)})
+        return [
+            # Files being copied up have merged stats
+            base.DirEntry(self, entry.path) if entry.path in self._range_copies else entry
+            for entry in members.values()
+        ]
+
+    def _list_whiteouts(self, path):
+        _members, hidden = self._merge_listings(
+            path, lambda branch: dict.fromkeys(branch.fs.listdir(path)))
+        return hidden
+
     def _lstat(self, path):
         branch, _stats = self._get_read_branch(path)
-        return branch.fs.lstat(path)
+        return self._range_copy_stats(path, branch.fs.lstat(path))
 
     def _readlink(self, path):
         branch, _stats = self._get_read_branch(path)
@@ -616,43 +1893,193 @@ class UnionFS(base.BaseFS):
 
     def _stat(self, path):
         _branch, stats = self._get_read_branch(path)
-        return stats
+        return self._range_copy_stats(path, stats)
+
+    def _get_hash(self, path, method, chunk_size):
+        if path in self._range_copies:
+            return super()._get_hash(path, method, chunk_size)
+        branch, _stats = self._get_read_branch(path)
+        return branch.fs.get_hash(path, method, chunk_size)
+
+    def _stat_many(self, paths, follow=True):
+        results = self._get_read_branches(paths)
+        if follow:
+            return [
+                result if isinstance(result, OSError) else self._range_copy_stats(path, result[1])
+                for path, result in zip(paths, results)
+            ]
+
+        # Symlinks are resolved by the stat() calls: lstat() on each branch.
+        by_branch = collections.defaultdict(list)
+        for index, result in enumerate(results):
+            if not isinstance(result, OSError):
+                by_branch[result[0]].append(index)
+        for branch, indices in by_branch.items():
+            stats = branch.fs.stat_many([paths[index] for index in indices], follow=False)
+            for index, result in zip(indices, stats):
+                if not isinstance(result, OSError):
+                    result = self._range_copy_stats(paths[index], result)
+                results[index] = result
+        return results
+
+    # Partial copy-up
+    # ---------------
+
+    def finish_copy_ups(self):
+        """Complete all partial copy-ups."""
+        for range_copy in list(self._range_copies.values()):
+            self._finish_range_copy(range_copy)
+
+    def _finish_range_copy(self, range_copy):
+        path = range_copy.path
+        # The attributes of the visible file, maybe already copied up by chmod()
+        _branch, old_stat = self._get_read_branch(path)
+        branch = self._write_branches[0]
+        self._copy_tree(path.parent, branch)
+        # Only now does the copy hide the lower file.
+        with branch.fs.open_binary(path, 'wb') as upper:
+            range_copy.finish(upper)
+        self._copy_stat(path, branch, old_stat)
+        del self._range_copies[path]
+        self._invalidate_path(path)
+
+    def _drop_range_copy(self, path):
+        """Forget the partial copy-up of a file being removed or overwritten."""
+        range_copy = self._range_copies.pop(path, None)
+        if range_copy is not None and not range_copy.open_handles:
+            range_copy.close()
+
+    def _range_copy_closed(self, range_copy):
+        if range_copy.open_handles:
+            return
+        if self._range_copies.get(range_copy.path) is not range_copy:
+            # Dropped while open
+            range_copy.close()
+        elif self.copy_up == self.COPY_UP_ON_CLOSE:
+            self._finish_range_copy(range_copy)
+
+    def _range_copy_stats(self, path, stats):
+        range_copy = self._range_copies.get(path)
+        if range_copy is None or not stat.S_ISREG(stats.st_mode):
+            return stats
+        return _with_size(stats, range_copy.size)
+
+    def _get_range_copy(self, path, mode):
+        """Find, or start, the partial copy-up of a file opened for update.
+
+        Returns:
+            _RangeCopy, or None if the file should be opened as usual.
+        """
+        if helpers.is_overwriting_open_mode(mode):
+            # No need to copy anything from the lower file.
+            self._drop_range_copy(path)
+            return None
+        if path in self._range_copies:
+            return self._range_copies[path]
+        if self.copy_up == self.COPY_UP_FULL or not self._write_branches:
+            return None
+
+        try:
+            old_branch, _stats = self._get_read_branch(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        if old_branch is self._write_branches[0]:
+            return None
+        old_stat = old_branch.fs.lstat(path)
+        if not stat.S_ISREG(old_stat.st_mode):
+            return None
+
+        range_copy = _RangeCopy(
+            path=path,
+            lower_branch=old_branch,
+            lower_size=old_stat.st_size,
+            block_size=self.copy_up_block_size,
+        )
+        self._range_copies[path] = range_copy
+        return range_copy
+
+    def _open_range_copy(self, range_copy, mode):
+        handle = _RangeCopyFile(range_copy, mode, on_close=self._range_copy_closed)
+        if not handle.writable():
+            return io.BufferedReader(handle)
+        elif not handle.readable():
+            return io.BufferedWriter(handle)
+        return io.BufferedRandom(handle)
 
     # Read/write
     # ----------
 
+    def _wrap_written_file(self, path, f, created):
+        """Ensure stats cached while writing to ``f`` are dropped, and the change reported, on close."""
+        if created:
+            self._events.emit(events.CREATE, path)
+        if self._resolution_cache is None and not self._events:
+            return f
+
+        def on_close():
+            self._invalidate_path(path)
+            self._events.emit(events.MODIFY, path)
+        return helpers.CloseHookFile(f, on_close=on_close)
+
     def _open_binary(self, path, mode):
         if helpers.is_readonly_open_mode(mode):
+            if path in self._range_copies:
+                return self._open_range_copy(self._range_copies[path], mode)
             branch, _stats = self._get_read_branch(path)
-        else:
-            branch = self._get_write_branch(path, for_overwrite=True)
-        return branch.fs.open_binary(path, mode)
+            return branch.fs.open_binary(path, mode)
+
+        created = bool(self._events) and not self._access(path, os.F_OK)
+        range_copy = self._get_range_copy(path, mode)
+        if range_copy is not None:
+            return self._wrap_written_file(path, self._open_range_copy(range_copy, mode), created)
+        branch = self._get_write_branch(path, for_overwrite=helpers.is_overwriting_open_mode(mode))
+        return self._wrap_written_file(path, branch.fs.open_binary(path, mode), created)
 
     def _open_text(self, path, mode, encoding):
         if helpers.is_readonly_open_mode(mode):
+            if path in self._range_copies:
+                return io.TextIOWrapper(self._open_range_copy(self._range_copies[path], mode), encoding=encoding)
             branch, _stats = self._get_read_branch(path)
-        else:
-            branch = self._get_write_branch(path, for_overwrite=True)
-        return branch.fs.open_text(path, mode, encoding)
+            return branch.fs.open_text(path, mode, encoding)
+
+        created = bool(self._events) and not self._access(path, os.F_OK)
+        range_copy = self._get_range_copy(path, mode)
+        if range_copy is not None:
+            f = io.TextIOWrapper(self._open_range_copy(range_copy, mode), encoding=encoding)
+            return self._wrap_written_file(path, f, created)
+        branch = self._get_write_branch(path, for_overwrite=helpers.is_overwriting_open_mode(mode))
+        return self._wrap_written_file(path, branch.fs.open_text(path, mode, encoding), created)
 
     # Write
     # -----
 
     def _chmod(self, path, mode):
         branch = self._get_write_branch(path, expected=self._EXIST_YES)
-        return branch.fs.chmod(path, mode)
+        result = branch.fs.chmod(path, mode)
+        self._events.emit(events.ATTRIB, path)
+        return result
 
     def _chown(self, path, uid, gid):
         branch = self._get_write_branch(path, expected=self._EXIST_YES)
-        return branch.fs.chown(path, uid, gid)
+        result = branch.fs.chown(path, uid, gid)
+        self._events.emit(events.ATTRIB, path)
+        return result
 
     def _mkdir(self, path):
         branch = self._get_write_branch(path, expected=self._EXIST_NO)
-        return branch.fs.mkdir(path)
+        result = branch.fs.mkdir(path)
+        self._events.emit(events.CREATE, path)
+        return result
 
     def _symlink(self, link_name, target):
         branch = self._get_write_branch(link_name, expected=self._EXIST_NO)
-        return branch.fs.symlink(link_name, target)
+        result = branch.fs.symlink(link_name, target)
+        # Lookups through the link, e.g of /link/file, now reach the target
+        self._invalidate_tree(link_name)
+        self._events.emit(events.CREATE, link_name)
+        return result
 
     # Delete
     # ------
@@ -664,11 +2091,53 @@ class UnionFS(base.BaseFS):
 
         # No need to check for _EXIST_YES, already done in listdir()
         branch = self._get_write_branch(path)
-        return branch.fs.rmdir(path)
+        result = branch.fs.rmdir(path)
+        self._events.emit(events.DELETE, path)
+        return result
 
     def _unlink(self, path):
+        self._drop_range_copy(path)
         branch = self._get_write_branch(path, expected=self._EXIST_YES, for_overwrite=True)
-        return branch.fs.unlink(path)
+        result = branch.fs.unlink(path)
+        # The path may be a symlink to a directory
+        self._invalidate_tree(path)
+        self._events.emit(events.DELETE, path)
+        return result
+
+    def _rmtree(self, path):
+        """Remove a directory tree, through the write branch if possible.
+
+        The write branch removes the tree at once if it holds all of it,
+        or if it can hide a whole subtree (FEATURE_SUBTREE_WHITEOUT);
+        otherwise, each entry of the deeper branches gets its own whiteout.
+        """
+        if not self.isdir(path):
+            raise exceptions.ENOTDIR(path)
+        if not self._write_branches:
+            raise exceptions.EACCES(path)
+        write_branch = self._write_branches[0]
+        if (list(self._get_dir_branches(path)) != [write_branch]
+                and not write_branch.fs.has_feature(self.FEATURE_SUBTREE_WHITEOUT)):
+            return super()._rmtree(path)
+
+        for copied in list(self._range_copies):
+            if path.is_parent_of(copied):
+                self._drop_range_copy(copied)
+        # Copies the directory itself up, if needed
+        branch = self._get_write_branch(path, expected=self._EXIST_YES)
+        try:
+            result = branch.fs.rmtree(path)
+        finally:
+            self._invalidate_tree(path)
+        self._events.emit(events.DELETE, path)
+        return result
+
+    # Changes
+    # -------
+
+    def _watch(self, path, recursive, emit):
+        # Only changes made through this UnionFS are reported.
+        return self._events.subscribe(path, recursive, emit)
 
 
 # }}} /UnionFS
@@ -688,11 +2157,158 @@ def _has_access(mode, uid, gid, target_mode, target_uid, target_gid):
     return False
 
 
+ContentInfo = collections.namedtuple('ContentInfo', ['budget', 'resident', 'spilled', 'arena'])
+
+
+class _StoredContent:
+    """The content of a FakeFile, held by a _ContentStore.
+
+    Attributes:
+        buffer (io.BytesIO): the content, or None while spilled to disk.
+    """
+    __slots__ = ('key', 'buffer', '__weakref__')
+
+    def __init__(self, key, buffer):
+        self.key = key
+        self.buffer = buffer
+
+
+class _ContentStore:
+    """File contents of a MemoryFS, within a memory budget.
+
+    Above the budget, the least recently used contents are spilled to a
+    temporary "arena" file, and loaded back when accessed. The space of
+    contents loaded back or deleted is reclaimed by rewriting the arena once
+    it holds more garbage than live data.
+
+    Contents are tracked through weak references: they are forgotten once
+    no file (of the MemoryFS or its forks) refers to them anymore.
+    """
+
+    # Don't bother rewriting smaller arenas
+    MIN_COMPACTION = 1024 * 1024
+
+    def __init__(self, budget, spill_dir=None):
+        self.budget = budget
+        self.spill_dir = spill_dir
+        self.resident_bytes = 0
+        self.spilled_bytes = 0
+        self._keys = itertools.count()
+        self._lock = threading.RLock()
+        # key => weakref to the _StoredContent
+        self._refs = {}
+        # key => size, by order of last use
+        self._resident = collections.OrderedDict()
+        # key => (offset, size) within the arena
+        self._spilled = {}
+        self._arena = None
+        self._arena_size = 0
+
+    def add(self, buffer):
+        with self._lock:
+            content = _StoredContent(next(self._keys), buffer)
+            self._refs[content.key] = weakref.ref(content, functools.partial(self._forget, content.key))
+            self._resident[content.key] = 0
+            self.resize(content, len(buffer.getbuffer()))
+            return content
+
+    def _forget(self, key, _ref):
+        with self._lock:
+            del self._refs[key]
+            if key in self._resident:
+                self.resident_bytes -= self._resident.pop(key)
+            elif key in self._spilled:
+                _offset, size = self._spilled.pop(key)
+                self.spilled_bytes -= size
+                self._maybe_compact()
+
+    def load(self, content):
+        """Fetch the buffer of a content, loading it back if spilled."""
+        with self._lock:
+            if content.buffer is not None:
+                self._resident.move_to_end(content.key)
+                return content.buffer
+
+            offset, size = self._spilled.pop(content.key)
+            self._arena.seek(offset)
+            content.buffer = io.BytesIO(self._arena.read(size))
+            self.spilled_bytes -= size
+            self._maybe_compact()
+            self._resident[content.key] = 0
+            self.resize(content, size)
+            return content.buffer
+
+    def resize(self, content, size):
+        """Record the new size of a (resident) content, spilling others if needed."""
+        with self._lock:
+            self.resident_bytes += size - self._resident[content.key]
+            self._resident[content.key] = size
+            self._resident.move_to_end(content.key)
+            # Keep the most recently used content in memory
+            while self.resident_bytes > self.budget and len(self._resident) > 1:
+                key = next(iter(self._resident))
+                victim = self._refs[key]()
+                if victim is None:
+                    # Dead, but _forget() is waiting for the lock, maybe
+                    # in another thread: nothing to spill.
+                    self.resident_bytes -= self._resident.pop(key)
+                    continue
+                self._spill(victim)
+
+    def _spill(self, content):
+        if self._arena is None:
+            self._arena = tempfile.TemporaryFile(dir=self.spill_dir)
+        size = self._resident.pop(content.key)
+        self._arena.seek(self._arena_size)
+        self._arena.write(content.buffer.getbuffer())
+        self._spilled[content.key] = (self._arena_size, size)
+        self._arena_size += size
+        self.resident_bytes -= size
+        self.spilled_bytes += size
+        content.buffer = None
+
+    def _maybe_compact(self):
+        garbage = self._arena_size - self.spilled_bytes
+        if garbage < max(self.spilled_bytes, self.MIN_COMPACTION):
+            return
+        arena = tempfile.TemporaryFile(dir=self.spill_dir)
+        position = 0
+        for key, (offset, size) in self._spilled.items():
+            self._arena.seek(offset)
+            arena.write(self._arena.read(size))
+            self._spilled[key] = (position, size)
+            position += size
+        self._arena.close()
+        self._arena = arena
+        self._arena_size = position
+
+    def info(self):
+        return ContentInfo(
+            budget=self.budget,
+            resident=self.resident_bytes,
+            spilled=self.spilled_bytes,
+            arena=self._arena_size,
+        )
+
+
 class FakeFSObject:
+    """A node of a MemoryFS.
+
+    Nodes use __slots__, and share their (interned) names with the contents
+    of their parent directory, to keep large trees compact.
+
+    Attributes:
+        path (str): the name of the node within its parent
+        owner (object): the token of the MemoryFS allowed to update the node
+            in place; other MemoryFS sharing it (forks) must copy it first.
+    """
+    __slots__ = ('path', 'mode', 'uid', 'gid', 'owner', '_size', '_atime', '_mtime', '_ctime')
+
     BASE_ST_MOD = 0
 
-    def __init__(self, path, mode, uid, gid):
-        self.path = path
+    def __init__(self, path, mode, uid, gid, owner=None):
+        self.path = sys.intern(str(path))
+        self.owner = owner
         self.mode = mode | self.BASE_ST_MOD
         self.uid = uid
         self.gid = gid
@@ -737,10 +2353,19 @@ class FakeFSObject:
     def readlink(self):
         raise exceptions.EINVAL(self.path)
 
+    def copy(self, owner):
+        """Copy the node, for an update by another owner."""
+        clone = object.__new__(type(self))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                setattr(clone, name, getattr(self, name))
+        clone.owner = owner
+        return clone
+
     def chmod(self, mode):
         if not self.access(os.W_OK):
             raise exceptions.EACCES(self.path)
-        self.mode = mode
+        self.mode = stat.S_IMODE(mode) | self.BASE_ST_MOD
 
     def chown(self, uid, gid):
         if not self.access(os.W_OK):
@@ -756,41 +2381,189 @@ class FakeFSObject:
     is_symlink = False
 
 
-class BufferWrapper:
-    def __init__(self, buf):
-        self._buf = buf
+class _MappedContent:
+    """A file content mapped from a MemoryFS image, read-only.
 
-    def close(self):
-        pass
+    Provides the subset of the io.BytesIO API used by FakeFile readers.
+    """
+    __slots__ = ('_view', '_pos')
 
-    def __getattr__(self, name):
-        return getattr(self._buf, name)
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
 
-    def __enter__(self):
-        return self
+    def seek(self, pos):
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        data = self._view[self._pos:self._pos + len(b)]
+        size = len(data)
+        b[:size] = data
+        self._pos += size
+        return size
+
+    def getbuffer(self):
+        return self._view[:]
+
+    def getvalue(self):
+        return self._view.tobytes()
 
-    def __exit__(self, *args, **kwargs):
-        pass
+
+class FakeFileHandle(io.RawIOBase):
+    """An open FakeFile.
+
+    Each handle has its own position within the (shared) file content.
+    """
+    def __init__(self, fake_file, mode):
+        super().__init__()
+        self._file = fake_file
+        self._readable = 'r' in mode or '+' in mode
+        self._writable = not helpers.is_readonly_open_mode(mode)
+        self._append = 'a' in mode
+        self._pos = 0
+        if 'w' in mode:
+            self._file.truncate(0)
+
+    def readable(self):
+        return self._readable
+
+    def writable(self):
+        return self._writable
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._readable:
+            raise io.UnsupportedOperation("File not open for reading")
+        content = self._file.content_if_any
+        if content is None:
+            return 0
+        content.seek(self._pos)
+        size = content.readinto(b)
+        self._pos += size
+        return size
+
+    def write(self, b):
+        if not self._writable:
+            raise io.UnsupportedOperation("File not open for writing")
+        content = self._file.content
+        if self._append:
+            self._pos = self._file.size
+        content.seek(self._pos)
+        size = content.write(b)
+        self._pos += size
+        self._file.touch()
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._file.size
+        if offset < 0:
+            raise exceptions.EINVAL(self._file.path)
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def truncate(self, size=None):
+        if not self._writable:
+            raise io.UnsupportedOperation("File not open for writing")
+        if size is None:
+            size = self._pos
+        self._file.truncate(size)
+        return size
 
 
 class FakeFile(FakeFSObject):
+    """A fake file.
+
+    Its content buffer is only allocated once written to, and copies of the
+    node share it until written to.
+
+    Attributes:
+        store (_ContentStore): where the content is held, if the MemoryFS
+            has a memory budget; None otherwise.
+    """
+    __slots__ = ('store', '_content', '_content_shared')
 
     BASE_ST_MOD = stat.S_IFREG
     is_file = True
 
-    def __init__(self, **kwargs):
+    def __init__(self, store=None, **kwargs):
         super().__init__(**kwargs)
-        self.content = io.BytesIO()
+        self.store = store
+        # A io.BytesIO, a _StoredContent if self.store is set, or a
+        # (shared) _MappedContent
+        self._content = None
+        self._content_shared = False
+
+    def copy(self, owner):
+        clone = super().copy(owner)
+        clone._content_shared = self._content is not None
+        return clone
+
+    def _new_content(self, data=b''):
+        buffer = io.BytesIO(data)
+        if self.store is None:
+            return buffer
+        return self.store.add(buffer)
+
+    @property
+    def content(self):
+        """The content, as a io.BytesIO, ready to be written to."""
+        if self._content is None:
+            self._content = self._new_content()
+        elif self._content_shared:
+            self._content = self._new_content(self.content_if_any.getvalue())
+            self._content_shared = False
+        return self.content_if_any
+
+    @property
+    def content_if_any(self):
+        """The content as a io.BytesIO (or read-only equivalent), or None if the file is empty."""
+        if isinstance(self._content, _StoredContent):
+            return self.store.load(self._content)
+        return self._content
+
+    @property
+    def size(self):
+        return self._size
+
+    def touch(self):
+        """Record a change to the content."""
+        content = self.content_if_any
+        self._size = 0 if content is None else len(content.getbuffer())
+        if isinstance(self._content, _StoredContent):
+            self.store.resize(self._content, self._size)
+        self._mtime = self._ctime = time.time()
+
+    def truncate(self, size):
+        if size == 0:
+            # Release the buffer
+            self._content = None
+            self._content_shared = False
+        elif self._content is not None:
+            self.content.truncate(size)
+        self.touch()
 
     def open_binary(self, mode):
         if not helpers.is_readonly_open_mode(mode) and not self.access(os.W_OK):
             raise exceptions.EACCES(self.path)
-        return BufferWrapper(self.content)
+        handle = FakeFileHandle(self, mode)
+        if handle.readable() and handle.writable():
+            return io.BufferedRandom(handle)
+        elif handle.writable():
+            return io.BufferedWriter(handle)
+        else:
+            return io.BufferedReader(handle)
 
     def open_text(self, mode, encoding):
-        if not helpers.is_readonly_open_mode(mode) and not self.access(os.W_OK):
-            raise exceptions.EACCES(self.path)
-        return io.TextIOWrapper(BufferWrapper(self.content), encoding=encoding)
+        return io.TextIOWrapper(self.open_binary(mode), encoding=encoding)
 
 
 class FakeDir(FakeFSObject):
@@ -799,6 +2572,8 @@ class FakeDir(FakeFSObject):
     Attributes:
         contents (dict(path => FakeFSObject): contained objects
     """
+    __slots__ = ('contents',)
+
     BASE_ST_MOD = stat.S_IFDIR
     is_dir = True
 
@@ -806,6 +2581,11 @@ class FakeDir(FakeFSObject):
         super().__init__(**kwargs)
         self.contents = {}
 
+    def copy(self, owner):
+        clone = super().copy(owner)
+        clone.contents = dict(self.contents)
+        return clone
+
     def __contains__(self, path):
         return path in self.contents
 
@@ -815,7 +2595,7 @@ class FakeDir(FakeFSObject):
     def __getitem__(self, path):
         return self.contents[path]
 
-    def make_file(self, relative_path, uid, gid, mode):
+    def make_file(self, relative_path, uid, gid, mode, store=None):
         full_path = os.path.join(self.path, relative_path)
         if not self.access(os.W_OK):
             raise exceptions.EACCES(full_path)
@@ -827,8 +2607,10 @@ class FakeDir(FakeFSObject):
             mode=mode,
             uid=uid,
             gid=gid,
+            owner=self.owner,
+            store=store,
         )
-        self.contents[relative_path] = new_file
+        self.contents[new_file.path] = new_file
         return new_file
 
     def make_subdir(self, relative_path, uid, gid, mode):
@@ -843,8 +2625,9 @@ class FakeDir(FakeFSObject):
             mode=mode,
             uid=uid,
             gid=gid,
+            owner=self.owner,
         )
-        self.contents[relative_path] = new_dir
+        self.contents[new_dir.path] = new_dir
         return new_dir
 
     def make_symlink(self, relative_path, target, uid, gid, mode):
@@ -853,8 +2636,8 @@ class FakeDir(FakeFSObject):
             raise exceptions.EACCES(full_path)
         if self.mode & stat.S_ISGID:
             gid = self.gid
-        new_link = FakeSymlink(target, mode=mode, uid=uid, gid=gid)
-        self.contents[relative_path] = new_link
+        new_link = FakeSymlink(target, path=relative_path, mode=mode, uid=uid, gid=gid, owner=self.owner)
+        self.contents[new_link.path] = new_link
         return new_link
 
     def rmdir(self, relative_path):
@@ -885,6 +2668,7 @@ class FakeDir(FakeFSObject):
 
 
 class FakeSymlink(FakeFSObject):
+    __slots__ = ('target',)
 
     BASE_ST_MOD = stat.S_IFLNK
     is_symlink = True
@@ -897,38 +2681,401 @@ class FakeSymlink(FakeFSObject):
         return self.target.stat()
 
     def readlink(self):
-        return self.target.path
+        return self.target
+
+
+class _MemoryDirEntry(base.DirEntry):
+    """A DirEntry for a MemoryFS, fetching stats from its node."""
+
+    def __init__(self, fs, path, node):
+        super().__init__(fs, path, file_type=stat.S_IFMT(node.mode))
+        self._node = node
+
+    def _fetch_stat(self):
+        if self._node.is_symlink:
+            return super()._fetch_stat()
+        return self._node.stat()
+
+    def _fetch_lstat(self):
+        return self._node.lstat()
+
+
+# Images, see MemoryFS.save()
+_IMAGE_MAGIC = b'FSLIBIMG'
+_IMAGE_VERSION = 1
+# magic, version, node count, offset of node records, size of names, reserved
+_IMAGE_HEADER = struct.Struct('<8sIQQQQ')
+# parent index, mode, uid, gid, atime, mtime, ctime, name offset, name size, data offset, data size
+_IMAGE_NODE = struct.Struct('<IIIIdddQIQQ')
 
 
 class MemoryFS(base.BaseFS):
-    def __init__(self, *args, **kwargs):
+    """A filesystem held in memory.
+
+    A MemoryFS may be forked in constant time, see fork(): both copies
+    then share their nodes, and copy them before updating them.
+
+    Args:
+        full_path_index: bool, whether to index all nodes by their full
+            path, for faster lookups. Otherwise, paths are resolved by
+            walking the tree, component by component, which saves a dict
+            entry and a full path string per node.
+        memory_budget: int or None, the number of bytes of file contents
+            to keep in memory. Above it, the least recently used contents
+            are spilled to a temporary file, and loaded back on access.
+            Forks share the budget of their original.
+        spill_dir: str or None, where to create that temporary file.
+    """
+
+    def __init__(self, *args, full_path_index=True, memory_budget=None, spill_dir=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self._store = None
+        if memory_budget is not None:
+            self._store = _ContentStore(memory_budget, spill_dir=spill_dir)
+        # Nodes owned by this token may be updated in place.
+        self._owner = object()
+        # Whether some nodes may be shared with forks
+        self._forked = False
+        self._events = events.Hub()
         self.fake_root = FakeDir(
             path=ROOT,
             mode=self.default_dir_mode,
             uid=self.default_uid,
             gid=self.default_gid,
+            owner=self._owner,
         )
-        self._full_map = {
-            ROOT: self.fake_root,
-        }
+        self._full_map = None
+        if full_path_index:
+            self._full_map = {
+                ROOT: self.fake_root,
+            }
+
+    def _lookup(self, path):
+        """Find the node at a path, without following symlinks.
+
+        Raises:
+            KeyError if there is no such node.
+        """
+        if self._full_map is not None:
+            return self._full_map[path]
+
+        node = self.fake_root
+        for part in helpers.normpath(path).parts:
+            if not node.is_dir:
+                raise KeyError(path)
+            node = node.contents[part]
+        return node
+
+    def _index(self, path, node):
+        if self._full_map is not None:
+            # A plain str key: don't keep the NormPath and its components alive
+            self._full_map[str(path)] = node
+
+    def _unindex(self, path):
+        if self._full_map is not None:
+            del self._full_map[path]
+
+    def _unindex_below(self, path, node):
+        """Drop the index entries below a directory about to be replaced."""
+        if self._full_map is None or node is None or not node.is_dir:
+            return
+        pending = [(path, node)]
+        while pending:
+            dir_path, dir_node = pending.pop()
+            for name, child in dir_node.contents.items():
+                child_path = os.path.join(dir_path, name)
+                self._full_map.pop(child_path, None)
+                if child.is_dir:
+                    pending.append((child_path, child))
 
     def _get(self, path, follow_symlinks=True):
-        target = self._full_map[path]
+        target = self._lookup(path)
         if target.is_symlink and follow_symlinks:
-            return self._get(target.target, follow_symlinks=follow_symlinks)
+            link_target = helpers.normpath(target.target)
+            if not link_target.is_absolute:
+                # Relative targets aren't supported
+                raise KeyError(link_target)
+            return self._get(link_target, follow_symlinks=follow_symlinks)
         return target
 
+    def _get_writable(self, path, follow_symlinks=True):
+        """Find a node about to be updated.
+
+        If shared with forks, the node and its parents are copied first.
+
+        Raises:
+            KeyError if there is no such node.
+        """
+        if not self._forked:
+            return self._get(path, follow_symlinks=follow_symlinks)
+
+        node = self.fake_root
+        if node.owner is not self._owner:
+            node = self.fake_root = node.copy(self._owner)
+            self._index(ROOT, node)
+        for current in helpers.normpath(path).lineage[1:]:
+            if not node.is_dir:
+                raise KeyError(path)
+            parent, node = node, node.contents[current.name]
+            if node.owner is not self._owner:
+                node = parent.contents[node.path] = node.copy(self._owner)
+                self._index(current, node)
+
+        if node.is_symlink and follow_symlinks:
+            link_target = helpers.normpath(node.target)
+            if not link_target.is_absolute:
+                raise KeyError(link_target)
+            return self._get_writable(link_target, follow_symlinks=follow_symlinks)
+        return node
+
     def _get_parent(self, path):
-        parent_path = os.path.dirname(path)
+        """Find the parent directory of a path, about to be updated."""
         try:
-            parent = self._get(parent_path)
+            parent = self._get_writable(path.parent)
         except KeyError:
             raise exceptions.ENOENT(path)
         if not parent.is_dir:
             raise exceptions.ENOTDIR(path)
         return parent
 
+    def memory_info(self):
+        """Bytes of file contents held in memory and on disk, as a ContentInfo.
+
+        Returns:
+            ContentInfo(budget, resident, spilled, arena), arena being the
+            size of the temporary file, including reclaimable space;
+            None if the MemoryFS has no memory budget.
+        """
+        if self._store is None:
+            return None
+        return self._store.info()
+
+    def fork(self):
+        """Copy this filesystem, in constant time.
+
+        Both filesystems share their nodes until updating them: an update
+        copies the nodes along its path, and file contents are copied on
+        their first write.
+
+        Files opened for writing before the fork must be closed first: they
+        would keep writing to the shared content.
+
+        The fork doesn't index nodes by their full path (see
+        full_path_index).
+
+        Returns:
+            MemoryFS
+        """
+        clone = copy.copy(self)
+        clone._full_map = None
+        clone._owner = object()
+        clone._forked = True
+        clone._events = events.Hub()
+        # Nodes owned so far are now shared
+        self._owner = object()
+        self._forked = True
+        return clone
+
+    def snapshot(self):
+        """A read-only view of the current state of this filesystem.
+
+        Later updates to this filesystem don't alter the snapshot.
+
+        Returns:
+            ReadOnlyFS, wrapping a fork.
+        """
+        return ReadOnlyFS(
+            wrapped=self.fork(),
+            default_umask=self.default_umask,
+            default_uid=self.default_uid,
+            default_gid=self.default_gid,
+        )
+
+    # Images
+    # ------
+
+    def save(self, path):
+        """Write the whole tree to an image file, for load().
+
+        An image holds the content of all files (and symlink targets),
+        followed by an index of fixed-size node records, in depth-first
+        order, and the names of the nodes.
+        """
+        records = []
+        names = bytearray()
+        with open(path, 'wb') as f:
+            f.write(_IMAGE_HEADER.pack(_IMAGE_MAGIC, _IMAGE_VERSION, 0, 0, 0, 0))
+            offset = _IMAGE_HEADER.size
+            # (parent index, name, node)
+            pending = [(0, '', self.fake_root)]
+            while pending:
+                parent, name, node = pending.pop()
+                if node.is_symlink:
+                    data = node.target.encode('utf-8')
+                elif node.is_file:
+                    data = node.content_if_any
+                    data = b'' if data is None else data.getbuffer()
+                else:
+                    data = b''
+                    index = len(records)
+                    pending.extend((index, child_name, child) for child_name, child in reversed(node.contents.items()))
+                f.write(data)
+                encoded_name = name.encode('utf-8')
+                records.append(_IMAGE_NODE.pack(
+                    parent, node.mode, node.uid, node.gid, node._atime, node._mtime, node._ctime,
+                    len(names), len(encoded_name), offset, len(data),
+                ))
+                names += encoded_name
+                offset += len(data)
+
+            f.write(b''.join(records))
+            f.write(names)
+            f.seek(0)
+            f.write(_IMAGE_HEADER.pack(_IMAGE_MAGIC, _IMAGE_VERSION, len(records), offset, len(names), 0))
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Load a MemoryFS from an image written by save().
+
+        The image is mapped in memory: file contents are read from the
+        mapping (and thus shared between processes loading the same image)
+        until they are written to.
+
+        Args:
+            kwargs: passed to the MemoryFS constructor
+
+        Raises:
+            FSError if the file isn't a valid image.
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < _IMAGE_HEADER.size:
+                raise exceptions.FSError("Not a MemoryFS image (version %d): %s" % (_IMAGE_VERSION, path))
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapping)
+        magic, version, count, records_offset, names_size, _reserved = _IMAGE_HEADER.unpack_from(view)
+        if magic != _IMAGE_MAGIC or version != _IMAGE_VERSION:
+            raise exceptions.FSError("Not a MemoryFS image (version %d): %s" % (_IMAGE_VERSION, path))
+        names_offset = records_offset + count * _IMAGE_NODE.size
+        if records_offset < _IMAGE_HEADER.size or names_offset + names_size > len(view):
+            raise exceptions.FSError("Truncated MemoryFS image: %s" % path)
+        names = bytes(view[names_offset:names_offset + names_size])
+
+        def invalid(index, reason):
+            return exceptions.FSError("Invalid node #%d (%s) in MemoryFS image: %s" % (index, reason, path))
+
+        memory_fs = cls(**kwargs)
+        nodes = []
+        # Full paths of directories, by index, for the full path index
+        paths = {}
+        records = _IMAGE_NODE.iter_unpack(view[records_offset:names_offset])
+        for index, record in enumerate(records):
+            parent, mode, uid, gid, atime, mtime, ctime, name_offset, name_size, offset, size = record
+            # Contents lie between the header and the node records.
+            if offset < _IMAGE_HEADER.size or offset + size > records_offset:
+                raise invalid(index, "data out of bounds")
+            if index == 0:
+                if not stat.S_ISDIR(mode):
+                    raise invalid(index, "root is not a directory")
+                node = memory_fs.fake_root
+                node.mode, node.uid, node.gid = mode, uid, gid
+                paths[0] = helpers.normpath(ROOT)
+            else:
+                # Parents come first, in depth-first order.
+                if parent >= index or not nodes[parent].is_dir:
+                    raise invalid(index, "no such parent directory: #%d" % parent)
+                if name_offset + name_size > names_size:
+                    raise invalid(index, "name out of bounds")
+                try:
+                    name = names[name_offset:name_offset + name_size].decode('utf-8')
+                except UnicodeDecodeError:
+                    raise invalid(index, "undecodable name")
+                if name in ('', os.curdir, os.pardir) or os.sep in name or name in nodes[parent].contents:
+                    raise invalid(index, "invalid name: %r" % name)
+
+                attrs = dict(path=name, mode=mode, uid=uid, gid=gid, owner=memory_fs._owner)
+                if stat.S_ISDIR(mode):
+                    node = FakeDir(**attrs)
+                elif stat.S_ISLNK(mode):
+                    try:
+                        target = view[offset:offset + size].tobytes().decode('utf-8')
+                    except UnicodeDecodeError:
+                        raise invalid(index, "undecodable symlink target")
+                    node = FakeSymlink(target, **attrs)
+                else:
+                    node = FakeFile(store=memory_fs._store, **attrs)
+                    if size:
+                        # Shared with the mapping, until written to
+                        node._content = _MappedContent(view[offset:offset + size])
+                        node._content_shared = True
+                        node._size = size
+                nodes[parent].contents[node.path] = node
+                if memory_fs._full_map is not None:
+                    node_path = paths[parent].child(node.path)
+                    memory_fs._index(node_path, node)
+                    if node.is_dir:
+                        paths[index] = node_path
+            node._atime, node._mtime, node._ctime = atime, mtime, ctime
+            nodes.append(node)
+        return memory_fs
+
+    # Bulk imports
+    # ------------
+
+    def import_node(self, path, mode, uid, gid, mtime=None, content=None, target=None, parent=None):
+        """Create a node without any permission check, for bulk imports (see builders).
+
+        An existing directory is updated in place; other existing nodes,
+        or empty directories, are replaced.
+
+        Args:
+            path: NormPath, the path of the node
+            mode: int, the full mode, including the file type (S_IFDIR,
+                S_IFREG or S_IFLNK)
+            mtime: float or None, the modification time
+            content: bytes or FakeFile, the content of a file; the content
+                of a FakeFile is shared until written to, as for a hard link.
+            target: str, the target of a symlink
+            parent: FakeDir or None, the parent directory, if already known
+
+        Returns:
+            The node.
+        """
+        if parent is None:
+            parent = self._get_parent(path)
+        name = path.name
+        existing = parent.contents.get(name)
+        attrs = dict(path=name, mode=mode, uid=uid, gid=gid, owner=self._owner)
+
+        if existing is not None and existing.is_dir:
+            if stat.S_ISDIR(mode):
+                node = existing if existing.owner is self._owner else existing.copy(self._owner)
+                node.mode, node.uid, node.gid = mode, uid, gid
+            elif existing.contents:
+                raise exceptions.ENOTEMPTY(path)
+
+        if stat.S_ISDIR(mode):
+            if existing is None or not existing.is_dir:
+                node = FakeDir(**attrs)
+        elif stat.S_ISLNK(mode):
+            node = FakeSymlink(target, **attrs)
+        elif stat.S_ISREG(mode):
+            node = FakeFile(store=self._store, **attrs)
+            if isinstance(content, FakeFile):
+                node._content = content._content
+                node._content_shared = content._content_shared = content._content is not None
+                node._size = content.size
+            elif content:
+                node._content = node._new_content(content)
+                node._size = len(content)
+        else:
+            raise exceptions.EINVAL(path)
+
+        if mtime is not None:
+            node._mtime = mtime
+        parent.contents[node.path] = node
+        self._index(path, node)
+        return node
+
     def _get_or_raise(self, path, follow_symlinks=True):
         try:
             return self._get(path, follow_symlinks=follow_symlinks)
@@ -951,6 +3098,15 @@ class MemoryFS(base.BaseFS):
             raise exceptions.ENOTDIR(path)
         return list(target.contents.keys())
 
+    def _scandir(self, path):
+        target = self._get_or_raise(path)
+        if not target.is_dir:
+            raise exceptions.ENOTDIR(path)
+        return [
+            _MemoryDirEntry(self, path.child(name), node)
+            for name, node in target.contents.items()
+        ]
+
     def _lstat(self, path):
         target = self._get_or_raise(path, follow_symlinks=False)
         return target.lstat()
@@ -963,49 +3119,76 @@ class MemoryFS(base.BaseFS):
         target = self._get_or_raise(path)
         return target.stat()
 
+    def _get_hash(self, path, method, chunk_size):
+        target = self._get_or_raise(path)
+        if target.is_dir:
+            raise exceptions.EISDIR(path)
+        file_hash = method()
+        if target.content_if_any is not None:
+            with target.content_if_any.getbuffer() as content:
+                file_hash.update(content)
+        return file_hash
+
     # Read/write
     # ----------
 
     def _get_or_create_file(self, path, mode):
+        readonly = helpers.is_readonly_open_mode(mode)
         try:
-            target = self._get(path)
+            target = self._get(path) if readonly else self._get_writable(path)
         except KeyError:
-            if helpers.is_readonly_open_mode(mode):
+            if readonly:
                 raise exceptions.ENOENT(path)
             parent = self._get_parent(path)
             target = parent.make_file(
-                os.path.basename(path),
+                path.name,
                 mode=self.default_file_mode,
                 uid=self.default_uid,
                 gid=self.default_gid,
+                store=self._store,
             )
 
-            self._full_map[path] = target
+            self._index(path, target)
+            self._events.emit(events.CREATE, path)
 
         return target
 
+    def _watch_written(self, path, mode, f):
+        """Report changes to a file opened for writing once closed."""
+        if helpers.is_readonly_open_mode(mode) or not self._events:
+            return f
+        return helpers.CloseHookFile(f, on_close=lambda: self._events.emit(events.MODIFY, path))
+
     def _open_binary(self, path, mode):
         target = self._get_or_create_file(path, mode)
-        return target.open_binary(mode)
+        return self._watch_written(path, mode, target.open_binary(mode))
 
     def _open_text(self, path, mode, encoding):
         target = self._get_or_create_file(path, mode)
-        return target.open_text(mode, encoding)
+        return self._watch_written(path, mode, target.open_text(mode, encoding))
 
     # Write
     # -----
 
+    def _get_writable_or_raise(self, path):
+        try:
+            return self._get_writable(path)
+        except KeyError:
+            raise exceptions.ENOENT(path)
+
     def _chmod(self, path, mode):
-        target = self._get_or_raise(path)
-        return target.chmod(mode)
+        target = self._get_writable_or_raise(path)
+        target.chmod(mode)
+        self._events.emit(events.ATTRIB, path)
 
     def _chown(self, path, uid, gid):
-        target = self._get_or_raise(path)
-        return target.chown(uid, gid)
+        target = self._get_writable_or_raise(path)
+        target.chown(uid, gid)
+        self._events.emit(events.ATTRIB, path)
 
     def _symlink(self, link_name, target):
         parent = self._get_parent(link_name)
-        path = os.path.basename(link_name)
+        path = link_name.name
         if path in parent:
             raise exceptions.EEXIST(link_name)
 
@@ -1015,18 +3198,22 @@ class MemoryFS(base.BaseFS):
             uid=self.default_uid,
             gid=self.default_gid,
         )
-        self._full_map[link_name] = new_link
+        self._index(link_name, new_link)
+        self._events.emit(events.CREATE, link_name)
         return new_link
 
     def _mkdir(self, path):
         parent = self._get_parent(path)
+        # An existing directory is replaced, with its contents
+        self._unindex_below(path, parent.contents.get(path.name))
         new_dir = parent.make_subdir(
-            os.path.basename(path),
+            path.name,
             mode=self.default_dir_mode,
             uid=self.default_uid,
             gid=self.default_gid,
         )
-        self._full_map[path] = new_dir
+        self._index(path, new_dir)
+        self._events.emit(events.CREATE, path)
         return new_dir
 
     # Delete
@@ -1034,13 +3221,21 @@ class MemoryFS(base.BaseFS):
 
     def _rmdir(self, path):
         parent = self._get_parent(path)
-        parent.rmdir(os.path.basename(path))
-        del self._full_map[path]
+        parent.rmdir(path.name)
+        self._unindex(path)
+        self._events.emit(events.DELETE, path)
 
     def _unlink(self, path):
         parent = self._get_parent(path)
-        parent.unlink(os.path.basename(path))
-        del self._full_map[path]
+        parent.unlink(path.name)
+        self._unindex(path)
+        self._events.emit(events.DELETE, path)
+
+    # Changes
+    # -------
+
+    def _watch(self, path, recursive, emit):
+        return self._events.subscribe(path, recursive, emit)
 
 
 # }}} /MemoryFS
@@ -1050,6 +3245,19 @@ class MemoryFS(base.BaseFS):
 # ===========
 
 
+class _MountNode:
+    """A node in the mount table: one path component.
+
+    Attributes:
+        children (dict(str => _MountNode)): nodes for sub-components;
+            only nodes leading to a mount point are kept.
+        subfs (BaseFS or None): the filesystem mounted here, if any.
+    """
+    def __init__(self):
+        self.children = {}
+        self.subfs = None
+
+
 class MountFS(base.BaseFS):
     """A UNIX-like tree of file systems.
 
@@ -1066,7 +3274,12 @@ class MountFS(base.BaseFS):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.filesystems = {}
-        self._sorted_filesystems = []
+        self._mount_tree = _MountNode()
+
+    def has_feature(self, feature):
+        if feature == self.FEATURE_BLOCKING_IO:
+            return any(subfs.has_feature(feature) for subfs in self.filesystems.values())
+        return super().has_feature(feature)
 
     def __repr__(self):
         return '<MountFS: %s>' % ', '.join(
@@ -1077,11 +3290,14 @@ class MountFS(base.BaseFS):
     # Mounting
     # --------
 
-    def _update_mount_cache(self):
-        self._sorted_filesystems = list(reversed(sorted(
-            self.filesystems.items(),
-            key=lambda item: (len(item[0]), item[0], item[1]),
-        )))
+    def _find_node(self, path):
+        """Find the mount table node for an exact path, or None."""
+        node = self._mount_tree
+        for part in helpers.normpath(path).parts:
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
 
     def mount_fs(self, subfs, mount_point):
         """Mount an existing BaseFS instance at the given mount_point.
@@ -1100,34 +3316,58 @@ class MountFS(base.BaseFS):
         if self.filesystems and not self.isdir(mount_point):
             raise exceptions.FSError("Can't mount subfs %r at %s: dir doesn't exist." % (subfs, mount_point))
 
+        node = self._mount_tree
+        for part in mount_point.parts:
+            node = node.children.setdefault(part, _MountNode())
+        node.subfs = subfs
         self.filesystems[mount_point] = subfs
-        self._update_mount_cache()
 
     def umount_fs(self, mount_point):
+        mount_point = helpers.normpath(mount_point)
         if mount_point not in self.filesystems:
             raise exceptions.EINVAL(mount_point)
 
-        for anchor in self.filesystems:
-            if helpers.is_parent(mount_point, anchor) and anchor != mount_point:
-                raise exceptions.EBUSY(mount_point)
+        parts = mount_point.parts
+        nodes = [self._mount_tree]
+        for part in parts:
+            nodes.append(nodes[-1].children[part])
+
+        if nodes[-1].children:
+            # Some filesystems are mounted below
+            raise exceptions.EBUSY(mount_point)
 
         if mount_point == ROOT:
             raise exceptions.EINVAL(mount_point)
 
+        nodes[-1].subfs = None
+        # Prune the now useless nodes, bottom-up
+        for part, parent, node in reversed(list(zip(parts, nodes, nodes[1:]))):
+            if node.subfs is not None or node.children:
+                break
+            del parent.children[part]
         del self.filesystems[mount_point]
-        self._update_mount_cache()
 
     def _get_subfs(self, path):
         """Find the innermost subfs handling the provided path.
 
         Returns:
-            (mount_point, subfs)
+            (mount_point, subfs, remaining), remaining being the list of
+            path components below the mount point.
         """
-        for subfs_anchor, subfs in self._sorted_filesystems:
-            if helpers.is_parent(subfs_anchor, path):
-                return subfs_anchor, subfs
+        parts = helpers.normpath(path).parts
+        node = self._mount_tree
+        anchor_depth, subfs = 0, node.subfs
+        for depth, part in enumerate(parts, 1):
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.subfs is not None:
+                anchor_depth, subfs = depth, node.subfs
 
-        return None, None
+        if subfs is None:
+            return None, None, parts
+        anchor = helpers.NormPath.from_parts(parts[:anchor_depth])
+        return anchor, subfs, parts[anchor_depth:]
 
     def _map_path(self, path):
         """Map a path to the proper subfs, along with the related path.
@@ -1138,11 +3378,10 @@ class MountFS(base.BaseFS):
         Raises:
             FSError if no subfs handles the provided path.
         """
-        anchor, subfs = self._get_subfs(path)
+        anchor, subfs, remaining = self._get_subfs(path)
         if anchor is None:
             raise exceptions.FSError("No subfs for path %s" % path)
-        relpath = os.path.relpath(path, start=anchor)
-        return os.path.join(ROOT, relpath), subfs
+        return helpers.NormPath.from_parts(remaining), subfs
 
     # Read
     # ----
@@ -1155,6 +3394,23 @@ class MountFS(base.BaseFS):
         relpath, subfs = self._map_path(path)
         return subfs.listdir(relpath)
 
+    def _scandir(self, path):
+        relpath, subfs = self._map_path(path)
+        entries = []
+        for entry in subfs.scandir(relpath):
+            entry_path = path.child(entry.name)
+            node = self._find_node(entry_path)
+            if node is not None and node.subfs is not None:
+                # A mount point: stats come from the mounted filesystem
+                entries.append(base.DirEntry(self, entry_path))
+            else:
+                entries.append(entry.with_path(entry_path))
+        return entries
+
+    def _list_whiteouts(self, path):
+        relpath, subfs = self._map_path(path)
+        return subfs.list_whiteouts(relpath)
+
     def _lstat(self, path):
         relpath, subfs = self._map_path(path)
         return subfs.lstat(relpath)
@@ -1167,6 +3423,27 @@ class MountFS(base.BaseFS):
         relpath, subfs = self._map_path(path)
         return subfs.stat(relpath)
 
+    def _get_hash(self, path, method, chunk_size):
+        relpath, subfs = self._map_path(path)
+        return subfs.get_hash(relpath, method, chunk_size)
+
+    def _stat_many(self, paths, follow=True):
+        results = [None] * len(paths)
+        by_subfs = collections.defaultdict(list)
+        for index, path in enumerate(paths):
+            try:
+                relpath, subfs = self._map_path(path)
+            except exceptions.FSError as e:
+                results[index] = e
+            else:
+                by_subfs[subfs].append((index, relpath))
+
+        for subfs, mapped in by_subfs.items():
+            stats = subfs.stat_many([relpath for _index, relpath in mapped], follow=follow)
+            for (index, _relpath), result in zip(mapped, stats):
+                results[index] = result
+        return results
+
     # Read/write
     # ----------
 
@@ -1207,9 +3484,9 @@ class MountFS(base.BaseFS):
     # ------
 
     def _rmdir(self, path):
-        for anchor in self.filesystems:
-            if helpers.is_parent(path, anchor):
-                raise exceptions.EBUSY(path)
+        if self._find_node(path) is not None:
+            # A filesystem is mounted at or below that path
+            raise exceptions.EBUSY(path)
         relpath, subfs = self._map_path(path)
         return subfs.rmdir(relpath)
 
@@ -1217,5 +3494,48 @@ class MountFS(base.BaseFS):
         relpath, subfs = self._map_path(path)
         return subfs.unlink(relpath)
 
+    def _rmtree(self, path):
+        if self._find_node(path) is not None:
+            # Filesystems mounted below are emptied, then EBUSY is raised
+            return super()._rmtree(path)
+        relpath, subfs = self._map_path(path)
+        return subfs.rmtree(relpath)
+
+    # Changes
+    # -------
+
+    def _watch(self, path, recursive, emit):
+        anchor, subfs, remaining = self._get_subfs(path)
+        if anchor is None:
+            raise exceptions.FSError("No subfs for path %s" % path)
+        watched = [(anchor, subfs, helpers.NormPath.from_parts(remaining))]
+        if recursive:
+            # Filesystems mounted below are watched from their root
+            watched.extend(
+                (mount_point, mounted, helpers.normpath(ROOT))
+                for mount_point, mounted in self.filesystems.items()
+                if mount_point != anchor and path.is_parent_of(mount_point)
+            )
+
+        watches = []
+        try:
+            for mount_point, mounted, relpath in watched:
+                watches.append(mounted.watch(relpath, recursive=recursive, callback=functools.partial(
+                    self._emit_mounted, mount_point, emit,
+                )))
+        except Exception:
+            for watch in watches:
+                watch.close()
+            raise
+
+        def stop():
+            for watch in watches:
+                watch.close()
+        return stop
+
+    @staticmethod
+    def _emit_mounted(mount_point, emit, event):
+        emit(event._replace(path=mount_point.descendant(helpers.normpath(event.path).parts)))
+
 
 # }}} /MountFS
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import asyncio
+import hashlib
+import tempfile
+import threading
+import time
+import unittest
+
+from fslib import aio
+from fslib import base
+from fslib import builders
+from fslib import events
+
+
+class AsyncFileSystemTests(unittest.IsolatedAsyncioTestCase):
+    def make_backends(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return [base.OSFS(tmp.name), builders.make_memory_fake(default_umask=0o777)]
+
+    async def test_file(self):
+        for backend in self.make_backends():
+            with self.subTest(backend=backend):
+                async with aio.AsyncFileSystem(backend) as afs:
+                    async with afs.open('/f', 'wb') as f:
+                        await f.write(b'abc\ndef\n')
+                    async with afs.open('/f', 'rb') as f:
+                        self.assertEqual(b'ab', await f.read(2))
+                        self.assertEqual([b'c\n', b'def\n'], [line async for line in f])
+
+    async def test_file_iteration_break(self):
+        for backend in self.make_backends():
+            with self.subTest(backend=backend):
+                async with aio.AsyncFileSystem(backend) as afs:
+                    await afs.writelines('/f', ['a', 'b'])
+                    async with afs.open('/f', 'rb') as f:
+                        async for _line in f:
+                            break
+                        # The file is still open
+                        await f.seek(0)
+                        self.assertEqual(b'a\nb\n', await f.read())
+
+    async def test_readlines(self):
+        for backend in self.make_backends():
+            with self.subTest(backend=backend):
+                async with aio.AsyncFileSystem(backend, batch_size=7) as afs:
+                    lines = ['l%d' % i for i in range(100)]
+                    await afs.writelines('/f', lines)
+                    self.assertEqual(lines, [line async for line in afs.readlines('/f')])
+
+    async def test_walk(self):
+        for backend in self.make_backends():
+            with self.subTest(backend=backend):
+                async with aio.AsyncFileSystem(backend) as afs:
+                    await afs.makedirs('/a/b')
+                    await afs.writelines('/a/f', ['x'])
+                    expected = list(afs.sync.walk('/'))
+                    self.assertEqual(expected, [item async for item in afs.walk('/')])
+                    self.assertEqual(
+                        list(afs.sync.walk('/', topdown=False)),
+                        [item async for item in afs.walk('/', topdown=False)],
+                    )
+
+    async def test_walk_prune(self):
+        for backend in self.make_backends():
+            with self.subTest(backend=backend):
+                async with aio.AsyncFileSystem(backend) as afs:
+                    await afs.makedirs('/a/b')
+                    await afs.makedirs('/c')
+                    seen = []
+                    async for dirpath, dirnames, _filenames in afs.walk('/'):
+                        seen.append(dirpath)
+                        dirnames[:] = [name for name in dirnames if name != 'a']
+                    self.assertEqual(['/', '/c'], seen)
+
+    async def test_batches(self):
+        for backend in self.make_backends():
+            with self.subTest(backend=backend):
+                async with aio.AsyncFileSystem(backend) as afs:
+                    await afs.makedirs('/a/b')
+                    await afs.writelines('/a/f', ['x'])
+                    entries = {entry.name: entry.is_dir() async for entry in afs.scandir('/a')}
+                    self.assertEqual({'b': True, 'f': False}, entries)
+                    self.assertEqual([True, False], await afs.exists_many(['/a/f', '/missing']))
+                    results = await afs.stat_many(['/a/f', '/missing'])
+                    self.assertEqual(2, results[0].st_size)
+                    self.assertIsInstance(results[1], FileNotFoundError)
+                    self.assertEqual(
+                        {'/a/f': hashlib.md5(b'x\n').hexdigest()},
+                        await afs.hash_tree('/', workers=2),
+                    )
+                    await afs.rmtree('/a')
+                    self.assertEqual([], [name async for name in afs.listdir('/')])
+
+    async def test_watch(self):
+        backend = builders.make_memory_fake(default_umask=0o777)
+        async with aio.AsyncFileSystem(backend) as afs:
+            async with await afs.watch('/', recursive=True) as watch:
+                await afs.mkdir('/a')
+                await afs.writelines('/a/f', ['x'])
+                event = await watch.get()
+                self.assertEqual((events.CREATE, '/a'), (event.kind, event.path))
+            self.assertTrue(watch.closed)
+            # Queued events, then the end
+            remaining = [(event.kind, event.path) async for event in watch]
+            self.assertIn((events.CREATE, '/a/f'), remaining)
+            self.assertIsNone(await watch.get())
+
+
+class SlowOSFS(base.OSFS):
+    """Record how many stat() calls run at once."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def _stat(self, path):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        return super()._stat(path)
+
+
+class ConcurrencyTests(unittest.IsolatedAsyncioTestCase):
+    async def test_shared_limit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SlowOSFS(tmp)
+            facades = [aio.AsyncFileSystem(backend, concurrency=2, max_workers=4) for _i in range(3)]
+            try:
+                await asyncio.gather(*(afs.stat('/') for afs in facades for _i in range(4)))
+            finally:
+                for afs in facades:
+                    afs.close()
+            # Bounded across all facades of the backend
+            self.assertEqual(2, backend.max_running)
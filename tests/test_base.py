@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import concurrent.futures
+import errno
+import hashlib
+import os
+import stat
+import tempfile
+import unittest
+
+import fslib
+from fslib import base
+from fslib import builders
+from fslib import stacking
+
+
+def make_fake():
+    return builders.make_memory_fake(default_umask=0o777)
+
+
+class OSFSPathTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        os.makedirs(os.path.join(self.root, 'real', 'sub'))
+        os.symlink(os.path.join(self.root, 'real', 'sub'), os.path.join(self.root, 'link'))
+        self.fs = fslib.FileSystem(base.OSFS(self.root))
+
+    def test_parent_components(self):
+        self.fs.writelines('/real/f', ['f'])
+        self.assertEqual(['f'], list(self.fs.readlines('/real/sub/../f')))
+        # Never above the root of the OSFS
+        self.assertEqual(os.stat(self.root).st_ino, self.fs.stat('/../..').st_ino)
+        self.assertEqual(sorted(os.listdir(self.root)), sorted(self.fs.listdir('/real/../..')))
+
+    def test_symlink_parent(self):
+        # Collapsed before reaching the OS: /link/.. is /, not /real
+        self.assertEqual(os.stat(self.root).st_ino, self.fs.stat('/link/..').st_ino)
+        self.assertEqual(os.stat(os.path.join(self.root, 'real')).st_ino,
+                         os.stat(os.path.join(self.root, 'link', '..')).st_ino)
+
+
+class CopyTests(unittest.TestCase):
+    CONTENT = os.urandom(10000)
+
+    def make_osfs(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return self.prepare(fslib.FileSystem(base.OSFS(tmp.name)))
+
+    def make_memory(self):
+        return self.prepare(fslib.FileSystem(make_fake()))
+
+    def prepare(self, fs):
+        with fs.open('/f', 'wb') as f:
+            f.write(self.CONTENT)
+        fs.chmod('/f', 0o640)
+        return fs
+
+    def setUp(self):
+        self.memory = self.make_memory()
+
+    def read(self, fs, path):
+        with fs.open(path, 'rb') as f:
+            return f.read()
+
+    def pairs(self):
+        """Source and destination filesystems, each time fresh ones."""
+        for make_source in (self.make_osfs, self.make_memory):
+            source = make_source()
+            yield source, source
+            for make_destination in (self.make_osfs, self.make_memory):
+                yield make_source(), make_destination()
+
+    def test_copy(self):
+        for source, destination in self.pairs():
+            with self.subTest(source=source.backend, destination=destination.backend):
+                result = source.copy('/f', '/copy', chunk_size=999, destination_fs=destination)
+                self.assertIsNone(result)
+                self.assertEqual(self.CONTENT, self.read(destination, '/copy'))
+                self.assertEqual(0o640, stat.S_IMODE(destination.stat('/copy').st_mode))
+
+    def test_copy_hash(self):
+        for source, destination in self.pairs():
+            with self.subTest(source=source.backend, destination=destination.backend):
+                result = source.copy('/f', '/copy', chunk_size=999, hash_method=hashlib.sha256,
+                                     destination_fs=destination)
+                self.assertEqual(hashlib.sha256(self.CONTENT).hexdigest(), result.hexdigest())
+
+    def test_copy_mode(self):
+        self.memory.writelines('/new', [''])
+        self.memory.copy('/f', '/copy', copy_mode=False)
+        self.assertEqual(self.memory.stat('/new').st_mode, self.memory.stat('/copy').st_mode)
+        self.memory.copy('/f', '/copy')
+        self.assertEqual(0o640, stat.S_IMODE(self.memory.stat('/copy').st_mode))
+
+    def test_copy_user(self):
+        self.memory.chown('/f', 1234, 5678)
+        self.memory.copy('/f', '/copy')
+        self.assertEqual(os.getuid(), self.memory.stat('/copy').st_uid)
+        self.memory.copy('/f', '/owned', copy_user=True)
+        stats = self.memory.stat('/owned')
+        self.assertEqual((1234, 5678), (stats.st_uid, stats.st_gid))
+
+    def test_copytree(self):
+        for source, destination in self.pairs():
+            with self.subTest(source=source.backend, destination=destination.backend):
+                source.makedirs('/tree/sub')
+                source.copy('/f', '/tree/sub/f')
+                source.symlink('/tree/link', '/tree/sub/f')
+                source.chmod('/tree/sub', 0o750)
+
+                source.copytree('/tree', '/copy', chunk_size=999, destination_fs=destination)
+                self.assertEqual(['link', 'sub'], sorted(destination.listdir('/copy')))
+                self.assertEqual(self.CONTENT, self.read(destination, '/copy/sub/f'))
+                self.assertEqual(0o640, stat.S_IMODE(destination.stat('/copy/sub/f').st_mode))
+                self.assertEqual(0o750, stat.S_IMODE(destination.stat('/copy/sub').st_mode))
+                # Copied as is
+                self.assertEqual('/tree/sub/f', destination.readlink('/copy/link'))
+                if isinstance(destination.backend, base.OSFS):
+                    with self.assertRaises(FileExistsError):
+                        # The destination must not exist
+                        source.copytree('/tree', '/copy', destination_fs=destination)
+
+
+class ScandirTests(unittest.TestCase):
+    def make_backends(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return [base.OSFS(tmp.name), make_fake()]
+
+    def make_tree(self, backend):
+        fs = fslib.FileSystem(backend)
+        fs.makedirs('/t/dir')
+        fs.writelines('/t/file', ['x'])
+        fs.symlink('/t/file_link', '/t/file')
+        fs.symlink('/t/dir_link', '/t/dir')
+        fs.symlink('/t/dangling', '/t/missing')
+        return fs
+
+    def entries(self, fs, path):
+        return {entry.name: entry for entry in fs.scandir(path)}
+
+    def test_types(self):
+        for backend in self.make_backends():
+            with self.subTest(backend=backend):
+                entries = self.entries(self.make_tree(backend), '/t')
+                self.assertEqual(['dangling', 'dir', 'dir_link', 'file', 'file_link'], sorted(entries))
+                types = {
+                    name: (entry.is_file(), entry.is_dir(), entry.is_symlink(),
+                           entry.is_file(follow_symlinks=False), entry.is_dir(follow_symlinks=False))
+                    for name, entry in entries.items()
+                }
+                self.assertEqual({
+                    'dangling': (False, False, True, False, False),
+                    'dir': (False, True, False, False, True),
+                    'dir_link': (False, True, True, False, False),
+                    'file': (True, False, False, True, False),
+                    'file_link': (True, False, True, False, False),
+                }, types)
+                self.assertEqual('/t/file', entries['file'].path)
+                self.assertEqual(stat.S_IFLNK, entries['file_link'].file_type())
+                self.assertEqual(2, entries['file_link'].stat().st_size)
+                self.assertTrue(stat.S_ISLNK(entries['file_link'].stat(follow_symlinks=False).st_mode))
+                with self.assertRaises(OSError):
+                    entries['dangling'].stat()
+
+    def test_lazy_stats(self):
+        for backend in self.make_backends():
+            with self.subTest(backend=backend):
+                fs = self.make_tree(backend)
+                entry = self.entries(fs, '/t')['file']
+                fs.writelines('/t/file', ['longer'])
+                # Fetched on first use, then cached
+                self.assertEqual(7, entry.stat().st_size)
+                fs.writelines('/t/file', ['longer still'])
+                self.assertEqual(7, entry.stat().st_size)
+                self.assertEqual(13, self.entries(fs, '/t')['file'].stat().st_size)
+
+    def test_chroot(self):
+        for backend in self.make_backends():
+            with self.subTest(backend=backend):
+                self.make_tree(backend)
+                fs = fslib.FileSystem(stacking.ChrootFS(internal_root='/t', wrapped=backend))
+                entries = self.entries(fs, '/')
+                self.assertEqual('/file', entries['file'].path)
+                self.assertEqual('/dir', entries['dir'].path)
+                self.assertTrue(entries['dir_link'].is_dir())
+                self.assertEqual(2, entries['file'].stat().st_size)
+
+    def test_mount(self):
+        root = self.make_tree(make_fake())
+        mounted = fslib.FileSystem(make_fake())
+        mounted.writelines('/inner', ['mounted'])
+        mounted.chmod('/', 0o700)
+        mount_fs = stacking.MountFS()
+        mount_fs.mount_fs(root.backend, '/')
+        mount_fs.mount_fs(mounted.backend, '/t/dir')
+        fs = fslib.FileSystem(mount_fs)
+
+        entries = self.entries(fs, '/t')
+        self.assertEqual('/t/file', entries['file'].path)
+        # The mount point's stats come from the mounted filesystem's root
+        self.assertEqual(0o700, stat.S_IMODE(entries['dir'].stat().st_mode))
+        inner = self.entries(fs, '/t/dir')['inner']
+        self.assertEqual('/t/dir/inner', inner.path)
+        self.assertEqual(8, inner.stat().st_size)
+
+    def test_union(self):
+        lower = self.make_tree(make_fake())
+        union = stacking.UnionFS()
+        union.add_branch(lower.backend, ref='lower', rank=1)
+        union.add_branch(make_fake(), ref='upper', rank=0, writable=True)
+        fs = fslib.FileSystem(union)
+        fs.writelines('/t/file', ['upper branch'])
+        fs.writelines('/t/new', [''])
+
+        entries = self.entries(fs, '/t')
+        self.assertEqual(['dangling', 'dir', 'dir_link', 'file', 'file_link', 'new'], sorted(entries))
+        # From the highest branch holding the name
+        self.assertEqual(13, entries['file'].stat().st_size)
+        self.assertTrue(entries['dir'].is_dir())
+        self.assertEqual('/t/new', entries['new'].path)
+
+
+class WalkTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        for path in ('a/b/c', 'a/d', 'e', 'f/g'):
+            os.makedirs(os.path.join(self.root, path))
+        for path in ('x', 'a/y', 'a/b/c/z', 'f/g/w'):
+            open(os.path.join(self.root, path), 'w').close()
+        os.symlink(os.path.join(self.root, 'f'), os.path.join(self.root, 'a', 'link'))
+        self.fs = fslib.FileSystem(base.OSFS(self.root))
+
+    def os_walk(self, **kwargs):
+        return [
+            ('/' + os.path.relpath(dirpath, self.root).replace('.', '', 1).lstrip('/'), dirnames, filenames)
+            for dirpath, dirnames, filenames in os.walk(self.root, **kwargs)
+        ]
+
+    def sorted_walk(self, walk):
+        return sorted((dirpath, sorted(dirnames), sorted(filenames)) for dirpath, dirnames, filenames in walk)
+
+    def test_os_walk(self):
+        for topdown in (True, False):
+            for followlinks in (True, False):
+                for workers in (None, 4):
+                    with self.subTest(topdown=topdown, followlinks=followlinks, workers=workers):
+                        expected = self.os_walk(topdown=topdown, followlinks=followlinks)
+                        walk = list(self.fs.walk('/', topdown=topdown, followlinks=followlinks, workers=workers))
+                        self.assertEqual(self.sorted_walk(expected), self.sorted_walk(walk))
+                        if workers is None:
+                            # Same listing order as os.scandir()
+                            self.assertEqual(expected, walk)
+
+    def test_ordered(self):
+        for topdown in (True, False):
+            with self.subTest(topdown=topdown):
+                self.assertEqual(
+                    list(self.fs.walk('/', topdown=topdown)),
+                    list(self.fs.walk('/', topdown=topdown, workers=4)),
+                )
+
+    def test_unordered(self):
+        for topdown in (True, False):
+            with self.subTest(topdown=topdown):
+                walk = list(self.fs.walk('/', topdown=topdown, workers=4, ordered=False))
+                self.assertEqual(self.sorted_walk(self.fs.walk('/')), self.sorted_walk(walk))
+                positions = {dirpath: index for index, (dirpath, _dirs, _files) in enumerate(walk)}
+                for dirpath in positions:
+                    if dirpath != '/':
+                        parent = os.path.dirname(dirpath)
+                        self.assertEqual(topdown, positions[parent] < positions[dirpath])
+
+    def test_prune(self):
+        for workers, ordered in ((None, True), (4, True), (4, False)):
+            with self.subTest(workers=workers, ordered=ordered):
+                seen = []
+                for dirpath, dirnames, _filenames in self.fs.walk('/', workers=workers, ordered=ordered):
+                    seen.append(dirpath)
+                    dirnames[:] = [name for name in dirnames if name not in ('b', 'f')]
+                self.assertEqual(['/', '/a', '/a/d', '/e'], sorted(seen))
+
+    def test_onerror(self):
+        for workers, ordered in ((None, True), (4, True), (4, False)):
+            with self.subTest(workers=workers, ordered=ordered):
+                errors = []
+                self.assertEqual([], list(self.fs.walk('/missing', onerror=errors.append, workers=workers,
+                                                       ordered=ordered)))
+                self.assertEqual([errno.ENOENT], [error.errno for error in errors])
+                # Ignored by default
+                self.assertEqual([], list(self.fs.walk('/missing', workers=workers, ordered=ordered)))
+
+    def test_stop_early(self):
+        for i in range(50):
+            os.makedirs(os.path.join(self.root, 'many', 'd%d' % i))
+
+        scanned = []
+
+        class CountingFileSystem(fslib.FileSystem):
+            def _walk_scan(self, path, followlinks):
+                scanned.append(path)
+                return super()._walk_scan(path, followlinks)
+
+        fs = CountingFileSystem(self.fs.backend)
+        walk = fs.walk('/many', workers=2)
+        next(walk)
+        next(walk)
+        walk.close()
+        # Only a few subdirectories were listed ahead
+        self.assertLess(len(scanned), 10)
+
+
+class HashTests(unittest.TestCase):
+    FILES = {
+        '/empty': b'',
+        '/a/small': b'small',
+        '/a/b/large': os.urandom(3 * base.HASH_CHUNK_SIZE + 1),
+    }
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.fs = self.prepare(fslib.FileSystem(base.OSFS(self.root)))
+
+    def prepare(self, fs):
+        fs.makedirs('/a/b')
+        for path, content in self.FILES.items():
+            with fs.open(path, 'wb') as f:
+                f.write(content)
+        fs.symlink('/link', '/a/small')
+        fs.symlink('/dangling', '/missing')
+        return fs
+
+    def expected(self, method=hashlib.md5):
+        return {path: method(content).hexdigest() for path, content in self.FILES.items()}
+
+    def test_get_hash(self):
+        for path, digest in self.expected(hashlib.sha256).items():
+            with self.subTest(path=path):
+                self.assertEqual(digest, self.fs.get_hash(path, method=hashlib.sha256).hexdigest())
+        self.assertEqual(self.expected()['/a/small'], self.fs.get_hash('/link').hexdigest())
+        with self.assertRaises(FileNotFoundError):
+            self.fs.get_hash('/dangling')
+
+    def test_hash_mapped(self):
+        for path, digest in self.expected().items():
+            with self.subTest(path=path):
+                with open(self.root + path, 'rb') as f:
+                    self.assertEqual(digest, base._hash_mapped(f, hashlib.md5).hexdigest())
+
+    def test_memory(self):
+        fs = self.prepare(fslib.FileSystem(stacking.MemoryFS()))
+        for path, digest in self.expected().items():
+            with self.subTest(path=path):
+                self.assertEqual(digest, fs.get_hash(path, chunk_size=1000).hexdigest())
+
+    def test_hash_tree(self):
+        expected = self.expected()
+        expected['/link'] = expected['/a/small']
+        for workers in (None, 4):
+            with self.subTest(workers=workers):
+                self.assertEqual(expected, self.fs.hash_tree('/', workers=workers))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            self.assertEqual(expected, self.fs.hash_tree('/', executor=executor))
+        self.assertEqual(
+            {path: digest for path, digest in expected.items() if path.startswith('/a/')},
+            self.fs.hash_tree('/a', workers=4),
+        )
+
+    def test_hash_tree_onerror(self):
+        errors = []
+        self.assertEqual({}, self.fs.hash_tree('/missing', onerror=errors.append))
+        self.assertEqual([errno.ENOENT], [error.errno for error in errors])
+
+    def test_union(self):
+        union = stacking.UnionFS()
+        union.add_branch(base.OSFS(self.root), ref='lower', rank=1)
+        union.add_branch(make_fake(), ref='upper', rank=0, writable=True)
+        fs = fslib.FileSystem(union)
+        fs.writelines('/a/small', ['changed'])
+
+        expected = self.expected()
+        # The link of the lower OSFS points to the lower file
+        expected['/link'] = expected['/a/small']
+        expected['/a/small'] = hashlib.md5(b'changed\n').hexdigest()
+        self.assertEqual(expected['/a/b/large'], fs.get_hash('/a/b/large').hexdigest())
+        self.assertEqual(expected['/a/small'], fs.get_hash('/a/small').hexdigest())
+        self.assertEqual(expected, fs.hash_tree('/'))
+
+    def test_mount(self):
+        mount_fs = stacking.MountFS()
+        mount_fs.mount_fs(self.prepare(fslib.FileSystem(make_fake())).backend, '/')
+        mount_fs.mount_fs(base.OSFS(self.root), '/a/b')
+        fs = fslib.FileSystem(mount_fs)
+
+        expected = self.expected()
+        self.assertEqual(expected['/a/small'], fs.get_hash('/a/b/a/small').hexdigest())
+        tree = fs.hash_tree('/a/b')
+        self.assertEqual(expected['/a/b/large'], tree['/a/b/a/b/large'])
+        self.assertEqual(expected['/empty'], tree['/a/b/empty'])
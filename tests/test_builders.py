@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import io
+import os
+import stat
+import tarfile
+import tempfile
+import unittest
+
+import fslib
+from fslib import base
+from fslib import builders
+from fslib import stacking
+
+
+class ImportDirectoryTests(unittest.TestCase):
+    def test_import(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'src', 'a', 'b'))
+            with open(os.path.join(tmp, 'src', 'a', 'f'), 'wb') as f:
+                f.write(b'content')
+            os.chmod(os.path.join(tmp, 'src', 'a', 'f'), 0o640)
+            os.utime(os.path.join(tmp, 'src', 'a', 'f'), (1000, 2000))
+            os.symlink('a/f', os.path.join(tmp, 'src', 'link'))
+
+            memory_fs = stacking.MemoryFS(default_umask=0o777)
+            builders.import_directory(memory_fs, base.OSFS(tmp), path='/src', target='/imported')
+
+        fs = fslib.FileSystem(memory_fs)
+        self.assertEqual(['a', 'link'], sorted(fs.listdir('/imported')))
+        self.assertEqual(['b', 'f'], sorted(fs.listdir('/imported/a')))
+        self.assertTrue(fs.dir_exists('/imported/a/b'))
+        with fs.open('/imported/a/f', 'rb') as f:
+            self.assertEqual(b'content', f.read())
+        stats = fs.stat('/imported/a/f')
+        self.assertEqual(stat.S_IFREG | 0o640, stats.st_mode)
+        self.assertEqual(2000, stats.st_mtime)
+        self.assertEqual('a/f', fs.readlink('/imported/link'))
+
+
+class ImportTarfileTests(unittest.TestCase):
+    def make_tar(self, *members):
+        """Build an archive from (TarInfo attributes, content) pairs."""
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w') as tar:
+            for attrs, content in members:
+                info = tarfile.TarInfo(attrs.pop('name'))
+                for name, value in attrs.items():
+                    setattr(info, name, value)
+                if content is not None:
+                    info.size = len(content)
+                    content = io.BytesIO(content)
+                tar.addfile(info, content)
+        data.seek(0)
+        return data
+
+    def file(self, name, content, **attrs):
+        return dict(name=name, mode=0o644, **attrs), content
+
+    def entry(self, name, kind, **attrs):
+        return dict(name=name, type=kind, mode=0o755, **attrs), None
+
+    def import_tar(self, *members, target='/'):
+        memory_fs = stacking.MemoryFS(default_umask=0o777)
+        builders.import_tarfile(memory_fs, self.make_tar(*members), target=target)
+        return memory_fs, fslib.FileSystem(memory_fs)
+
+    def read(self, fs, path):
+        with fs.open(path, 'rb') as f:
+            return f.read()
+
+    def test_import(self):
+        _memory_fs, fs = self.import_tar(
+            self.entry('./d', tarfile.DIRTYPE, mtime=1234),
+            self.file('./d/f', b'content'),
+            # Parent directories are created as needed
+            self.file('x/y/z', b'deep'),
+            self.entry('l', tarfile.SYMTYPE, linkname='d/f'),
+            self.entry('fifo', tarfile.FIFOTYPE),
+            target='/imported',
+        )
+        self.assertEqual(['d', 'l', 'x'], sorted(fs.listdir('/imported')))
+        self.assertEqual(b'content', self.read(fs, '/imported/d/f'))
+        self.assertEqual(b'deep', self.read(fs, '/imported/x/y/z'))
+        self.assertEqual(1234, fs.stat('/imported/d').st_mtime)
+        self.assertEqual(stat.S_IFREG | 0o644, fs.stat('/imported/d/f').st_mode)
+        self.assertEqual('d/f', fs.readlink('/imported/l'))
+
+    def test_hard_links(self):
+        _memory_fs, fs = self.import_tar(
+            self.file('f', b'shared'),
+            self.entry('h', tarfile.LNKTYPE, linkname='f'),
+            self.entry('l', tarfile.SYMTYPE, linkname='f'),
+            self.entry('hl', tarfile.LNKTYPE, linkname='l'),
+        )
+        self.assertEqual(b'shared', self.read(fs, '/h'))
+        # Shared until written to
+        with fs.open('/h', 'ab') as f:
+            f.write(b'!')
+        self.assertEqual(b'shared!', self.read(fs, '/h'))
+        self.assertEqual(b'shared', self.read(fs, '/f'))
+        # A link to the symlink itself
+        self.assertTrue(fs.symlink_exists('/hl'))
+        self.assertEqual('f', fs.readlink('/hl'))
+
+    def test_invalid_hard_links(self):
+        for members in (
+                # Not imported yet
+                [self.entry('h', tarfile.LNKTYPE, linkname='f'), self.file('f', b'')],
+                [self.entry('h', tarfile.LNKTYPE, linkname='missing')],
+                [self.entry('d', tarfile.DIRTYPE), self.entry('h', tarfile.LNKTYPE, linkname='d')],
+        ):
+            with self.subTest(members=members):
+                with self.assertRaises(fslib.FSError):
+                    self.import_tar(*members)
+
+    def test_duplicates(self):
+        _memory_fs, fs = self.import_tar(
+            self.file('f', b'first'),
+            self.file('f', b'second'),
+            self.entry('d', tarfile.DIRTYPE),
+            self.file('d/a', b''),
+            self.entry('d', tarfile.DIRTYPE, mtime=1234),
+            self.entry('e', tarfile.DIRTYPE),
+            self.file('e', b'was a directory'),
+            self.file('g', b'was a file'),
+            self.entry('g', tarfile.DIRTYPE),
+            self.file('g/b', b'below'),
+            self.entry('h', tarfile.LNKTYPE, linkname='e'),
+        )
+        self.assertEqual(b'second', self.read(fs, '/f'))
+        # Directories are updated in place
+        self.assertEqual(['a'], fs.listdir('/d'))
+        self.assertEqual(1234, fs.stat('/d').st_mtime)
+        self.assertEqual(b'was a directory', self.read(fs, '/e'))
+        self.assertEqual(b'was a directory', self.read(fs, '/h'))
+        self.assertEqual(b'below', self.read(fs, '/g/b'))
+
+    def test_invalid_duplicates(self):
+        for members in (
+                [self.entry('d', tarfile.DIRTYPE), self.file('d/a', b''), self.file('d', b'')],
+                [self.file('f', b''), self.file('f/a', b'')],
+        ):
+            with self.subTest(members=members):
+                with self.assertRaises(fslib.FSError):
+                    self.import_tar(*members)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import fslib
+from fslib import base
+from fslib import events
+from fslib import stacking
+
+
+def drain(watch, timeout=0.2):
+    """The (kind, path) of the events received until none came for ``timeout`` seconds."""
+    received = []
+    while True:
+        event = watch.get(timeout=timeout)
+        if event is None:
+            return received
+        received.append((event.kind, event.path))
+
+
+class MemoryFSWatchTests(unittest.TestCase):
+    def test_watch(self):
+        memory_fs = stacking.MemoryFS()
+        fs = fslib.FileSystem(memory_fs)
+        with fs.watch('/', recursive=True) as recursive, fs.watch('/d') as direct:
+            fs.mkdir('/d')
+            fs.mkdir('/d/e')
+            with fs.open('/d/e/f', 'w') as f:
+                f.write('x')
+            fs.remove('/d/e/f')
+            self.assertEqual([
+                (events.CREATE, '/d'),
+                (events.CREATE, '/d/e'),
+                (events.CREATE, '/d/e/f'),
+                (events.MODIFY, '/d/e/f'),
+                (events.DELETE, '/d/e/f'),
+            ], drain(recursive, 0))
+            self.assertEqual([(events.CREATE, '/d'), (events.CREATE, '/d/e')], drain(direct, 0))
+        self.assertFalse(memory_fs._events)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), "inotify is only available on Linux")
+class OSFSWatchTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.fs = fslib.FileSystem(base.OSFS(tmp.name))
+
+    def watch(self, path, recursive=True, **kwargs):
+        watch = self.fs.watch(path, recursive=recursive, **kwargs)
+        self.addCleanup(watch.close)
+        return watch
+
+    def test_write(self):
+        watch = self.watch('/')
+        with self.fs.open('/f', 'wb') as f:
+            f.write(b'x')
+        with self.fs.open('/f', 'ab') as f:
+            f.write(b'y')
+        self.assertEqual([
+            (events.CREATE, '/f'),
+            (events.MODIFY, '/f'),
+            (events.MODIFY, '/f'),
+        ], drain(watch))
+
+    def test_rmtree(self):
+        self.fs.makedirs('/d/e')
+        watch = self.watch('/')
+        self.fs.rmtree('/d')
+        self.assertEqual([(events.DELETE, '/d/e'), (events.DELETE, '/d')], drain(watch))
+
+    def test_top_deleted(self):
+        self.fs.makedirs('/d')
+        watch = self.watch('/d')
+        self.fs.remove('/d')
+        self.assertEqual([(events.DELETE, '/d')], drain(watch))
+
+    def test_move(self):
+        self.fs.makedirs('/d/e')
+        self.fs.makedirs('/other')
+        watch = self.watch('/')
+        os.rename(os.path.join(self.root, 'd'), os.path.join(self.root, 'other', 'd'))
+        self.assertEqual([
+            (events.DELETE, '/d'),
+            (events.CREATE, '/other/d'),
+            (events.CREATE, '/other/d/e'),
+        ], drain(watch))
+        # Subdirectories are watched under their new path
+        self.fs.writelines('/other/d/e/f', ['x'])
+        self.assertEqual([(events.CREATE, '/other/d/e/f'), (events.MODIFY, '/other/d/e/f')], drain(watch))
+
+    def test_moved_away(self):
+        self.fs.makedirs('/d/e')
+        outside = tempfile.TemporaryDirectory()
+        self.addCleanup(outside.cleanup)
+        watch = self.watch('/')
+        os.rename(os.path.join(self.root, 'd'), os.path.join(outside.name, 'd'))
+        with open(os.path.join(outside.name, 'd', 'e', 'f'), 'w'):
+            pass
+        self.assertEqual([(events.DELETE, '/d')], drain(watch))
+
+    def test_callback_error(self):
+        received = []
+
+        def callback(event):
+            received.append(event)
+            if len(received) == 1:
+                raise ValueError()
+
+        self.watch('/', callback=callback)
+        with self.assertLogs('fslib.events', 'ERROR') as logs:
+            self.fs.mkdir('/a')
+            deadline = time.monotonic() + 5
+            while not logs.records:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+        # The watcher is still running
+        self.fs.mkdir('/b')
+        deadline = time.monotonic() + 5
+        while len(received) < 2:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual([events.Event(events.CREATE, '/a'), events.Event(events.CREATE, '/b')], received)
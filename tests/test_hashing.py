@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import hashlib
+import os
+import pickle
+import tempfile
+import unittest
+
+import fslib
+from fslib import base
+from fslib import hashing
+from fslib import stacking
+
+
+class DigestCacheTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.fs = fslib.FileSystem(base.OSFS(self.tmp))
+        for name in ('a', 'b', 'c'):
+            self.fs.writelines('/' + name, [name])
+
+    def make_caches(self, maxsize=10):
+        sqlite_cache = hashing.SQLiteDigestCache(os.path.join(self.tmp, 'digests.%d' % maxsize), maxsize=maxsize)
+        self.addCleanup(sqlite_cache.close)
+        return [hashing.MemoryDigestCache(maxsize), sqlite_cache]
+
+    def test_lookup(self):
+        for cache in self.make_caches():
+            with self.subTest(cache=cache):
+                file_stat = self.fs.stat('/a')
+                self.assertIsNone(cache.get(file_stat, 'md5'))
+                cache.set(file_stat, 'md5', b'md5')
+                cache.set(file_stat, 'sha1', b'sha1')
+                self.assertEqual(b'md5', cache.get(file_stat, 'md5'))
+                self.assertEqual(b'sha1', cache.get(file_stat, 'sha1'))
+
+                # Another version of the file
+                os.utime(os.path.join(self.tmp, 'a'), ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 1000))
+                self.assertIsNone(cache.get(self.fs.stat('/a'), 'md5'))
+
+                cache.invalidate(file_stat)
+                self.assertIsNone(cache.get(file_stat, 'sha1'))
+
+    def test_no_identity(self):
+        memory_fs = fslib.FileSystem(stacking.MemoryFS())
+        memory_fs.writelines('/a', ['a'])
+        for cache in self.make_caches():
+            with self.subTest(cache=cache):
+                file_stat = memory_fs.stat('/a')
+                cache.set(file_stat, 'md5', b'md5')
+                self.assertIsNone(cache.get(file_stat, 'md5'))
+                self.assertEqual(0, cache.info().currsize)
+
+    def test_eviction(self):
+        for cache in self.make_caches(maxsize=2):
+            with self.subTest(cache=cache):
+                cache.set(self.fs.stat('/a'), 'md5', b'a')
+                cache.set(self.fs.stat('/b'), 'md5', b'b')
+                self.assertEqual(b'a', cache.get(self.fs.stat('/a'), 'md5'))
+                cache.set(self.fs.stat('/c'), 'md5', b'c')
+                self.assertIsNone(cache.get(self.fs.stat('/b'), 'md5'))
+                self.assertEqual(b'a', cache.get(self.fs.stat('/a'), 'md5'))
+                self.assertEqual(b'c', cache.get(self.fs.stat('/c'), 'md5'))
+                self.assertEqual(2, cache.info().currsize)
+
+    def test_get_hash(self):
+        for cache in self.make_caches():
+            with self.subTest(cache=cache):
+                fs = fslib.FileSystem(self.fs.backend, digest_cache=cache)
+                digest = hashlib.md5(b'a\n').hexdigest()
+                self.assertEqual(digest, fs.get_hash('/a').hexdigest())
+                cached = fs.get_hash('/a')
+                self.assertIsInstance(cached, hashing.CachedHash)
+                self.assertEqual(digest, cached.hexdigest())
+
+                # Invalidated on write
+                with fs.open('/a', 'w') as f:
+                    f.write('other\n')
+                self.assertIsNone(cache.get(fs.stat('/a'), 'md5'))
+                self.assertEqual(hashlib.md5(b'other\n').hexdigest(), fs.get_hash('/a').hexdigest())
+                fs.writelines('/a', ['a'])
+
+    def test_sqlite_reopen(self):
+        cache = hashing.SQLiteDigestCache(os.path.join(self.tmp, 'digests'), maxsize=2)
+        self.addCleanup(cache.close)
+        cache.set(self.fs.stat('/a'), 'md5', b'a')
+        clone = pickle.loads(pickle.dumps(cache))
+        self.addCleanup(clone.close)
+        self.assertEqual(b'a', clone.get(self.fs.stat('/a'), 'md5'))
+
+        # Both share the usage clock and size
+        clone.set(self.fs.stat('/b'), 'md5', b'b')
+        self.assertEqual(b'a', cache.get(self.fs.stat('/a'), 'md5'))
+        cache.set(self.fs.stat('/c'), 'md5', b'c')
+        self.assertIsNone(clone.get(self.fs.stat('/b'), 'md5'))
+        self.assertEqual(2, clone.info().currsize)
+        cache.invalidate(self.fs.stat('/a'))
+        self.assertEqual(1, clone.info().currsize)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import copy
+import pickle
+import unittest
+
+from fslib import helpers
+
+
+class NormPathTests(unittest.TestCase):
+    def test_normalize(self):
+        path = helpers.normpath('/a//b/../c/')
+        self.assertEqual('/a/c', path)
+        self.assertEqual(('a', 'c'), path.parts)
+        self.assertIs(path, helpers.normpath('/a/c'))
+        self.assertEqual(('/', '/a', '/a/c'), path.lineage)
+
+    def test_parent_components(self):
+        # Collapsed lexically on absolute paths, never above the root
+        self.assertEqual('/a/c', helpers.normpath('/a/b/../c'))
+        self.assertEqual('/', helpers.normpath('/a/../..'))
+        self.assertEqual((), helpers.normpath('/..').parts)
+        # Kept when leading a relative path
+        path = helpers.normpath('a/../../b')
+        self.assertEqual('../b', path)
+        self.assertEqual(('..', 'b'), path.parts)
+
+    def test_copy(self):
+        path = helpers.normpath('/a/b')
+        for clone in (copy.copy(path), copy.deepcopy(path), pickle.loads(pickle.dumps(path))):
+            self.assertIs(path, clone)
+            self.assertEqual(('a', 'b'), clone.parts)
+
+
+class LRUCacheTests(unittest.TestCase):
+    def test_eviction(self):
+        cache = helpers.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(1, cache.get('a'))
+        cache['c'] = 3
+        self.assertEqual(['a', 'c'], cache.keys())
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((1, 1, 2, 2, 1), tuple(cache.info()))
+
+    def test_copy(self):
+        cache = helpers.LRUCache(2)
+        cache['a'] = 1
+        for clone in (copy.deepcopy(cache), pickle.loads(pickle.dumps(cache))):
+            self.assertEqual(1, clone.get('a'))
+            clone['b'] = 2
+            self.assertNotIn('b', cache)
+
+
+class PathLRUCacheTests(unittest.TestCase):
+    def test_pop_tree(self):
+        cache = helpers.PathLRUCache(10)
+        for path in ('/a', '/a/b/c', '/a/b/d', '/ab', '/e/f'):
+            cache[helpers.normpath(path)] = True
+        cache.pop_tree(helpers.normpath('/a/b'))
+        self.assertEqual(['/a', '/ab', '/e/f'], cache.keys())
+        cache.pop_tree(helpers.normpath('/a'))
+        self.assertEqual(['/ab', '/e/f'], cache.keys())
+        cache.pop(helpers.normpath('/e/f'))
+        cache.pop(helpers.normpath('/ab'))
+        # Nothing left in the index
+        self.assertEqual({}, cache._children)
+
+    def test_eviction(self):
+        cache = helpers.PathLRUCache(2)
+        for path in ('/a/b', '/a/c', '/d'):
+            cache[helpers.normpath(path)] = True
+        self.assertEqual(['/a/c', '/d'], cache.keys())
+        cache.pop_tree(helpers.normpath('/a'))
+        self.assertEqual(['/d'], cache.keys())
+        self.assertEqual({'/': {'/d'}}, cache._children)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import unittest
+
+import fslib
+from fslib import instrumentation
+from fslib import stacking
+
+
+class InstrumentedFSTests(unittest.TestCase):
+    def test_record(self):
+        recorder = instrumentation.Recorder()
+        memory_fs = stacking.MemoryFS()
+        fs = fslib.FileSystem(stacking.InstrumentedFS(recorder=recorder, wrapped=memory_fs))
+        fs.mkdir('/a')
+        fs.stat('/a')
+        with self.assertRaises(FileNotFoundError):
+            fs.stat('/b')
+
+        stats = recorder.snapshot()[('InstrumentedFS(MemoryFS)', 'stat')]
+        self.assertEqual(2, stats.calls)
+        self.assertEqual({'ENOENT': 1}, stats.errors)
+        self.assertEqual(2, sum(stats.buckets))
+        self.assertIn('InstrumentedFS(MemoryFS)', recorder.report())
+
+    def test_enabled(self):
+        recorder = instrumentation.Recorder()
+        whiteout_fs = stacking.WhiteoutFS(stacking.MemoryWhiteoutCache(), wrapped=stacking.MemoryFS())
+        fs = fslib.FileSystem(stacking.InstrumentedFS(recorder=recorder, wrapped=whiteout_fs))
+        fs.mkdir('/a')
+        instrumentation.enable(recorder)
+        try:
+            fs.stat('/a')
+            fs.stat('/a')
+        finally:
+            instrumentation.disable()
+        self.assertFalse(instrumentation.is_enabled())
+
+        snapshot = recorder.snapshot()
+        self.assertEqual(2, snapshot[('InstrumentedFS(WhiteoutFS)', 'stat')].calls)
+        self.assertEqual(2, snapshot[('WhiteoutFS', 'stat')].calls)
+        self.assertIn(('MemoryFS', 'stat'), snapshot)
+        # Nested calls are excluded from the own time
+        outer = snapshot[('InstrumentedFS', 'stat')]
+        self.assertLessEqual(outer.own_ns, outer.total_ns)
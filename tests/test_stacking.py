@@ -0,0 +1,906 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import copy
+import errno
+import io
+import os
+import pickle
+import posixpath
+import stat
+import tempfile
+import time
+import unittest
+
+import fslib
+from fslib import base
+from fslib import builders
+from fslib import instrumentation
+from fslib import stacking
+
+
+def make_fake():
+    return builders.make_memory_fake(default_umask=0o777)
+
+
+class CopyTests(unittest.TestCase):
+    def make_tree(self, backend):
+        fs = fslib.FileSystem(backend)
+        fs.makedirs('/a/b')
+        fs.writelines('/a/b/f', ['x'])
+        fs.writelines('/a/g', ['y'])
+        fs.remove('/a/b/f')
+        return fs
+
+    def assertSameTree(self, fs, clone):
+        self.assertEqual(list(fs.walk('/')), list(fslib.FileSystem(clone).walk('/')))
+
+    def test_memoryfs(self):
+        memory_fs = stacking.MemoryFS()
+        fs = self.make_tree(memory_fs)
+        for clone in (copy.deepcopy(memory_fs), pickle.loads(pickle.dumps(memory_fs))):
+            self.assertSameTree(fs, clone)
+
+    def test_whiteoutfs(self):
+        whiteout_fs = make_fake()
+        fs = self.make_tree(whiteout_fs)
+        for clone in (copy.deepcopy(whiteout_fs), pickle.loads(pickle.dumps(whiteout_fs))):
+            self.assertSameTree(fs, clone)
+
+    def test_watched(self):
+        whiteout_fs = make_fake()
+        fs = self.make_tree(whiteout_fs)
+        events = []
+        with fs.watch('/a', callback=events.append):
+            clone = copy.deepcopy(whiteout_fs)
+            fslib.FileSystem(clone).writelines('/a/h', ['z'])
+            self.assertEqual([], events)
+            self.assertFalse(fs.file_exists('/a/h'))
+
+    def test_unionfs(self):
+        union = stacking.UnionFS(cache_size=16)
+        union.add_branch(make_fake(), ref='upper', rank=0, writable=True)
+        fs = self.make_tree(union)
+        fs.stat('/a/g')
+        for clone in (copy.deepcopy(union), pickle.loads(pickle.dumps(union))):
+            self.assertSameTree(fs, clone)
+
+
+class CachingFSTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.osfs = fslib.FileSystem(base.OSFS(tmp.name))
+        self.caching_fs = stacking.CachingFS(ttl=None, wrapped=base.OSFS(tmp.name))
+        self.fs = fslib.FileSystem(self.caching_fs)
+        self.osfs.makedirs('/real')
+        self.osfs.writelines('/real/f', ['x'])
+
+    def test_cached(self):
+        self.assertFalse(self.fs.file_exists('/g'))
+        self.assertEqual(['real'], self.fs.listdir('/'))
+        # Changes made below the cache are not seen
+        self.osfs.writelines('/g', ['y'])
+        self.assertFalse(self.fs.file_exists('/g'))
+        self.assertEqual(['real'], self.fs.listdir('/'))
+        self.caching_fs.invalidate('/', recursive=True)
+        self.assertTrue(self.fs.file_exists('/g'))
+        self.assertEqual(['g', 'real'], sorted(self.fs.listdir('/')))
+
+    def test_write(self):
+        self.assertFalse(self.fs.file_exists('/real/g'))
+        self.fs.writelines('/real/g', ['y'])
+        self.assertTrue(self.fs.file_exists('/real/g'))
+        self.assertEqual(['f', 'g'], sorted(self.fs.listdir('/real')))
+        self.fs.remove('/real/g')
+        self.assertFalse(self.fs.file_exists('/real/g'))
+
+    def test_invalidate_subtree(self):
+        self.osfs.makedirs('/other')
+        self.assertEqual([True, True], self.fs.exists_many(['/real/f', '/other']))
+        self.fs.chmod('/real', 0o755)
+        self.assertNotIn('/real/f', self.caching_fs._cache)
+        self.assertIn('/other', self.caching_fs._cache)
+
+    def test_rmtree(self):
+        self.assertTrue(self.fs.file_exists('/real/f'))
+        self.fs.rmtree('/real')
+        self.assertFalse(self.fs.file_exists('/real/f'))
+        self.assertEqual([], self.fs.listdir('/'))
+
+    def test_unlink_symlink(self):
+        self.fs.symlink('/link', 'real')
+        self.assertTrue(self.fs.file_exists('/link/f'))
+        self.caching_fs.unlink('/link')
+        self.assertFalse(self.fs.file_exists('/link/f'))
+
+    def test_create_symlink(self):
+        self.assertFalse(self.fs.file_exists('/link/f'))
+        self.fs.symlink('/link', 'real')
+        self.assertTrue(self.fs.file_exists('/link/f'))
+
+    def assertEventually(self, check):
+        deadline = time.monotonic() + 5
+        while not check():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_follow_changes(self):
+        caching_fs = stacking.CachingFS(ttl=None, follow_changes=True, wrapped=self.caching_fs.wrapped)
+        self.addCleanup(caching_fs.close)
+        fs = fslib.FileSystem(caching_fs)
+
+        self.assertFalse(fs.file_exists('/g'))
+        self.osfs.writelines('/g', ['y'])
+        self.assertEventually(lambda: fs.file_exists('/g'))
+        self.assertFalse(fs.file_exists('/link/f'))
+        self.osfs.symlink('/link', 'real')
+        self.assertEventually(lambda: fs.file_exists('/link/f'))
+
+
+class UnionFSRmtreeTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def make_union(self, whiteout_cache):
+        self.lower = fslib.FileSystem(stacking.MemoryFS())
+        upper = stacking.WhiteoutFS(whiteout_cache, wrapped=stacking.MemoryFS())
+        union = stacking.UnionFS(cache_size=100)
+        union.add_branch(self.lower.backend, ref='lower', rank=1)
+        union.add_branch(upper, ref='upper', rank=0, writable=True)
+        return fslib.FileSystem(union)
+
+    def check_rmtree(self, whiteout_cache):
+        fs = self.make_union(whiteout_cache)
+        self.lower.makedirs('/big/sub')
+        for i in range(10):
+            self.lower.writelines('/big/f%d' % i, ['x'])
+        self.lower.writelines('/big/sub/g', ['x'])
+        fs.writelines('/big/sub/h', ['y'])
+        # Cached resolutions
+        self.assertTrue(fs.file_exists('/big/sub/g'))
+
+        fs.rmtree('/big')
+        self.assertFalse(fs.dir_exists('/big'))
+        self.assertFalse(fs.file_exists('/big/sub/g'))
+        self.assertFalse(fs.file_exists('/big/sub/h'))
+        self.assertEqual([], fs.listdir('/'))
+        # The lower branch is unchanged
+        self.assertTrue(self.lower.file_exists('/big/sub/g'))
+        # Deleted entries don't come back
+        fs.makedirs('/big/sub')
+        self.assertEqual(['sub'], fs.listdir('/big'))
+        self.assertEqual([], fs.listdir('/big/sub'))
+
+    def test_rmtree(self):
+        self.check_rmtree(stacking.MemoryWhiteoutCache())
+
+    def test_rmtree_subtree(self):
+        cache = stacking.SQLiteWhiteoutCache(os.path.join(self.tmp, 'whiteouts'))
+        self.addCleanup(cache.close)
+        self.check_rmtree(cache)
+
+    def test_rmtree_one_row(self):
+        cache = stacking.SQLiteWhiteoutCache(os.path.join(self.tmp, 'whiteouts'))
+        self.addCleanup(cache.close)
+        fs = self.make_union(cache)
+        self.lower.makedirs('/big/sub')
+        for i in range(50):
+            self.lower.writelines('/big/f%d' % i, ['x'])
+        fs.rmtree('/big')
+        self.assertEqual(['/big'], list(cache.keys()))
+
+    def test_rmtree_mounted(self):
+        cache = stacking.SQLiteWhiteoutCache(os.path.join(self.tmp, 'whiteouts'))
+        self.addCleanup(cache.close)
+        union = self.make_union(cache).backend
+        self.lower.makedirs('/big/sub')
+        mount_fs = stacking.MountFS()
+        mount_fs.mount_fs(union, '/')
+        fs = fslib.FileSystem(mount_fs)
+        fs.rmtree('/big')
+        self.assertFalse(fs.dir_exists('/big'))
+        self.assertEqual(['/big'], list(cache.keys()))
+
+
+class UnionFSCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.union = stacking.UnionFS(cache_size=1024)
+        self.union.add_branch(stacking.MemoryFS(), ref='lower', rank=1)
+        self.union.add_branch(make_fake(), ref='upper', rank=0, writable=True)
+        self.fs = fslib.FileSystem(self.union)
+
+    def test_cached(self):
+        self.fs.writelines('/f', ['x'])
+        self.assertEqual(2, self.fs.stat('/f').st_size)
+        self.assertEqual(2, self.fs.stat('/f').st_size)
+        self.assertEqual(1, self.union.cache_info().hits)
+        self.fs.writelines('/f', ['xyz'])
+        self.assertEqual(4, self.fs.stat('/f').st_size)
+
+    def test_dangling_symlink(self):
+        self.fs.symlink('/link', '/target')
+        with self.assertRaises(FileNotFoundError):
+            self.fs.stat('/link')
+        self.fs.writelines('/target', ['x'])
+        self.assertEqual(2, self.fs.stat('/link').st_size)
+        self.assertEqual([2], [stats.st_size for stats in self.union.stat_many(['/link'])])
+
+    def test_invalidate_subtree(self):
+        self.fs.makedirs('/a/sub')
+        self.fs.makedirs('/b')
+        for path in ('/a/x', '/a/sub/y', '/b/y'):
+            self.fs.writelines(path, [''])
+        self.assertEqual([True] * 3, self.fs.exists_many(['/a/x', '/a/sub/y', '/b/y']))
+
+        self.fs.remove('/a/x')
+        self.assertFalse(self.fs.file_exists('/a/x'))
+        # Paths elsewhere, or alongside, stay cached
+        self.assertIn('/a/sub/y', self.union._resolution_cache)
+        self.assertIn('/b/y', self.union._resolution_cache)
+
+        self.fs.rmtree('/a')
+        self.assertNotIn('/a/sub/y', self.union._resolution_cache)
+        self.assertIn('/b/y', self.union._resolution_cache)
+        self.assertFalse(self.fs.file_exists('/a/sub/y'))
+
+    def test_symlink_target_changed(self):
+        self.fs.symlink('/link', '/target')
+        self.fs.writelines('/target', ['x'])
+        self.assertEqual(2, self.fs.stat('/link').st_size)
+        self.fs.writelines('/target', ['xyz'])
+        self.assertEqual(4, self.fs.stat('/link').st_size)
+
+
+class OpaqueWhiteoutCache(stacking.MemoryWhiteoutCache):
+    """A whiteout cache unable to list the whiteouts of a directory."""
+    def children(self, path):
+        raise NotImplementedError()
+
+
+class UnionFSListingTests(unittest.TestCase):
+    def make_union(self, middle_cache):
+        lower = fslib.FileSystem(stacking.MemoryFS(default_umask=0o777))
+        lower.makedirs('/dir')
+        for name in ('a', 'b', 'c', 'd', 'g'):
+            lower.writelines('/dir/' + name, ['lower'])
+
+        # A read-only branch, hiding some names of the lower one
+        middle_fs = stacking.MemoryFS(default_umask=0o777)
+        middle = fslib.FileSystem(middle_fs)
+        middle.makedirs('/dir')
+        middle.writelines('/dir/e', ['middle'])
+        middle_whiteouts = stacking.WhiteoutFS(middle_cache, wrapped=middle_fs)
+        for name in ('b', 'g'):
+            middle_whiteouts.unlink('/dir/' + name)
+
+        union = stacking.UnionFS()
+        union.add_branch(lower.backend, ref='lower', rank=2)
+        union.add_branch(middle_whiteouts, ref='middle', rank=1)
+        union.add_branch(make_fake(), ref='upper', rank=0, writable=True)
+        fs = fslib.FileSystem(union)
+        fs.remove('/dir/c')
+        fs.writelines('/dir/f', ['upper'])
+        # Deleted in the middle branch, created again above it
+        fs.writelines('/dir/g', ['upper'])
+        return fs
+
+    def test_merged(self):
+        for middle_cache in (stacking.MemoryWhiteoutCache(), OpaqueWhiteoutCache()):
+            with self.subTest(middle_cache=middle_cache):
+                fs = self.make_union(middle_cache)
+                self.assertEqual(['a', 'd', 'e', 'f', 'g'], sorted(fs.listdir('/dir')))
+                self.assertEqual(['a', 'd', 'e', 'f', 'g'], sorted(entry.name for entry in fs.scandir('/dir')))
+                self.assertEqual({'b', 'c'}, set(fs.backend.list_whiteouts('/dir')))
+                self.assertEqual(['upper'], list(fs.readlines('/dir/g')))
+                self.assertFalse(fs.file_exists('/dir/b'))
+
+    def test_opaque_branch(self):
+        with self.assertRaises(NotImplementedError):
+            stacking.WhiteoutFS(OpaqueWhiteoutCache(), wrapped=stacking.MemoryFS()).list_whiteouts('/')
+
+
+class UnionFSCopyUpTests(unittest.TestCase):
+    CONTENT = bytes(range(26)) * 2
+
+    def make_union(self, copy_up):
+        self.lower = fslib.FileSystem(stacking.MemoryFS(default_umask=0o777))
+        self.lower.makedirs('/d')
+        with self.lower.open('/d/f', 'wb') as f:
+            f.write(self.CONTENT)
+        self.upper = fslib.FileSystem(make_fake())
+        self.union = stacking.UnionFS(copy_up=copy_up, copy_up_block_size=16)
+        self.union.add_branch(self.lower.backend, ref='lower', rank=1)
+        self.union.add_branch(self.upper.backend, ref='upper', rank=0, writable=True)
+        return fslib.FileSystem(self.union)
+
+    def read(self, fs, path='/d/f'):
+        with fs.open(path, 'rb') as f:
+            return f.read()
+
+    def test_partial_write(self):
+        for copy_up in (stacking.UnionFS.COPY_UP_FULL, stacking.UnionFS.COPY_UP_ON_CLOSE,
+                        stacking.UnionFS.COPY_UP_LAZY):
+            with self.subTest(copy_up=copy_up):
+                fs = self.make_union(copy_up)
+                expected = bytearray(self.CONTENT)
+                with fs.open('/d/f', 'r+b') as f:
+                    f.seek(20)
+                    f.write(b'XYZ')
+                    expected[20:23] = b'XYZ'
+                    # Untouched blocks, before and after
+                    f.seek(0)
+                    self.assertEqual(bytes(expected), f.read())
+                self.union.finish_copy_ups()
+                self.assertEqual(bytes(expected), self.read(fs))
+                self.assertEqual(bytes(expected), self.read(self.upper))
+                self.assertEqual(self.CONTENT, self.read(self.lower))
+
+    def test_append(self):
+        for copy_up in (stacking.UnionFS.COPY_UP_ON_CLOSE, stacking.UnionFS.COPY_UP_LAZY):
+            with self.subTest(copy_up=copy_up):
+                fs = self.make_union(copy_up)
+                with fs.open('/d/f', 'ab') as f:
+                    f.write(b'tail')
+                self.assertEqual(self.CONTENT + b'tail', self.read(fs))
+                self.assertEqual(len(self.CONTENT) + 4, fs.stat('/d/f').st_size)
+                self.union.finish_copy_ups()
+                self.assertEqual(self.CONTENT + b'tail', self.read(self.upper))
+
+    def test_truncate(self):
+        fs = self.make_union(stacking.UnionFS.COPY_UP_ON_CLOSE)
+        with fs.open('/d/f', 'r+b') as f:
+            f.truncate(10)
+            f.truncate(40)
+        self.assertEqual(self.CONTENT[:10] + bytes(30), self.read(fs))
+        self.assertEqual(self.CONTENT[:10] + bytes(30), self.read(self.upper))
+
+    def test_finish_on_close(self):
+        fs = self.make_union(stacking.UnionFS.COPY_UP_ON_CLOSE)
+        first = fs.open('/d/f', 'r+b')
+        second = fs.open('/d/f', 'r+b')
+        first.write(b'A')
+        first.close()
+        # Still open through another handle
+        self.assertFalse(self.upper.file_exists('/d/f'))
+        second.seek(1)
+        second.write(b'B')
+        second.close()
+        self.assertEqual(b'AB' + self.CONTENT[2:], self.read(self.upper))
+
+    def test_unfinished(self):
+        fs = self.make_union(stacking.UnionFS.COPY_UP_LAZY)
+        with fs.open('/d/f', 'r+b') as f:
+            f.write(b'A')
+        self.assertEqual(b'A' + self.CONTENT[1:], self.read(fs))
+        # The writable branch doesn't hide the lower file with a partial copy
+        self.assertFalse(self.upper.file_exists('/d/f'))
+        self.assertEqual(self.CONTENT, self.read(self.lower))
+
+        fs.remove('/d/f')
+        self.union.finish_copy_ups()
+        self.assertFalse(fs.file_exists('/d/f'))
+        self.assertFalse(self.upper.file_exists('/d/f'))
+
+    def test_chmod(self):
+        fs = self.make_union(stacking.UnionFS.COPY_UP_LAZY)
+        with fs.open('/d/f', 'r+b') as f:
+            f.write(b'A')
+        fs.chmod('/d/f', 0o600)
+        self.union.finish_copy_ups()
+        self.assertEqual(0o600, fs.stat('/d/f').st_mode & 0o777)
+        self.assertEqual(b'A' + self.CONTENT[1:], self.read(self.upper))
+
+
+class MountFSTests(unittest.TestCase):
+    def setUp(self):
+        self.root = fslib.FileSystem(make_fake())
+        self.root.makedirs('/mnt')
+        self.root.makedirs('/a/b/c')
+        self.mnt = fslib.FileSystem(make_fake())
+        self.mnt.makedirs('/sub')
+        self.sub = fslib.FileSystem(make_fake())
+        self.mount_fs = stacking.MountFS()
+        self.mount_fs.mount_fs(self.root.backend, '/')
+        self.mount_fs.mount_fs(self.mnt.backend, '/mnt')
+        self.mount_fs.mount_fs(self.sub.backend, '/mnt/sub')
+        self.fs = fslib.FileSystem(self.mount_fs)
+
+    def errno_of(self, function, *args):
+        with self.assertRaises(OSError) as context:
+            function(*args)
+        return context.exception.errno
+
+    def test_nested(self):
+        self.fs.writelines('/mnt/sub/f', ['sub'])
+        self.fs.writelines('/mnt/g', ['mnt'])
+        self.fs.writelines('/a/h', ['root'])
+        self.assertEqual(['f'], self.sub.listdir('/'))
+        self.assertEqual(['g', 'sub'], sorted(self.mnt.listdir('/')))
+        self.assertEqual(['a', 'mnt'], sorted(self.root.listdir('/')))
+        self.assertEqual(['sub'], list(self.fs.readlines('/mnt/sub/f')))
+        self.assertEqual(['g', 'sub'], sorted(self.fs.listdir('/mnt')))
+
+    def test_mount_errors(self):
+        with self.assertRaises(fslib.FSError):
+            self.mount_fs.mount_fs(make_fake(), '/mnt')
+        with self.assertRaises(OSError):
+            self.mount_fs.mount_fs(make_fake(), '/missing')
+        with self.assertRaises(ValueError):
+            stacking.MountFS().mount_fs(make_fake(), '/mnt')
+
+    def test_umount(self):
+        self.assertEqual(errno.EBUSY, self.errno_of(self.mount_fs.umount_fs, '/mnt'))
+        self.assertEqual(errno.EINVAL, self.errno_of(self.mount_fs.umount_fs, '/a'))
+        self.mount_fs.umount_fs('/mnt/sub')
+        self.assertEqual({}, self.mount_fs._mount_tree.children['mnt'].children)
+        self.mount_fs.umount_fs('/mnt')
+        self.assertEqual(['/'], list(self.mount_fs.filesystems))
+        self.assertEqual(errno.EINVAL, self.errno_of(self.mount_fs.umount_fs, '/'))
+        # The root filesystem's own directory is visible again
+        self.assertEqual([], self.fs.listdir('/mnt'))
+
+    def test_umount_prunes(self):
+        self.mount_fs.mount_fs(make_fake(), '/a/b/c')
+        self.assertIsNotNone(self.mount_fs._find_node('/a/b'))
+        self.mount_fs.umount_fs('/a/b/c')
+        # Intermediate nodes only led to /a/b/c
+        self.assertNotIn('a', self.mount_fs._mount_tree.children)
+        self.assertIn('mnt', self.mount_fs._mount_tree.children)
+
+    def test_rmdir_busy(self):
+        self.assertEqual(errno.EBUSY, self.errno_of(self.mount_fs.rmdir, '/mnt/sub'))
+        self.assertEqual(errno.EBUSY, self.errno_of(self.mount_fs.rmdir, '/mnt'))
+        self.mount_fs.mount_fs(make_fake(), '/a/b/c')
+        # A mount point below
+        self.assertEqual(errno.EBUSY, self.errno_of(self.mount_fs.rmdir, '/a/b'))
+        self.mount_fs.umount_fs('/a/b/c')
+        self.mount_fs.rmdir('/a/b/c')
+        self.assertEqual([], self.fs.listdir('/a/b'))
+
+
+class StatManyTests(unittest.TestCase):
+    def instrumented(self, fs):
+        recorder = instrumentation.Recorder()
+        return recorder, stacking.InstrumentedFS(recorder=recorder, label='inner', wrapped=fs)
+
+    def calls(self, recorder, operation):
+        stats = recorder.snapshot().get(('inner', operation))
+        return stats.calls if stats else 0
+
+    def make_tree(self, fs):
+        tree = fslib.FileSystem(fs)
+        tree.makedirs('/a/b')
+        for i in range(5):
+            tree.writelines('/a/b/%d' % i, [''])
+        tree.writelines('/a/f', [''])
+        return fs
+
+    def test_errors(self):
+        fs = fslib.FileSystem(self.make_tree(stacking.MemoryFS()))
+        results = fs.stat_many(['/a/f', '/missing', '/a/f/sub', '/a/b/0'])
+        self.assertTrue(stat.S_ISREG(results[0].st_mode))
+        self.assertEqual(errno.ENOENT, results[1].errno)
+        self.assertIsInstance(results[2], OSError)
+        self.assertTrue(stat.S_ISREG(results[3].st_mode))
+        self.assertEqual([True, False, False, True], fs.exists_many(['/a/f', '/missing', '/a/f/sub', '/a/b/0']))
+        self.assertEqual([], fs.stat_many([]))
+
+    def test_lstat(self):
+        fs = fslib.FileSystem(self.make_tree(stacking.MemoryFS()))
+        fs.symlink('/link', '/a/f')
+        fs.symlink('/dangling', '/missing')
+        results = fs.stat_many(['/link', '/dangling'], follow=False)
+        self.assertEqual([True, True], [stat.S_ISLNK(result.st_mode) for result in results])
+        results = fs.stat_many(['/link', '/dangling'])
+        self.assertTrue(stat.S_ISREG(results[0].st_mode))
+        self.assertEqual(errno.ENOENT, results[1].errno)
+
+    def test_whiteouts(self):
+        recorder, inner = self.instrumented(self.make_tree(stacking.MemoryFS()))
+        whiteout_fs = stacking.WhiteoutFS(stacking.MemoryWhiteoutCache(), live_dirs_cache_size=0, wrapped=inner)
+        fs = fslib.FileSystem(whiteout_fs)
+        fs.remove('/a/b/1')
+        recorder.reset()
+
+        paths = ['/a/b/%d' % i for i in range(5)] + ['/a/f', '/a/f/sub']
+        results = fs.stat_many(paths)
+        self.assertEqual(errno.ENOENT, results[1].errno)
+        self.assertEqual(errno.ENOTDIR, results[6].errno)
+        self.assertEqual([True, False, True, True, True, True, False], fs.exists_many(paths))
+        # Each batch checks /, /a, /a/b and /a/f once, then stats the visible paths at once.
+        self.assertEqual(2, self.calls(recorder, 'stat_many'))
+        self.assertEqual(8, self.calls(recorder, 'stat'))
+
+        fs.rmtree('/a/b')
+        self.assertEqual([False] * 5, fs.exists_many(paths[:5]))
+
+    def test_union(self):
+        lower_recorder, lower = self.instrumented(self.make_tree(stacking.MemoryFS()))
+        union = stacking.UnionFS(cache_size=1024)
+        union.add_branch(lower, ref='lower', rank=1)
+        union.add_branch(make_fake(), ref='upper', rank=0, writable=True)
+        fs = fslib.FileSystem(union)
+        fs.writelines('/a/b/0', ['upper'])
+        fs.writelines('/a/new', [''])
+        union._resolution_cache.clear()
+        lower_recorder.reset()
+
+        paths = ['/a/b/0', '/a/b/1', '/a/b/2', '/a/new', '/missing']
+        results = fs.stat_many(paths)
+        self.assertEqual([6, 1, 1, 1], [result.st_size for result in results[:4]])
+        self.assertEqual(errno.ENOENT, results[4].errno)
+        # The lower branch only sees the paths missing from the upper one, at once.
+        self.assertEqual(1, self.calls(lower_recorder, 'stat_many'))
+        self.assertEqual(0, self.calls(lower_recorder, 'stat'))
+
+        # Resolutions are cached for later lookups.
+        for path in paths[:4]:
+            self.assertIn(path, union._resolution_cache)
+        self.assertEqual([True] * 4, fs.exists_many(paths[:4]))
+        self.assertEqual(1, self.calls(lower_recorder, 'stat_many'))
+
+    def test_mount(self):
+        root_recorder, root = self.instrumented(self.make_tree(stacking.MemoryFS()))
+        mnt_recorder, mnt = self.instrumented(self.make_tree(stacking.MemoryFS()))
+        fslib.FileSystem(root).makedirs('/mnt')
+        mount_fs = stacking.MountFS()
+        mount_fs.mount_fs(root, '/')
+        mount_fs.mount_fs(mnt, '/mnt')
+        fs = fslib.FileSystem(mount_fs)
+        root_recorder.reset()
+        mnt_recorder.reset()
+
+        paths = ['/a/f', '/mnt/a/f', '/a/b/0', '/mnt/missing', '/mnt/a/b/0']
+        self.assertEqual([True, True, True, False, True], fs.exists_many(paths))
+        # One batch for each mounted filesystem
+        self.assertEqual(1, self.calls(root_recorder, 'stat_many'))
+        self.assertEqual(1, self.calls(mnt_recorder, 'stat_many'))
+
+
+class MemoryFSFileTests(unittest.TestCase):
+    def setUp(self):
+        self.fs = fslib.FileSystem(stacking.MemoryFS(default_umask=0o777))
+        with self.fs.open('/f', 'wb') as f:
+            f.write(b'0123456789')
+
+    def read(self):
+        with self.fs.open('/f', 'rb') as f:
+            return f.read()
+
+    def test_positions(self):
+        with self.fs.open('/f', 'rb') as first, self.fs.open('/f', 'rb') as second:
+            self.assertEqual(b'012', first.read(3))
+            self.assertEqual(b'01', second.read(2))
+            self.assertEqual(b'345', first.read(3))
+            self.assertEqual(6, first.tell())
+        with self.fs.open('/f', 'r+b') as writer, self.fs.open('/f', 'rb') as reader:
+            writer.seek(5)
+            writer.write(b'XY')
+            writer.flush()
+            self.assertEqual(b'01234XY789', reader.read())
+
+    def test_truncate_on_write(self):
+        with self.fs.open('/f', 'wb') as f:
+            f.write(b'new')
+        self.assertEqual(b'new', self.read())
+        with self.fs.open('/f', 'w') as f:
+            pass
+        self.assertEqual(b'', self.read())
+        self.assertEqual(0, self.fs.stat('/f').st_size)
+
+    def test_append(self):
+        with self.fs.open('/f', 'ab') as f:
+            f.write(b'ab')
+            f.seek(0)
+            # Appends ignore the position
+            f.write(b'cd')
+        self.assertEqual(b'0123456789abcd', self.read())
+        with self.fs.open('/f', 'a+b') as f:
+            f.seek(0)
+            self.assertEqual(b'0123', f.read(4))
+
+    def test_chmod_keeps_type(self):
+        self.fs.mkdir('/d')
+        self.fs.symlink('/l', '/f')
+        for path in ('/f', '/d'):
+            self.fs.chmod(path, 0o700)
+        self.assertEqual(stat.S_IFREG | 0o700, self.fs.stat('/f').st_mode)
+        self.assertEqual(stat.S_IFDIR | 0o700, self.fs.stat('/d').st_mode)
+        self.assertTrue(self.fs.dir_exists('/d'))
+        self.assertTrue(self.fs.symlink_exists('/l'))
+        self.assertEqual(b'0123456789', self.read())
+
+
+class MemoryFSIndexTests(unittest.TestCase):
+    def make_filesystems(self):
+        return [stacking.MemoryFS(default_umask=0o777, full_path_index=index) for index in (True, False)]
+
+    def test_lookups(self):
+        for memory_fs in self.make_filesystems():
+            with self.subTest(full_path_index=memory_fs._full_map is not None):
+                fs = fslib.FileSystem(memory_fs)
+                fs.makedirs('/a/b/c')
+                fs.writelines('/a/b/c/f', ['f'])
+                fs.symlink('/a/link', '/a/b/c/f')
+                self.assertEqual(['f'], list(fs.readlines('/a/link')))
+                self.assertTrue(fs.file_exists('/a/b/c/f'))
+                self.assertFalse(fs.file_exists('/a/b/c/f/x'))
+                self.assertFalse(fs.file_exists('/a/missing/f'))
+
+                fs.remove('/a/b/c/f')
+                memory_fs.rmdir('/a/b/c')
+                self.assertEqual([], fs.listdir('/a/b'))
+                with self.assertRaises(FileNotFoundError):
+                    fs.stat('/a/link')
+
+    def test_replaced_dir(self):
+        for memory_fs in self.make_filesystems():
+            with self.subTest(full_path_index=memory_fs._full_map is not None):
+                fs = fslib.FileSystem(memory_fs)
+                fs.makedirs('/a/b')
+                fs.writelines('/a/b/f', ['f'])
+                # Replaced by an empty directory, as through WhiteoutFS
+                fs.mkdir('/a')
+                self.assertEqual([], fs.listdir('/a'))
+                self.assertFalse(fs.dir_exists('/a/b'))
+                self.assertFalse(fs.file_exists('/a/b/f'))
+                if memory_fs._full_map is not None:
+                    self.assertEqual(['/', '/a'], sorted(memory_fs._full_map))
+
+    def test_fork(self):
+        memory_fs = stacking.MemoryFS(default_umask=0o777)
+        fs = fslib.FileSystem(memory_fs)
+        fs.makedirs('/a/b')
+        clone = memory_fs.fork()
+        self.assertIsNone(clone._full_map)
+        fslib.FileSystem(clone).writelines('/a/b/f', ['f'])
+        self.assertEqual(['f'], clone.listdir('/a/b'))
+        self.assertEqual([], fs.listdir('/a/b'))
+
+
+class MemoryFSContentTests(unittest.TestCase):
+    def setUp(self):
+        self.memory_fs = stacking.MemoryFS(default_umask=0o777)
+        self.fs = fslib.FileSystem(self.memory_fs)
+
+    def node(self, path):
+        return self.memory_fs._lookup(path)
+
+    def test_lazy(self):
+        self.fs.writelines('/empty', [])
+        self.assertIsNone(self.node('/empty')._content)
+        self.assertEqual(0, self.fs.stat('/empty').st_size)
+        with self.fs.open('/empty', 'rb') as f:
+            self.assertEqual(b'', f.read())
+        # Still not allocated by reads
+        self.assertIsNone(self.node('/empty')._content)
+
+    def test_truncate(self):
+        with self.fs.open('/f', 'wb') as f:
+            f.write(b'0123456789')
+        self.assertIsNotNone(self.node('/f')._content)
+        with self.fs.open('/f', 'r+b') as f:
+            f.truncate(4)
+        self.assertEqual(4, self.fs.stat('/f').st_size)
+        self.assertIsNotNone(self.node('/f')._content)
+        with self.fs.open('/f', 'r+b') as f:
+            f.truncate(0)
+        # The buffer is released
+        self.assertIsNone(self.node('/f')._content)
+        self.assertEqual(0, self.fs.stat('/f').st_size)
+
+        with self.fs.open('/f', 'wb') as f:
+            f.write(b'again')
+        with self.fs.open('/f', 'wb'):
+            pass
+        self.assertIsNone(self.node('/f')._content)
+
+    def test_truncate_forked(self):
+        with self.fs.open('/f', 'wb') as f:
+            f.write(b'0123456789')
+        clone = fslib.FileSystem(self.memory_fs.fork())
+        with clone.open('/f', 'r+b') as f:
+            f.truncate(0)
+        with clone.open('/g', 'wb') as f:
+            f.write(b'')
+        self.assertEqual(0, clone.stat('/f').st_size)
+        with self.fs.open('/f', 'rb') as f:
+            self.assertEqual(b'0123456789', f.read())
+
+
+class MemoryFSSpillTests(unittest.TestCase):
+    def test_round_trip(self):
+        memory_fs = stacking.MemoryFS(memory_budget=100 * 1024)
+        fs = fslib.FileSystem(memory_fs)
+        contents = {'/f%d' % i: os.urandom(10 * 1024 + i) for i in range(30)}
+        for path, content in contents.items():
+            with fs.open(path, 'wb') as f:
+                f.write(content)
+        info = memory_fs.memory_info()
+        self.assertLessEqual(info.resident, 100 * 1024)
+        self.assertGreater(info.spilled, 0)
+
+        for path, content in contents.items():
+            with fs.open(path, 'rb') as f:
+                self.assertEqual(content, f.read())
+            self.assertEqual(len(content), fs.stat(path).st_size)
+        with fs.open('/f0', 'ab') as f:
+            f.write(b'tail')
+        with fs.open('/f0', 'rb') as f:
+            self.assertEqual(contents['/f0'] + b'tail', f.read())
+
+    def test_dead_content(self):
+        store = stacking._ContentStore(budget=10)
+        first = store.add(io.BytesIO(b'x' * 8))
+        # Dead, with its callback not run yet
+        store._refs[first.key] = lambda: None
+        second = store.add(io.BytesIO(b'y' * 8))
+        self.assertEqual(8, store.resident_bytes)
+        self.assertEqual(0, store.spilled_bytes)
+        store._forget(first.key, None)
+        self.assertEqual(8, store.resident_bytes)
+        self.assertEqual(b'y' * 8, store.load(second).getvalue())
+
+
+class MemoryFSForkTests(unittest.TestCase):
+    def make_tree(self, **kwargs):
+        memory_fs = stacking.MemoryFS(default_umask=0o777, **kwargs)
+        fs = fslib.FileSystem(memory_fs)
+        fs.makedirs('/a/b')
+        fs.writelines('/a/b/f', ['one'])
+        fs.writelines('/a/g', ['g'])
+        return memory_fs, fs
+
+    def test_fork(self):
+        for full_path_index in (True, False):
+            with self.subTest(full_path_index=full_path_index):
+                memory_fs, fs = self.make_tree(full_path_index=full_path_index)
+                fork = fslib.FileSystem(memory_fs.fork())
+
+                fs.writelines('/a/b/f', ['two'])
+                fs.remove('/a/g')
+                fs.mkdir('/a/c')
+                self.assertEqual(['one'], list(fork.readlines('/a/b/f')))
+                self.assertEqual(['b', 'g'], sorted(fork.listdir('/a')))
+
+                with fork.open('/a/b/f', 'ab') as f:
+                    f.write(b'fork\n')
+                fork.mkdir('/a/k')
+                self.assertEqual(['two'], list(fs.readlines('/a/b/f')))
+                self.assertEqual(['b', 'c'], sorted(fs.listdir('/a')))
+                self.assertEqual(['one', 'fork'], list(fork.readlines('/a/b/f')))
+                self.assertEqual(['b', 'g', 'k'], sorted(fork.listdir('/a')))
+
+    def test_fork_of_fork(self):
+        memory_fs, _fs = self.make_tree()
+        fork = memory_fs.fork()
+        fork_of_fork = fslib.FileSystem(fork.fork())
+        fork_of_fork.remove('/a/g')
+        self.assertEqual(['b', 'g'], sorted(fslib.FileSystem(fork).listdir('/a')))
+        self.assertEqual(['b'], fork_of_fork.listdir('/a'))
+
+    def test_snapshot(self):
+        memory_fs, fs = self.make_tree()
+        snapshot = fslib.FileSystem(memory_fs.snapshot())
+        fs.writelines('/a/b/f', ['two'])
+        self.assertEqual(['one'], list(snapshot.readlines('/a/b/f')))
+        with self.assertRaises(OSError):
+            snapshot.writelines('/a/x', ['no'])
+
+
+class MemoryFSImageTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.image = os.path.join(tmp.name, 'image')
+
+    def tree(self, fs):
+        entries = []
+        for dirpath, dirnames, filenames in fs.walk('/'):
+            for name in dirnames + filenames:
+                path = posixpath.join(dirpath, name)
+                stats = fs.lstat(path)
+                if fs.symlink_exists(path):
+                    content = fs.readlink(path)
+                elif fs.file_exists(path):
+                    with fs.open(path, 'rb') as f:
+                        content = f.read()
+                else:
+                    content = None
+                entries.append((path, stats.st_mode, stats.st_size, stats.st_mtime, content))
+        return sorted(entries)
+
+    def test_save_load(self):
+        memory_fs = stacking.MemoryFS(default_umask=0o777)
+        fs = fslib.FileSystem(memory_fs)
+        fs.makedirs('/a/b/c')
+        fs.makedirs('/é/d')
+        for i in range(10):
+            with fs.open('/a/b/f%d' % i, 'wb') as f:
+                f.write(os.urandom(i * 100))
+        fs.writelines('/é/d/txt', ['héllo'])
+        fs.symlink('/a/l', '/é/d/txt')
+        fs.chmod('/a/b/c', 0o700)
+        memory_fs.save(self.image)
+
+        for full_path_index in (True, False):
+            for memory_budget in (None, 500):
+                with self.subTest(full_path_index=full_path_index, memory_budget=memory_budget):
+                    loaded = stacking.MemoryFS.load(
+                        self.image, default_umask=0o777,
+                        full_path_index=full_path_index, memory_budget=memory_budget,
+                    )
+                    loaded_fs = fslib.FileSystem(loaded)
+                    self.assertEqual(self.tree(fs), self.tree(loaded_fs))
+
+                    with loaded_fs.open('/a/b/f5', 'ab') as f:
+                        f.write(b'!')
+                    with fs.open('/a/b/f5', 'rb') as f:
+                        original = f.read()
+                    with loaded_fs.open('/a/b/f5', 'rb') as f:
+                        self.assertEqual(original + b'!', f.read())
+
+    def test_load_invalid(self):
+        for data in (b'', b'not an image'):
+            with open(self.image, 'wb') as f:
+                f.write(data)
+            with self.assertRaises(fslib.FSError):
+                stacking.MemoryFS.load(self.image)
+
+    def test_load_truncated(self):
+        memory_fs = stacking.MemoryFS()
+        fslib.FileSystem(memory_fs).writelines('/f', ['x'])
+        memory_fs.save(self.image)
+        with open(self.image, 'r+b') as f:
+            f.truncate(os.path.getsize(self.image) - 1)
+        with self.assertRaises(fslib.FSError):
+            stacking.MemoryFS.load(self.image)
+
+    def test_load_corrupt(self):
+        memory_fs = stacking.MemoryFS()
+        fs = fslib.FileSystem(memory_fs)
+        fs.makedirs('/d')
+        fs.writelines('/d/f', ['x'])
+        fs.symlink('/l', '/d/f')
+        memory_fs.save(self.image)
+        with open(self.image, 'rb') as f:
+            image = f.read()
+        _magic, _version, count, records_offset, _names_size, _reserved = stacking._IMAGE_HEADER.unpack_from(image)
+        # Depth-first: /, /d, /d/f, /l
+        records = [list(record) for record in stacking._IMAGE_NODE.iter_unpack(
+            image[records_offset:records_offset + count * stacking._IMAGE_NODE.size])]
+
+        corruptions = {
+            'root type': (0, 1, stat.S_IFREG | 0o644),
+            'parent after': (1, 0, 3),
+            'parent out of range': (3, 0, 2 ** 32 - 1),
+            'parent is a file': (3, 0, 2),
+            'name out of bounds': (2, 7, 2 ** 40),
+            'empty name': (2, 8, 0),
+            'duplicate name': (3, 7, records[1][7]),
+            'data out of bounds': (2, 9, len(image)),
+            'data before contents': (2, 9, 0),
+            'data size': (3, 10, 2 ** 40),
+        }
+        for label, (index, field, value) in corruptions.items():
+            with self.subTest(label):
+                record = list(records[index])
+                record[field] = value
+                if label == 'duplicate name':
+                    record[8] = records[1][8]
+                    record[0] = 0
+                offset = records_offset + index * stacking._IMAGE_NODE.size
+                with open(self.image, 'wb') as f:
+                    f.write(image[:offset] + stacking._IMAGE_NODE.pack(*record)
+                            + image[offset + stacking._IMAGE_NODE.size:])
+                with self.assertRaises(fslib.FSError):
+                    stacking.MemoryFS.load(self.image)
+
+        # The untouched image loads fine
+        with open(self.image, 'wb') as f:
+            f.write(image)
+        self.assertEqual(['x'], list(fslib.FileSystem(stacking.MemoryFS.load(self.image)).readlines('/l')))
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2020 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import errno
+import os
+import tempfile
+import unittest
+
+import fslib
+from fslib import base
+from fslib import stacking
+
+
+class DBMWhiteoutCacheTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'whiteouts')
+
+    def open_cache(self, **kwargs):
+        cache = stacking.DBMWhiteoutCache(self.path, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_buffered(self):
+        cache = self.open_cache(max_pending=10, flush_interval=None)
+        for i in range(5):
+            cache.add('/a/%d' % i)
+        self.assertIn('/a/3', cache)
+        self.assertEqual({'0', '1', '2', '3', '4'}, set(cache.children('/a')))
+        self.assertEqual([], cache.storage.keys())
+        cache.flush()
+        self.assertEqual(5, len(cache.storage.keys()))
+
+    def test_write_through(self):
+        cache = self.open_cache()
+        cache.add('/a')
+        self.assertEqual([b'/a'], cache.storage.keys())
+        del cache['/a']
+        self.assertEqual([], cache.storage.keys())
+
+    def test_reopen(self):
+        cache = self.open_cache()
+        cache.add('/a')
+        cache.add('/b')
+        del cache['/a']
+        cache.close()
+        cache = self.open_cache()
+        self.assertNotIn('/a', cache)
+        self.assertIn('/b', cache)
+
+    def test_remove_missing(self):
+        cache = self.open_cache(flush_interval=None)
+        del cache['/a']
+        self.assertNotIn('/a', cache)
+        # Nothing to write
+        self.assertEqual({}, cache._pending)
+
+    def test_journal_replay(self):
+        cache = self.open_cache(max_pending=100, flush_interval=None)
+        cache.add('/a')
+        cache.flush()
+        # A crash after writing the journal, before applying it
+        cache._write_journal([(b'/b', True), (b'/a', False)])
+        cache.storage.close()
+
+        cache = self.open_cache()
+        self.assertIn('/b', cache)
+        self.assertNotIn('/a', cache)
+        self.assertFalse(os.path.exists(cache.journal_path))
+
+
+class BloomWhiteoutCacheTests(unittest.TestCase):
+    def test_lookups(self):
+        wrapped = stacking.MemoryWhiteoutCache()
+        wrapped.add('/old')
+        cache = stacking.BloomWhiteoutCache(wrapped)
+        self.assertIn('/old', cache)
+        cache.add('/a')
+        self.assertIn('/a', cache)
+        self.assertIn('/a', wrapped)
+        self.assertNotIn('/b', cache)
+        del cache['/a']
+        self.assertNotIn('/a', cache)
+        self.assertNotIn('/a', wrapped)
+        self.assertEqual(['/old'], list(cache.keys()))
+
+    def test_grow(self):
+        cache = stacking.BloomWhiteoutCache(stacking.MemoryWhiteoutCache(), capacity=10)
+        for i in range(25):
+            cache.add('/%d' % i)
+        self.assertEqual(40, cache.info().capacity)
+        for i in range(25):
+            self.assertIn('/%d' % i, cache)
+
+    def test_remove_missing(self):
+        cache = stacking.BloomWhiteoutCache(stacking.MemoryWhiteoutCache(), capacity=10)
+        cache.add('/a')
+        bloom = cache._filter
+        for i in range(100):
+            del cache['/%d' % i]
+        # No rebuild
+        self.assertIs(bloom, cache._filter)
+        self.assertIn('/a', cache)
+
+    def test_subtrees(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            wrapped = stacking.SQLiteWhiteoutCache(os.path.join(tmp, 'whiteouts'))
+            with self.assertRaises(ValueError):
+                stacking.BloomWhiteoutCache(wrapped)
+            wrapped.close()
+
+
+class WhiteoutFSTests(unittest.TestCase):
+    def make_caches(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        sqlite_cache = stacking.SQLiteWhiteoutCache(os.path.join(tmp.name, 'whiteouts'))
+        self.addCleanup(sqlite_cache.close)
+        return [stacking.MemoryWhiteoutCache(), sqlite_cache]
+
+    def make_fs(self, whiteout_cache):
+        memory_fs = stacking.MemoryFS()
+        wrapped = fslib.FileSystem(memory_fs)
+        wrapped.makedirs('/a/b/c')
+        wrapped.makedirs('/a/d')
+        for path in ('/a/x', '/a/b/y', '/a/b/c/z', '/top'):
+            wrapped.writelines(path, [''])
+        return fslib.FileSystem(stacking.WhiteoutFS(whiteout_cache, wrapped=memory_fs))
+
+    def test_unlink(self):
+        for cache in self.make_caches():
+            with self.subTest(cache=cache):
+                fs = self.make_fs(cache)
+                fs.remove('/a/x')
+                self.assertFalse(fs.file_exists('/a/x'))
+                self.assertEqual(['b', 'd'], sorted(fs.listdir('/a')))
+                fs.writelines('/a/x', ['again'])
+                self.assertEqual(['again'], list(fs.readlines('/a/x')))
+
+    def test_rmtree(self):
+        for cache in self.make_caches():
+            with self.subTest(cache=cache):
+                fs = self.make_fs(cache)
+                fs.rmtree('/a/b')
+                self.assertEqual(['d', 'x'], sorted(fs.listdir('/a')))
+                self.assertFalse(fs.dir_exists('/a/b'))
+                with self.assertRaises(OSError) as context:
+                    fs.stat('/a/b/c/z')
+                self.assertEqual(errno.ENOENT, context.exception.errno)
+
+                # Created again, empty
+                fs.mkdir('/a/b')
+                self.assertEqual([], fs.listdir('/a/b'))
+                fs.writelines('/a/b/new', [''])
+                self.assertEqual(['new'], fs.listdir('/a/b'))
+                self.assertFalse(fs.file_exists('/a/b/y'))
+                fs.mkdir('/a/b/c')
+                self.assertEqual([], fs.listdir('/a/b/c'))
+
+                fs.rmtree('/a')
+                self.assertEqual(['top'], fs.listdir('/'))
+
+    def test_subtree_rows(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cache = stacking.SQLiteWhiteoutCache(os.path.join(tmp.name, 'whiteouts'))
+        self.addCleanup(cache.close)
+        fs = self.make_fs(cache)
+        fs.remove('/a/x')
+        fs.rmtree('/a/b')
+        self.assertEqual({'b', 'x'}, set(cache.children('/a')))
+        fs.rmtree('/a')
+        # A single row hides everything
+        self.assertEqual(['/a'], list(cache.keys()))
+        self.assertEqual({'a'}, set(cache.children('/')))
+        with self.assertRaises(NotImplementedError):
+            # Covered by a subtree whiteout
+            cache.children('/a')
+        self.assertEqual({'b'}, cache.hidden_children('/a', ['b', 'other']) & {'b'})
+
+    def test_unlink_symlink(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        os.makedirs(os.path.join(tmp.name, 'real', 'sub'))
+        open(os.path.join(tmp.name, 'real', 'sub', 'x'), 'w').close()
+        os.symlink('real', os.path.join(tmp.name, 'link'))
+        whiteout_fs = stacking.WhiteoutFS(stacking.MemoryWhiteoutCache(), wrapped=base.OSFS(tmp.name))
+        fs = fslib.FileSystem(whiteout_fs)
+
+        fs.stat('/link/sub/x')
+        self.assertIn('/link/sub', whiteout_fs._live_dirs)
+        whiteout_fs.unlink('/link')
+        self.assertNotIn('/link/sub', whiteout_fs._live_dirs)
+        with self.assertRaises(OSError) as context:
+            fs.stat('/link/sub/x')
+        self.assertEqual(errno.ENOENT, context.exception.errno)
+        fs.stat('/real/sub/x')
+
+    def test_close(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cache = stacking.DBMWhiteoutCache(os.path.join(tmp.name, 'whiteouts'), max_pending=10, flush_interval=None)
+        whiteout_fs = stacking.WhiteoutFS(cache, wrapped=stacking.MemoryFS())
+        whiteout_fs.close()
+        # Closed once: the cache can't flush twice
+        whiteout_fs.close()
+        del whiteout_fs
+
+    def test_init_failed(self):
+        class FailingWhiteoutFS(stacking.WhiteoutFS):
+            def __init__(self):
+                raise ValueError()
+
+        with self.assertRaises(ValueError):
+            FailingWhiteoutFS()
+        # __del__ doesn't raise on the partly built instance
+        stacking.WhiteoutFS.__del__(FailingWhiteoutFS.__new__(FailingWhiteoutFS))